@@ -1,10 +1,8 @@
 import json
-import duckdb
 import pandas as pd
-import pyarrow as pa
 import copy
 import zipfile
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import gzip
 import os
 from tqdm import tqdm
@@ -89,28 +87,6 @@ class PubChemDB(ABCChemDB):
             5: 'probe'
         }
         
-        # If outcome is not able to be cast to an integer, set to NULL. If it is not a registered INT set to NULL
-        self.activity_map_sql_query = f'''
-            SELECT
-            CASE
-                WHEN TRY_CAST(outcome AS INTEGER) IS NULL THEN NULL
-                WHEN outcome = 1 THEN '{self._activity_map[1]}'
-                WHEN outcome = 2 THEN '{self._activity_map[2]}'
-                WHEN outcome = 3 THEN '{self._activity_map[3]}'
-                WHEN outcome = 4 THEN '{self._activity_map[4]}'
-                WHEN outcome = 5 THEN '{self._activity_map[5]}'
-                ELSE NULl
-            END AS Activity
-            FROM data_table;
-        '''
-        
-        self.__results_schema = pa.schema([
-            pa.field('tid', pa.int64()),
-            pa.field('name', pa.string()),
-            pa.field('unit', pa.int64()),
-            pa.field('sunit', pa.string())
-        ])
-        
         self.__possible_non_tid_bioassay_columns = [ # sourced from: \
             # https://ftp.ncbi.nlm.nih.gov/pubchem/Bioassay/pcassay2.asn
             'sid',
@@ -136,6 +112,12 @@ class PubChemDB(ABCChemDB):
         ########## Connect to DB ##########
         self.conn = sqlite3.connect('pubchem_temp.db')
         self.cur = self.conn.cursor()
+        # Bulk load settings: WAL lets readers work during the build and commits append to the log, synchronous \
+            # NORMAL only syncs at checkpoints, temporary b-trees (index builds) stay in memory
+        self.cur.execute('PRAGMA journal_mode = WAL')
+        self.cur.execute('PRAGMA synchronous = NORMAL')
+        self.cur.execute('PRAGMA temp_store = MEMORY')
+        self.cur.execute('PRAGMA cache_size = -262144') # KiB, 256 MB
         # TODO: Functionality for building a new DB called 'pubchem_temp' or wtvr
     
     @property
@@ -162,10 +144,6 @@ class PubChemDB(ABCChemDB):
         """
         return copy.deepcopy(self.__activity_map)
 
-    @property
-    def _results_schema(self) -> pa.lib.Schema:
-        return copy.deepcopy(self.__results_schema)
-    
     @property
     def _possible_non_tid_bioassay_columns(self) -> List[str]:
         """
@@ -215,54 +193,100 @@ class PubChemDB(ABCChemDB):
         df = pd.read_csv(path, delimiter='\t')
         df.to_sql('protein', self.conn, if_exists='replace', index=False)
         
-    def _build_bioassay_table(self) -> None:
+    def _build_bioassay_table(self, batch_size:int=100000) -> None:
+        """
+        Builds the bioassay tables in a fixed long format, so no bioassay changes the schema whatever its result
+        columns (TIDs) are:
+            bioassay_entry: one row per substance entry with data, holding the columns any entry can have
+            bioassay_result_column: name (with unit) of each TID of a bioassay
+            bioassay_value: one row per entry and TID, SQLite stores each value with its own type
+        Rows are inserted with executemany in batches of about batch_size values, all in one transaction.
+
+        :param batch_size: Number of values to collect before inserting, defaults to 100000
+        :type batch_size: int, optional
+        """
         self._clear_bioassay_target_relationship_table_and_specify_schema() # create table but don't yet populate
+        self._clear_bioassay_tables_and_specify_schema()
         
-        # Remove existing tables
-        self.cur.execute('DROP TABLE IF EXISTS bioassay')
-        
-        first_bioassay_flag_for_alter_table = True # if True, don't need to alter table to add new columns
-            # initial schema = schema for first bioassay
-        for zip_dir in tqdm(os.listdir(self.json_dir_path)): # NOTE: Limit to just first few for testing
+        entry_rows, result_column_rows, value_rows, target_rows = [], [], [], []
+        zip_dirs = sorted(zip_dir for zip_dir in os.listdir(self.json_dir_path) if zip_dir.endswith('.zip'))
+        for zip_dir in tqdm(zip_dirs):
             loader = PubChemDB._read_one_bioassay_zip_dir(os.path.join(self.json_dir_path, zip_dir),
                                                           print_filename=False)
             
-            for json in loader: # (batch_size) bioassays at a time
-                # for json in batch:
-                table = self._format_bioassay_and_store_in_table(json)
+            for json in loader:
+                rows = self._bioassay_rows(json)
                 
-                if not table: # table is None
+                if not rows: # rows is None
                     continue
                 
-                if not first_bioassay_flag_for_alter_table:
-                    existing_columns = [x[1] for x in self.conn.execute(f'PRAGMA table_info(bioassay)').fetchall()]
-                    print(len(existing_columns))
-                    
-                    for column in table.column_names:
-                        if column not in existing_columns:
-                            column_type = table.schema.field(column).type
-                            
-                            # print(column)
-                            # print(sanitize_column_name(column))
-                            # print(table.to_pandas())
-                            # print(f"ALTER TABLE bioassay ADD COLUMN '{column}' \
-                            #     {column_type}")
-                            self.conn.execute(f'ALTER TABLE bioassay ADD COLUMN "{column}" \
-                                {column_type}')
-
-                table.to_pandas().to_sql('bioassay', self.conn, if_exists='append', index=False)
-                first_bioassay_flag_for_alter_table = False
-                
-                # self.cur.execute('SELECT * FROM bioassay')
-                # rows = self.cur.fetchall()
-
-                # # Print the table contents
-                # for row in rows[:100]:
-                #     print(row)   
+                entry_rows.extend(rows[0])
+                result_column_rows.extend(rows[1])
+                value_rows.extend(rows[2])
+                target_rows.extend(rows[3])
+                if len(value_rows) >= batch_size:
+                    self._insert_bioassay_rows(entry_rows, result_column_rows, value_rows, target_rows)
+                    entry_rows, result_column_rows, value_rows, target_rows = [], [], [], []
                 
                 # TODO: Add targets as a column
+        
+        self._insert_bioassay_rows(entry_rows, result_column_rows, value_rows, target_rows)
+        
+        # Index after loading, maintaining it during the inserts would be slower
+        self.cur.execute('CREATE INDEX bioassay_entry_sid ON bioassay_entry (sid)')
+        self.conn.commit()
+        
+    def _clear_bioassay_tables_and_specify_schema(self) -> None:
+        # Remove existing tables, including the wide bioassay table this schema replaces
+        for table in ['bioassay', 'bioassay_entry', 'bioassay_result_column', 'bioassay_value']:
+            self.cur.execute(f'DROP TABLE IF EXISTS {table}')
+        
+        # Inserted in primary key order, so WITHOUT ROWID tables are appended to rather than reshuffled
+        self.cur.execute('''
+            CREATE TABLE bioassay_entry (
+                bioassay_id INTEGER,
+                entry INTEGER,  -- position in the bioassay data, a substance can be tested more than once
+                sid INTEGER,
+                sid_source INTEGER,
+                version INTEGER,
+                comment TEXT,
+                activity TEXT,
+                rank INTEGER,
+                url TEXT,
+                xref TEXT,  -- JSON
+                date TEXT,  -- JSON
+                PRIMARY KEY (bioassay_id, entry)
+            ) WITHOUT ROWID
+        ''')
+        self.cur.execute('''
+            CREATE TABLE bioassay_result_column (
+                bioassay_id INTEGER,
+                tid INTEGER,
+                name TEXT,
+                PRIMARY KEY (bioassay_id, tid)
+            ) WITHOUT ROWID
+        ''')
+        self.cur.execute('''
+            CREATE TABLE bioassay_value (
+                bioassay_id INTEGER,
+                entry INTEGER,
+                tid INTEGER,
+                value,  -- no declared type, numbers and text are both stored as is
+                PRIMARY KEY (bioassay_id, entry, tid)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.commit()
+        
+    def _insert_bioassay_rows(self, entry_rows:List[tuple], result_column_rows:List[tuple], value_rows:List[tuple],
+                              target_rows:List[tuple]) -> None:
+        """ Inserts rows from _bioassay_rows, the transaction is left open for the rest of the build. """
+        self.cur.executemany('INSERT INTO bioassay_entry VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', entry_rows)
+        self.cur.executemany('INSERT OR REPLACE INTO bioassay_result_column VALUES (?, ?, ?)', result_column_rows)
+        # A TID repeated within an entry keeps its last value, as when the entry was a dict of columns
+        self.cur.executemany('INSERT OR REPLACE INTO bioassay_value VALUES (?, ?, ?, ?)', value_rows)
+        self.cur.executemany('INSERT INTO bioassay_target_relationship (bioassay_id, uniprot_id) VALUES (?, ?)',
+                             target_rows)
                 
-                # TODO: Add functionality to store in database
                 
     def _clear_bioassay_target_relationship_table_and_specify_schema(self):
         # Remove existing tables
@@ -324,69 +348,68 @@ class PubChemDB(ABCChemDB):
     
                 yield json.loads(contents_str)
                 
-    def _format_bioassay_and_store_in_table(self, file_json:dict, protein_only:bool=True) -> pa.lib.Table:
+    def _bioassay_rows(self, file_json:dict, protein_only:bool=True) -> Optional[Tuple[List[tuple], List[tuple],
+                                                                                      List[tuple], List[tuple]]]:
         """
-        Formats a single PubChem FTP JSON (unzipped) file into a pyarrow table similar to that found in PubChem Web
+        Formats a single PubChem FTP JSON (unzipped) file into rows of the long bioassay tables, see
+        _build_bioassay_table
 
         :param file_json: Loaded JSON file
         :type file_json: dict
-        :return: Formatted pyarrow table
-        :rtype: pa.lib.Table
+        :param protein_only: Whether to skip bioassays whose target is not a protein, defaults to True
+        :type protein_only: bool, optional
+        :return: Rows of bioassay_entry, bioassay_result_column, bioassay_value and bioassay_target_relationship,
+            None if the bioassay has no data or is skipped
+        :rtype: Optional[Tuple[List[tuple], List[tuple], List[tuple], List[tuple]]]
         """
-        ########## Get raw data and results nested within file_json ##########
+        ########## Get raw data and results nested within file_json, read only so not copied ##########
+        descr = file_json['PC_AssaySubmit']['assay']['descr']
+        if 'data' not in file_json['PC_AssaySubmit'] or 'results' not in descr:
+            return None
         try:
-            raw_data = PubChemDB._get_raw_data_from_file_json(file_json)
-            raw_results = PubChemDB._get_raw_results_from_file_json(file_json) # contains metadata
             formatted_target = self._format_raw_target(PubChemDB._get_raw_target_from_file_json(file_json))
-        except KeyError: # no data in file_json
+        except KeyError: # no target in file_json
             return None
+        bioassay_id = descr['aid']['id']
         
         ########## Check if target is protein ##########
+        target_rows = []
         if protein_only:
             if 'target_protein_accession' not in formatted_target.keys(): # not protein
                 return None
-            else:
-                bioassay_id = file_json['PC_AssaySubmit']['assay']['descr']['aid']['id']
-                self._populate_bioassay_target_relationship_table(bioassay_id,
-                                                                  formatted_target['target_protein_accession'])
-                
+            target_rows.append((bioassay_id, formatted_target['target_protein_accession']))
         
-        ########## Format raw data and results to PyArrow tables ##########
-        data_table = PubChemDB._format_raw_data_into_pa_table(raw_data)
-        results_table = pa.Table.from_pylist(raw_results, schema=self._results_schema)
+        ########## Add units to each column name, ex: value --> value, unit ##########
+        result_column_rows = []
+        for result in descr['results']:
+            name = result['name']
+            if result.get('unit') is not None:
+                name = f'{name}, {self.__unit_map[result["unit"]]}'
+            elif result.get('sunit') is not None:
+                name = f'{name}, {result["sunit"]}'
+            result_column_rows.append((bioassay_id, result['tid'], name.lower()))
         
-        ########## Add units to each column name, ex: value --> value (unit) ##########
-        results_table = self._add_units_to_results_table_col_names(results_table)
-            
-        ########## Replace integer codes in data_table w/ names in results_table by joining on TIDs ##########
-        non_tid_names = [i for i in self._possible_non_tid_bioassay_columns if i in data_table.column_names]
-        tid_integer_codes = [int(x) for x in data_table.column_names if x not in non_tid_names]
-        tid_names = [x[1] for x in
-                    duckdb.sql(f'SELECT * FROM results_table WHERE tid IN {tuple(tid_integer_codes)}').fetchall()]
-        data_table = data_table.rename_columns(non_tid_names + tid_names)
-
-        ########## Convert integer coded activity to strings w/ meaning (same format as PubChem) ##########
-        activity_col = pa.array(duckdb.sql(self.activity_map_sql_query).fetchall()).flatten()
-        data_table = data_table.append_column('Activity', activity_col)
-        # Remove old integer activity 'outcome' column
-        data_table = data_table.remove_column(data_table.column_names.index('outcome'))
-        
-        ########## Format target info and add as columns to data_table ##########
-        # for key, value in self._format_raw_target(raw_target).items():
-        #     column = pa.array([value] * len(data_table))
-        #     data_table = data_table.add_column(data_table.num_columns, key, column)
+        ########## One row per entry with data and one per value, activity as strings w/ meaning ##########
+        entry_rows = []
+        value_rows = []
+        for entry, sid_entry in enumerate(file_json['PC_AssaySubmit']['data']):
+            # NO DATA, skip
+            if 'data' not in sid_entry:
+                continue
+            entry_rows.append((bioassay_id, entry, sid_entry.get('sid'), sid_entry.get('sid_source'),
+                               sid_entry.get('version'), sid_entry.get('comment'),
+                               self.__activity_map.get(sid_entry.get('outcome')), sid_entry.get('rank'),
+                               sid_entry.get('url'), PubChemDB._json_or_none(sid_entry.get('xref')),
+                               PubChemDB._json_or_none(sid_entry.get('date'))))
+            for tid_data in sid_entry['data']:
+                value_rows.append((bioassay_id, entry, tid_data['tid'],
+                                   list(tid_data['value'].values())[0])) # list of one element
         
-        ########## Make the column names lowercase ##########
-        columns_lower = [column.lower() for column in data_table.column_names]
-        data_table = pa.Table.from_arrays(data_table.columns, schema=pa.schema([(column_lower, field.type) for
-                                                                                column_lower, field in
-                                                                                zip(columns_lower, data_table.schema)]))
-
-        return data_table
+        return entry_rows, result_column_rows, value_rows, target_rows
     
-    def _populate_bioassay_target_relationship_table(self, bioassay_id:int, uniprot_id:str) -> None:
-        self.cur.execute('INSERT INTO bioassay_target_relationship (bioassay_id, uniprot_id) VALUES (?, ?)',
-                         (bioassay_id, uniprot_id))
+    @staticmethod
+    def _json_or_none(value) -> Optional[str]:
+        return None if value is None else json.dumps(value)
                     
     @staticmethod
     def _get_raw_data_from_file_json(file_json:dict) -> dict:
@@ -442,60 +465,6 @@ class PubChemDB(ABCChemDB):
         else:
             raise KeyError('No target in file_json')
         
-    @staticmethod 
-    def _format_raw_data_into_pa_table(raw_data:dict) -> pa.lib.Table:
-        """
-        _summary_
-
-        :param data: Raw data info from JSON
-        :type data: dict
-        :return: Formatted table from the raw data
-        :rtype: pa.lib.Table
-        """
-        pylist = []
-        for sid_entry in raw_data:
-            # NO DATA, skip
-            if 'data' not in sid_entry.keys():
-                continue
-            sid_results = sid_entry.pop('data') # List of dicts
-
-            # Extract useful data for each TID
-            for i, tid_data in enumerate(sid_results):
-                tid_data.update({str(tid_data.pop('tid')): # use string TID as dict key
-                                list(tid_data.pop('value').values())[0]}) # list of one element
-                sid_results[i] = tid_data # over-write
-
-            # Convert list of dictionaries to single dict
-            sid_results = {k: v for d in sid_results for k, v in d.items()}
-
-            sid_entry.update(sid_results)
-            pylist.append(sid_entry)
-            
-        return pa.Table.from_pylist(pylist) # convert to table
-    
-    def _add_units_to_results_table_col_names(self, results_table:pa.lib.Table) -> pa.lib.Table:
-        """
-        Adds units to column names according to self.unit_map. ex: 'IC50' -> 'IC50, M'
-
-        :param results_table: PyArrow table containing PubChem results data
-        :type results_table: pa.lib.Table
-        :return: PyArrow table containing PubChem results data with units in column names
-        :rtype: pa.lib.Table
-        """
-        results_dict = results_table.to_pydict()
-
-        for i in range(len(results_table)):
-            unit = results_dict['unit'][i]
-            sunit = results_dict['sunit'][i]
-            name = results_dict['name'][i]
-
-            if unit is not None:
-                results_dict['name'][i] = f'{name}, {self._unit_map[unit]}'
-            elif sunit is not None:
-                results_dict['name'][i] = f'{name}, {sunit}'
-
-        return pa.Table.from_pydict(results_dict)
-    
     def _format_raw_target(self, raw_target:dict) -> dict:
         """
         Un-nests the 'mol_id' data and renames some keys to make them appropriate column names
@@ -0,0 +1,104 @@
+import argparse
+import statistics
+import time
+from typing import List
+import psycopg2
+
+
+# Per-target extraction as in PubChemQuery.get_bioassays_from_protein_accession, {fn} is json or jsonb
+TARGET_QUERY = '''
+    SELECT {fn}_array_elements(assay_data), bioassay_id, protein_accession
+    FROM {table}
+    WHERE protein_accession = %s AND assay_data IS NOT NULL AND {fn}_typeof(assay_data)='array'
+'''
+
+# Per-target SID extraction joined to SMILES as in ache_project.py
+TARGET_SMILES_QUERY = '''
+    SELECT entry, smiles, bioassay_id
+    FROM {table}
+    CROSS JOIN {fn}_array_elements(assay_data) AS entry
+    JOIN substance ON (entry->>'sid')::integer = substance_id
+    WHERE protein_accession = %s AND {fn}_typeof(assay_data)='array'
+'''
+
+# Bioassays testing a substance, only the JSONB table has an index for it
+SID_QUERIES = {
+    'json': '''
+        SELECT bioassay_id FROM {table}
+        WHERE json_typeof(assay_data)='array'
+            AND EXISTS (SELECT 1 FROM json_array_elements(assay_data) AS entry WHERE (entry->>'sid')::integer = %s)
+    ''',
+    'jsonb': '''
+        SELECT bioassay_id FROM {table}
+        WHERE jsonb_path_query_array(assay_data, '$[*].sid') @> to_jsonb(ARRAY[%s])
+    '''
+}
+
+
+def create_copies(cursor) -> None:
+    """ Temporary JSON and JSONB copies of bioassay with the indexes PubChemDB.migrate_assay_data_to_jsonb creates. """
+    for fn in ['json', 'jsonb']:
+        cursor.execute(f'''
+            CREATE TEMPORARY TABLE bioassay_{fn} AS
+            SELECT bioassay_id, protein_accession, assay_data::{fn} AS assay_data FROM bioassay
+        ''')
+        cursor.execute(f'CREATE INDEX ON bioassay_{fn} (protein_accession)')
+        cursor.execute(f'ANALYZE bioassay_{fn}')
+    cursor.execute('''
+        CREATE INDEX ON bioassay_jsonb USING GIN ((jsonb_path_query_array(assay_data, '$[*].sid')) jsonb_path_ops)
+    ''')
+
+def busiest_protein_accessions(cursor, n:int) -> List[str]:
+    cursor.execute('''
+        SELECT protein_accession FROM bioassay
+        WHERE protein_accession IS NOT NULL AND assay_data IS NOT NULL
+        GROUP BY protein_accession
+        ORDER BY count(*) DESC
+        LIMIT %s
+    ''', (n,))
+    return [x[0] for x in cursor.fetchall()]
+
+def sample_sids(cursor, n:int) -> List[int]:
+    cursor.execute('SELECT substance_id FROM substance ORDER BY random() LIMIT %s', (n,))
+    return [x[0] for x in cursor.fetchall()]
+
+def median_ms(cursor, sql:str, params:List, repeats:int) -> float:
+    """ Median latency of running sql once per parameter and fetching all rows. """
+    timings = []
+    for _ in range(repeats):
+        for param in params:
+            t_0 = time.perf_counter()
+            cursor.execute(sql, (param,))
+            cursor.fetchall()
+            timings.append((time.perf_counter() - t_0) * 1000)
+    return statistics.median(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare bioassay queries on JSON and JSONB assay_data.')
+    parser.add_argument('--dsn', default='host=localhost dbname=pubchem user=postgres',
+                        help='libpq connection string, the password can be given with PGPASSWORD')
+    parser.add_argument('--n-targets', type=int, default=10, help='Number of protein accessions to query')
+    parser.add_argument('--n-sids', type=int, default=20, help='Number of substance IDs to look up')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(args.dsn)
+    cursor = connection.cursor()
+    create_copies(cursor)
+    protein_accessions = busiest_protein_accessions(cursor, args.n_targets)
+    sids = sample_sids(cursor, args.n_sids)
+
+    # Server: rows counted in the database, end to end: rows sent to and decoded by psycopg2
+    print(f'{"query":<16}{"json server ms":>16}{"jsonb server ms":>17}{"json e2e ms":>13}{"jsonb e2e ms":>14}')
+    for name, queries, params in [('target', {fn: TARGET_QUERY for fn in ['json', 'jsonb']}, protein_accessions),
+                                  ('target smiles', {fn: TARGET_SMILES_QUERY for fn in ['json', 'jsonb']},
+                                   protein_accessions),
+                                  ('sid', SID_QUERIES, sids)]:
+        sqls = [queries[fn].format(fn=fn, table=f'bioassay_{fn}') for fn in ['json', 'jsonb']]
+        server_ms = [median_ms(cursor, f'SELECT count(*) FROM ({sql}) AS q', params, args.repeats) for sql in sqls]
+        end_to_end_ms = [median_ms(cursor, sql, params, args.repeats) for sql in sqls]
+        print(f'{name:<16}{server_ms[0]:>16.2f}{server_ms[1]:>17.2f}{end_to_end_ms[0]:>13.2f}{end_to_end_ms[1]:>14.2f}')
+
+    connection.rollback() # temporary tables only
+    connection.close()
@@ -0,0 +1,87 @@
+import argparse
+import gzip
+import importlib
+import json
+import multiprocessing
+import os
+import resource
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+
+def zip_dir_paths(bioassay_json_dir_path:str) -> List[str]:
+    return sorted(os.path.join(bioassay_json_dir_path, file) for file in os.listdir(bioassay_json_dir_path)
+                  if file.endswith('.zip'))
+
+def json_megabytes(paths:List[str]) -> float:
+    """ Decompressed size of every .json.gz file in the archives, the bytes each loader has to parse. """
+    n_bytes = 0
+    for path in paths:
+        with zipfile.ZipFile(path, 'r') as zip_ref:
+            for filename in zip_ref.namelist():
+                if filename.endswith('.json.gz'):
+                    with zip_ref.open(filename, 'r') as member, gzip.GzipFile(fileobj=member, mode='rb') as file:
+                        while True:
+                            chunk = file.read(1 << 20)
+                            if not chunk:
+                                break
+                            n_bytes += len(chunk)
+    return n_bytes / 1e6
+
+def legacy_loader(zip_dir_path:str):
+    """ _bioassay_zip_dir_loader before streaming: compressed bytes, decompressed bytes and str all held at once. """
+    with zipfile.ZipFile(zip_dir_path, 'r') as zip_ref:
+        for filename in [filename for filename in zip_ref.namelist() if filename.endswith('.json.gz')]:
+            with zip_ref.open(filename, 'r') as file:
+                contents = gzip.decompress(file.read())
+                contents_str = contents.decode('utf-8')
+            yield json.loads(contents_str)
+
+def run_loader(args:Tuple[str, List[str]]) -> Tuple[float, int, float, float]:
+    """
+    Runs one loader over every archive in a fresh process, so ru_maxrss is the peak of that loader alone.
+
+    :return: (seconds, number of bioassays, RSS in MB before loading, peak RSS in MB)
+    """
+    name, paths = args
+    module = importlib.import_module('autochem.database_build.PubChemDB') # the package attribute is the class
+    if name == 'streamed json':
+        module.orjson = None
+    loader = legacy_loader if name == 'legacy' else \
+        lambda path: module.PubChemDB._bioassay_zip_dir_loader(path, print_filename=False)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on Linux
+    n_bioassays = 0
+    t_0 = time.perf_counter()
+    for path in paths:
+        for _ in loader(path):
+            n_bioassays += 1
+    seconds = time.perf_counter() - t_0
+    return seconds, n_bioassays, rss_before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare throughput and peak memory of bioassay JSON loaders.')
+    parser.add_argument('bioassay_json_dir_path', help='Directory of bioassay JSON zip archives')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per loader, the fastest is reported')
+    args = parser.parse_args()
+
+    paths = zip_dir_paths(args.bioassay_json_dir_path)
+    megabytes = json_megabytes(paths)
+    loaders = ['legacy', 'streamed json']
+    if importlib.util.find_spec('orjson') is not None:
+        loaders.append('streamed orjson')
+
+    print(f'{len(paths)} archives, {megabytes:.1f} MB of JSON')
+    print(f'{"loader":<18}{"seconds":>10}{"MB/s":>10}{"assays":>10}{"peak RSS MB":>14}{"over base MB":>14}')
+    context = multiprocessing.get_context('spawn') # nothing inherited from this process counts towards the peak
+    for name in loaders:
+        runs = []
+        for _ in range(args.repeats):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(run_loader, (name, paths)).result())
+        seconds, n_bioassays, rss_before, rss_peak = min(runs)
+        print(f'{name:<18}{seconds:>10.2f}{megabytes / seconds:>10.1f}{n_bioassays:>10}{rss_peak:>14.1f}'
+              f'{rss_peak - rss_before:>14.1f}')
@@ -0,0 +1,83 @@
+import argparse
+import copy
+import os
+import time
+from typing import Callable, List
+from autochem.database_build import PubChemDB
+
+
+# Name-mangled class maps, read directly as the reformatters do rather than through the deep-copying properties
+UNIT_MAP = PubChemDB._PubChemDB__unit_map
+ACTIVITY_OUTCOME_MAP = PubChemDB._PubChemDB__activity_outcome_map
+POSSIBLE_NON_TID_BIOASSAY_COLUMNS = PubChemDB._PubChemDB__possible_non_tid_bioassay_columns
+
+
+def legacy_reformat_bioassay_data(json_bioassay:dict) -> list:
+    """ _reformat_bioassay_data before precomputed column names, reformats the data entries in place. """
+    if 'results' in json_bioassay['PC_AssaySubmit']['assay']['descr']:
+        tid_to_activity_name_map = {}
+        for item in json_bioassay['PC_AssaySubmit']['assay']['descr']['results']:
+            if 'unit' in item:
+                tid_to_activity_name_map[item['tid']] = f"{item['name']} ({UNIT_MAP[item['unit']]})"
+            else:
+                tid_to_activity_name_map[item['tid']] = ''
+    else:
+        return []
+
+    reformatted_data = []
+    for sid_entry in json_bioassay['PC_AssaySubmit']['data']:
+        if 'data' in sid_entry:
+            sid_results = sid_entry.pop('data')
+            tid_data = {tid_entry['tid']: list(tid_entry['value'].values())[0] for tid_entry in sid_results}
+            sid_entry.update(tid_data)
+        sid_entry['outcome'] = ACTIVITY_OUTCOME_MAP[sid_entry['outcome']]
+        sid_entry = {(tid_to_activity_name_map[key] if key not in POSSIBLE_NON_TID_BIOASSAY_COLUMNS else key):
+                     value for key, value in sid_entry.items()}
+        reformatted_data.append(sid_entry)
+    return reformatted_data
+
+def load_bioassays(bioassay_json_dir_path:str, limit:int) -> List[dict]:
+    """ Non-ChEMBL bioassays with data, as the build reformats them. """
+    bioassays = []
+    for file in sorted(os.listdir(bioassay_json_dir_path)):
+        if not file.endswith('.zip'):
+            continue
+        for bioassay_json in PubChemDB._bioassay_zip_dir_loader(os.path.join(bioassay_json_dir_path, file)):
+            descr = bioassay_json['PC_AssaySubmit']['assay']['descr']
+            if descr['aid_source']['db']['name'].lower() != 'chembl' and 'data' in bioassay_json['PC_AssaySubmit']:
+                bioassays.append(bioassay_json)
+            if len(bioassays) >= limit:
+                return bioassays
+    return bioassays
+
+def time_best_of(func:Callable[[dict], list], bioassays:List[dict], repeats:int) -> float:
+    """ Fastest of repeats runs over fresh deep copies, as the legacy reformatter modifies its input. """
+    best = float('inf')
+    for _ in range(repeats):
+        copies = copy.deepcopy(bioassays)
+        t_0 = time.perf_counter()
+        for bioassay_json in copies:
+            func(bioassay_json)
+        best = min(best, time.perf_counter() - t_0)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the legacy and precomputed bioassay data reformatters.')
+    parser.add_argument('bioassay_json_dir_path', help='Directory of bioassay JSON zip archives')
+    parser.add_argument('--limit', type=int, default=100, help='Maximum number of bioassays to load')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per reformatter, the fastest is reported')
+    args = parser.parse_args()
+
+    bioassays = load_bioassays(args.bioassay_json_dir_path, args.limit)
+    n_entries = sum(len(bioassay_json['PC_AssaySubmit']['data']) for bioassay_json in bioassays)
+
+    n_agree = sum(legacy_reformat_bioassay_data(copy.deepcopy(bioassay_json)) ==
+                  PubChemDB._reformat_bioassay_data(bioassay_json) for bioassay_json in bioassays)
+    print(f'{len(bioassays)} bioassays, {n_entries} data entries, {n_agree} reformatted identically')
+
+    print(f'{"reformatter":<14}{"seconds":>10}{"entries/s":>14}{"speedup":>10}')
+    legacy_seconds = time_best_of(legacy_reformat_bioassay_data, bioassays, args.repeats)
+    seconds = time_best_of(PubChemDB._reformat_bioassay_data, bioassays, args.repeats)
+    print(f'{"legacy":<14}{legacy_seconds:>10.2f}{n_entries / legacy_seconds:>14.0f}{1:>10.2f}')
+    print(f'{"precomputed":<14}{seconds:>10.2f}{n_entries / seconds:>14.0f}{legacy_seconds / seconds:>10.2f}')
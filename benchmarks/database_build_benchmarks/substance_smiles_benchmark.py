@@ -0,0 +1,51 @@
+import argparse
+import time
+from typing import Callable, Dict, Tuple
+from rdkit import RDLogger
+from rdkit.Chem import PandasTools
+import naclo
+from autochem.database_build import PubChemDB
+
+
+def naclo_smiles(sdf_gz_path:str) -> Dict[str, str]:
+    """ SMILES by substance ID from the original PandasTools.LoadSDF + naclo path of repopulate_substance_table. """
+    df = PandasTools.LoadSDF(sdf_gz_path)
+    df = df[['PUBCHEM_SUBSTANCE_ID', 'ROMol']]
+    df = naclo.dataframes.df_mols_2_smiles(df, 'ROMol', 'smiles')
+    return dict(zip(df['PUBCHEM_SUBSTANCE_ID'], df['smiles']))
+
+def streamed_smiles(sdf_gz_path:str, fast_smiles:bool) -> Dict[str, str]:
+    """ SMILES by substance ID from PubChemDB._substance_sdf_chunk_generator. """
+    return {substance_id: smiles for rows in PubChemDB._substance_sdf_chunk_generator(sdf_gz_path,
+                                                                                       fast_smiles=fast_smiles)
+            for substance_id, smiles in rows}
+
+def time_best_of(func:Callable[[], Dict[str, str]], repeats:int) -> Tuple[float, Dict[str, str]]:
+    best = float('inf')
+    for _ in range(repeats):
+        t_0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t_0)
+    return best, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare SMILES extraction paths of the substance table build.')
+    parser.add_argument('sdf_gz_path', help='PubChem Substance .sdf.gz fixture')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per path, the fastest is reported')
+    args = parser.parse_args()
+
+    RDLogger.DisableLog('rdApp.*') # as under _rdkit_stfu in the build
+
+    reference_seconds, reference = time_best_of(lambda: naclo_smiles(args.sdf_gz_path), args.repeats)
+    print(f'{"path":<12}{"seconds":>10}{"mols/s":>12}{"mols":>10}{"agree":>10}{"missing":>10}{"extra":>8}')
+    print(f'{"naclo":<12}{reference_seconds:>10.2f}{len(reference) / reference_seconds:>12.0f}{len(reference):>10}'
+          f'{len(reference):>10}{0:>10}{0:>8}')
+
+    for name, fast_smiles in [('streamed', False), ('fast', True)]:
+        seconds, smiles = time_best_of(lambda: streamed_smiles(args.sdf_gz_path, fast_smiles), args.repeats)
+        n_agree = sum(reference.get(substance_id) == value for substance_id, value in smiles.items())
+        n_missing = len(reference.keys() - smiles.keys())
+        n_extra = len(smiles.keys() - reference.keys())
+        print(f'{name:<12}{seconds:>10.2f}{len(smiles) / seconds:>12.0f}{len(smiles):>10}{n_agree:>10}'
+              f'{n_missing:>10}{n_extra:>8}')
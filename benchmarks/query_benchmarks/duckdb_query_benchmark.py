@@ -0,0 +1,59 @@
+import argparse
+import statistics
+import time
+from typing import Callable, List
+import pandas as pd
+from autochem import PubChemDuckDBQuery, PubChemQuery
+
+
+def normalized(df:pd.DataFrame) -> pd.DataFrame:
+    """ Row and column order differ between backends, jsonb also reorders the keys of the assay data. Rows are
+    sorted on every column, a substance can have more than one entry in a bioassay. """
+    df = df[sorted(df.columns)]
+    return df.loc[df.astype(str).sort_values(list(df.columns)).index].reset_index(drop=True)
+
+def median_ms(func:Callable, params:List[str], repeats:int) -> float:
+    """ Median latency of calling func once per parameter. """
+    timings = []
+    for _ in range(repeats):
+        for param in params:
+            t_0 = time.perf_counter()
+            func(param)
+            timings.append((time.perf_counter() - t_0) * 1000)
+    return statistics.median(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare PubChemQuery on Postgres with PubChemDuckDBQuery on the '
+                                                 'Parquet datasets built from the same files.')
+    parser.add_argument('parquet_dir_path', help='Directory of datasets written by PubChemParquet')
+    parser.add_argument('protein2xrefs_path', help='protein2xrefs file the Postgres target table was loaded from')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4], help='DuckDB thread counts to run with')
+    parser.add_argument('--n-targets', type=int, default=10, help='Number of UniProt IDs to query')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    postgres_query = PubChemQuery()
+    duckdb_queries = {threads: PubChemDuckDBQuery(args.parquet_dir_path, args.protein2xrefs_path, threads=threads)
+                      for threads in args.threads}
+    uniprot_ids = sorted(postgres_query.get_uniprot_ids_with_data())[:args.n_targets]
+
+    # Both backends must agree before their timings are compared
+    duckdb_query = duckdb_queries[args.threads[0]]
+    if sorted(duckdb_query.get_uniprot_ids_with_data()) != sorted(postgres_query.get_uniprot_ids_with_data()):
+        raise ValueError('Backends disagree on get_uniprot_ids_with_data, were they built from the same files?')
+    n_rows = 0
+    for uniprot_id in uniprot_ids:
+        postgres_df = normalized(postgres_query.get_bioassays_from_uniprot_id(uniprot_id))
+        if not postgres_df.equals(normalized(duckdb_query.get_bioassays_from_uniprot_id(uniprot_id))):
+            raise ValueError(f'Backends disagree on get_bioassays_from_uniprot_id({uniprot_id!r})')
+        n_rows += len(postgres_df)
+    print(f'{len(uniprot_ids)} UniProt IDs, {n_rows} rows, identical on both backends')
+
+    backends = [('postgres', postgres_query)] + [(f'duckdb {threads} threads', query)
+                                                 for threads, query in duckdb_queries.items()]
+    print(f'{"backend":<20}{"by uniprot ms":>15}{"ids with data ms":>18}')
+    for name, query in backends:
+        target_ms = median_ms(query.get_bioassays_from_uniprot_id, uniprot_ids, args.repeats)
+        ids_ms = median_ms(lambda _: query.get_uniprot_ids_with_data(), [None], args.repeats)
+        print(f'{name:<20}{target_ms:>15.2f}{ids_ms:>18.2f}')
@@ -0,0 +1,79 @@
+import argparse
+import statistics
+import time
+from typing import Callable, List
+from autochem import PubChemQuery
+
+
+def median_ms(func:Callable, params:List[tuple], repeats:int) -> float:
+    """ Median latency of calling func once per parameter tuple. """
+    timings = []
+    for _ in range(repeats):
+        for param in params:
+            t_0 = time.perf_counter()
+            func(*param)
+            timings.append((time.perf_counter() - t_0) * 1000)
+    return statistics.median(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Latency of repeated PubChemQuery lookups with the statements sent '
+                                                 'as SQL text, parsed and planned on every call as before, and '
+                                                 'executed as the prepared statements PubChemQuery now uses.')
+    parser.add_argument('--dsn', default=None, help='Connection string, defaults to PostgresPool.dsn("pubchem")')
+    parser.add_argument('--n-targets', type=int, default=10, help='Number of the busiest targets to look up')
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    query = PubChemQuery(args.dsn)
+    statements = PubChemQuery._PubChemQuery__statements
+
+    def unprepared(name:str, *params) -> list:
+        """ The statement of name with client-side interpolated parameters, as PubChemQuery ran them before. """
+        parameter_types, statement = statements[name]
+        for i in range(len(params), 0, -1):
+            statement = statement.replace(f'${i}', '%s')
+        query.cursor.execute(statement, params)
+        return query.cursor.fetchall()
+
+    def prepared(name:str, *params) -> list:
+        query._execute(name, *params)
+        return query.cursor.fetchall()
+
+    # Hot targets, the UniProt IDs and protein accessions with the most data entries
+    query.cursor.execute(
+        '''
+            SELECT target.uniprot_id, bioassay.protein_accession
+            FROM target
+            JOIN bioassay ON bioassay.protein_accession = target.protein_accession
+            WHERE jsonb_typeof(bioassay.assay_data)='array' AND target.uniprot_id IS NOT NULL
+            GROUP BY target.uniprot_id, bioassay.protein_accession
+            ORDER BY sum(jsonb_array_length(bioassay.assay_data)) DESC, target.uniprot_id
+            LIMIT %s
+        ''',
+        (args.n_targets,)
+    )
+    targets = query.cursor.fetchall()
+    query.cursor.execute("SELECT min(bioassay_id) FROM bioassay WHERE jsonb_typeof(assay_data)='array'")
+    bioassay_id = query.cursor.fetchone()[0]
+    lookups = [
+        ('pubchem_bioassays_from_uniprot_id', [(x[0],) for x in targets]),
+        ('pubchem_bioassays_from_protein_accession', [(x[1],) for x in targets]),
+        ('pubchem_assay_data_from_bioassay_id', [(bioassay_id,)]),
+        ('pubchem_uniprot_ids_with_data', [()]),
+        ('pubchem_protein_accessions_with_data', [()])
+    ]
+
+    # Both must return the same rows before their timings are compared
+    for name, params in lookups:
+        for param in params:
+            if sorted(map(str, unprepared(name, *param))) != sorted(map(str, prepared(name, *param))):
+                raise ValueError(f'Prepared and unprepared {name} disagree on {param!r}')
+    print(f'{len(targets)} hot targets, results identical')
+
+    print(f'{"statement":<45}{"unprepared ms":>15}{"prepared ms":>13}{"speedup":>9}')
+    for name, params in lookups:
+        unprepared_ms = median_ms(lambda *param: unprepared(name, *param), params, args.repeats)
+        prepared_ms = median_ms(lambda *param: prepared(name, *param), params, args.repeats)
+        print(f'{name:<45}{unprepared_ms:>15.2f}{prepared_ms:>13.2f}{unprepared_ms / prepared_ms:>8.2f}x')
+    query.close()
@@ -0,0 +1,16 @@
+import pyarrow.dataset as ds
+from autochem.database_build import PubChemParquet
+
+
+if __name__ == '__main__':
+    pc_parquet = PubChemParquet(
+        '/Users/collabpharma/Desktop/JSON',
+        '/Users/collabpharma/Desktop/SDF',
+        '/Users/collabpharma/Desktop/pubchem_parquet'
+    )
+    pc_parquet.build(n_workers=4)
+    
+    # Only the protein_accession=P00533 directories are read
+    activity = ds.dataset('/Users/collabpharma/Desktop/pubchem_parquet/activity', partitioning='hive')
+    print(activity.to_table(filter=(ds.field('protein_accession') == 'P00533') &
+                                   (ds.field('outcome') == 'active')).to_pandas())
@@ -16,9 +16,22 @@ setup(
     ]},
     python_requires='>=3.7',
     install_requires=[
+        'numpy',
         'pandas',
+        'psycopg2-binary',
         'PyYAML',
+        'rdkit',
         'requests',
-        'setuptools'
+        'setuptools',
+        'tqdm'
     ],
+    extras_require={
+        'fast_json': ['orjson'], # parses bioassay JSON bytes faster than json
+        'stream_json': ['ijson'], # PubChemDB builds with stream_json=True
+        'parquet': ['pyarrow'], # PubChemParquet
+        'duckdb': ['duckdb'] # PubChemDuckDBQuery
+    },
+    entry_points={'console_scripts': [
+        'autochem-build=autochem.database_build.__main__:main'
+    ]},
 )
\ No newline at end of file
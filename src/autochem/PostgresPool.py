@@ -0,0 +1,101 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Generator, Tuple
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+
+class PostgresPool():
+    # One pool per DSN for the whole process, with a semaphore so that borrowers wait for a free connection instead of
+    # getting a PoolError once every connection is in use
+    __pools:Dict[str, Tuple[ThreadedConnectionPool, threading.BoundedSemaphore]] = {}
+    __lock = threading.Lock()
+    __pid = os.getpid()
+
+    @staticmethod
+    def dsn(database:str) -> str:
+        """
+        Connection string of a database, from the environment variable AUTOCHEM_<DATABASE>_DSN (e.g.
+        AUTOCHEM_PUBCHEM_DSN) if set. Otherwise connects to the database as postgres on localhost, unless PGUSER or
+        PGHOST say otherwise; libpq takes the password from PGPASSWORD or ~/.pgpass.
+
+        :param database: Name of the database, 'pubchem' or 'uniprot'
+        :type database: str
+        :return: libpq connection string or URI
+        :rtype: str
+        """
+        dsn = os.environ.get(f'AUTOCHEM_{database.upper()}_DSN')
+        if dsn:
+            return dsn
+        defaults = {'host': ('PGHOST', 'localhost'), 'user': ('PGUSER', 'postgres')}
+        return ' '.join([f'dbname={database}'] + [f'{key}={default}' for key, (env_var, default) in defaults.items()
+                                                 if env_var not in os.environ])
+
+    @staticmethod
+    def getconn(dsn:str) -> psycopg2.extensions.connection:
+        """
+        Borrows a connection, waiting for one to be returned if the pool of dsn is at its maximum size. The pool is
+        created on first use with at most AUTOCHEM_PG_POOL_SIZE (default 10) connections. Every connection borrowed
+        must be returned with putconn.
+
+        :param dsn: Connection string, see PostgresPool.dsn
+        :type dsn: str
+        :return: Connection, with no transaction open
+        :rtype: psycopg2.extensions.connection
+        """
+        pool, semaphore = PostgresPool.__pool(dsn)
+        semaphore.acquire()
+        try:
+            return pool.getconn()
+        except Exception:
+            semaphore.release()
+            raise
+
+    @staticmethod
+    def putconn(connection:psycopg2.extensions.connection, dsn:str) -> None:
+        """
+        Returns a connection borrowed with getconn. An open transaction is rolled back, a closed or broken
+        connection is discarded and replaced on a later getconn.
+
+        :param connection: Borrowed connection
+        :type connection: psycopg2.extensions.connection
+        :param dsn: Connection string it was borrowed with
+        :type dsn: str
+        """
+        pool, semaphore = PostgresPool.__pool(dsn)
+        try:
+            pool.putconn(connection, close=connection.closed != 0)
+        finally:
+            semaphore.release()
+
+    @staticmethod
+    @contextmanager
+    def connection(dsn:str) -> Generator[psycopg2.extensions.connection, None, None]:
+        """ Borrows a connection for the duration of a with block, see getconn. """
+        connection = PostgresPool.getconn(dsn)
+        try:
+            yield connection
+        finally:
+            PostgresPool.putconn(connection, dsn)
+
+    @staticmethod
+    def closeall() -> None:
+        """ Closes every connection of every pool, connections still borrowed included. """
+        with PostgresPool.__lock:
+            for pool, _ in PostgresPool.__pools.values():
+                pool.closeall()
+            PostgresPool.__pools.clear()
+
+    @staticmethod
+    def __pool(dsn:str) -> Tuple[ThreadedConnectionPool, threading.BoundedSemaphore]:
+        with PostgresPool.__lock:
+            if os.getpid() != PostgresPool.__pid:
+                # Forked, the connections belong to the parent so they are left alone rather than closed
+                PostgresPool.__pools = {}
+                PostgresPool.__pid = os.getpid()
+            if dsn not in PostgresPool.__pools:
+                max_size = int(os.environ.get('AUTOCHEM_PG_POOL_SIZE', 10))
+                PostgresPool.__pools[dsn] = (ThreadedConnectionPool(1, max_size, dsn),
+                                             threading.BoundedSemaphore(max_size))
+            return PostgresPool.__pools[dsn]
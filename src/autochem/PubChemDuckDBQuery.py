@@ -0,0 +1,211 @@
+import json
+import duckdb
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Optional
+from autochem.UniProtQuery import UniProtQuery
+
+
+class PubChemDuckDBQuery:
+    def __init__(self, parquet_dir_path:str, protein2xrefs_path:Optional[str]=None, database_path:str=':memory:',
+                 threads:Optional[int]=None) -> None:
+        """
+        Answers the same queries as PubChemQuery in process with DuckDB, over the datasets PubChemParquet writes
+        instead of a Postgres server. The datasets are attached as views, so every query scans the Parquet files with
+        DuckDB's worker threads and skips protein_accession partitions that a filter rules out.
+
+        NOTE: PubChemParquet keeps the protein accession of every bioassay, while the Postgres build drops it for
+        accessions that are not in the target table, so queries by protein accession can return bioassays that
+        PubChemQuery does not. Queries by UniProt ID join the target table and return the same bioassays.
+
+        :param parquet_dir_path: Directory holding the datasets written by PubChemParquet
+        :type parquet_dir_path: str
+        :param protein2xrefs_path: Path to protein2xrefs file to load the target table from, as PubChemDB does, if
+            None the table is expected in database_path, defaults to None
+        :type protein2xrefs_path: Optional[str], optional
+        :param database_path: DuckDB database file to keep the views and target table in, defaults to ':memory:'
+        :type database_path: str, optional
+        :param threads: Number of DuckDB worker threads, defaults to None for one per core
+        :type threads: Optional[int], optional
+        """
+        ########## Connect to DB ##########
+        self.connection = duckdb.connect(database_path)
+        if threads is not None:
+            self.connection.execute(f'SET threads = {int(threads)}')
+        self.cursor = self.connection.cursor()
+
+        ########## Attach datasets ##########
+        # Rows without a protein accession are written to the __HIVE_DEFAULT_PARTITION__ partition, mapped back to NULL
+        # as in Postgres, so that accession filters match the same rows with any DuckDB version
+        parquet_dir_path = parquet_dir_path.rstrip('/').replace("'", "''")
+        accession_columns = "* REPLACE (NULLIF(protein_accession, '__HIVE_DEFAULT_PARTITION__') AS protein_accession)"
+        for dataset, hive_types, columns in [
+            ('bioassay', "{'aid_range': 'VARCHAR', 'protein_accession': 'VARCHAR'}", accession_columns),
+            ('activity', "{'aid_range': 'VARCHAR', 'protein_accession': 'VARCHAR'}", accession_columns),
+            ('result_column', "{'aid_range': 'VARCHAR'}", '*')
+        ]:
+            self.cursor.execute(
+                f'''
+                    CREATE OR REPLACE VIEW {dataset} AS
+                    SELECT {columns}
+                    FROM read_parquet('{parquet_dir_path}/{dataset}/**/*.parquet', hive_partitioning=true,
+                                      hive_types={hive_types})
+                '''
+            )
+        self.cursor.execute(
+            f'''
+                CREATE OR REPLACE VIEW substance AS
+                SELECT substance_id, smiles
+                FROM read_parquet('{parquet_dir_path}/substance/*.parquet')
+            '''
+        )
+        if protein2xrefs_path is not None:
+            self._load_target_table(protein2xrefs_path)
+
+    def _load_target_table(self, protein2xrefs_path:str) -> None:
+        """ Replaces the target table with the rows PubChemDB.repopulate_protein_target_table loads. """
+        df = pd.read_csv(protein2xrefs_path, delimiter='\t')
+        df = df.replace({np.nan: None})
+        df = df.drop_duplicates(subset=['ProteinAccession'], keep='first') # protein_accession is the primary key
+        target_df = df[['ProteinAccession', 'GeneID', 'RefSeq', 'UniProt']]
+
+        self.cursor.register('protein2xrefs', target_df)
+        self.cursor.execute(
+            '''
+                CREATE OR REPLACE TABLE target AS
+                SELECT CAST(ProteinAccession AS VARCHAR) AS protein_accession, CAST(GeneID AS BIGINT) AS gene_id,
+                       CAST(RefSeq AS VARCHAR) AS ref_seq, CAST(UniProt AS VARCHAR) AS uniprot_id
+                FROM protein2xrefs
+            '''
+        )
+        self.cursor.unregister('protein2xrefs')
+
+    def get_assay_data_from_bioassay_id(self, bioassay_id:str) -> pd.DataFrame:
+        """
+        :param bioassay_id: ID of the bioassay
+        :type bioassay_id: str
+        :return: One row per data entry with the columns of the source assay in its order, empty if the bioassay has
+            no data
+        :rtype: pd.DataFrame
+        """
+        self.cursor.execute(
+            '''
+                SELECT assay_data
+                FROM bioassay
+                WHERE bioassay_id = CAST(? AS BIGINT) AND assay_data LIKE '[%'
+            ''',
+            [bioassay_id]
+        )
+        # The serialized JSON keeps the key order of the source assay, unlike JSONB in Postgres
+        return pd.DataFrame.from_records([entry for (assay_data,) in self.cursor.fetchall()
+                                          for entry in json.loads(assay_data)])
+
+    def get_bioassays_from_protein_accession(self, protein_accession:str) -> pd.DataFrame:
+        self.cursor.execute(
+            # NOTE: Assay data in index 0, bioassay_id is index 1, protein_accession is index 2
+            '''
+                SELECT assay_data, bioassay_id, protein_accession
+                FROM bioassay
+                WHERE protein_accession = ? AND assay_data LIKE '[%' -- serialized JSON array
+            ''',
+            [protein_accession]
+        )
+        return self._assay_data_frame(self.cursor.fetchall(), ['bioassay_id', 'protein_accession'])
+
+    def get_bioassays_from_uniprot_id(self, uniprot_id:str) -> pd.DataFrame:
+        self.cursor.execute(
+            # NOTE: Assay data in index 0, bioassay_id is index 1, protein_accession is index 2, uniprot_id is index 3
+            '''
+                SELECT bioassay.assay_data, bioassay.bioassay_id, bioassay.protein_accession, target.uniprot_id
+                FROM bioassay
+                JOIN target ON bioassay.protein_accession = target.protein_accession
+                WHERE target.uniprot_id = ? AND bioassay.assay_data LIKE '[%'
+            ''',
+            [uniprot_id]
+        )
+        return self._assay_data_frame(self.cursor.fetchall(), ['bioassay_id', 'protein_accession', 'uniprot_id'])
+
+    def _assay_data_frame(self, results:List[tuple], columns:List[str]) -> pd.DataFrame:
+        """
+        Expands bioassay rows into one row per data entry and merges on SMILES, as PubChemQuery does with
+        jsonb_array_elements and a second query on the substance table.
+
+        :param results: Rows of serialized assay data followed by the values of columns
+        :type results: List[tuple]
+        :param columns: Names of the values after the assay data
+        :type columns: List[str]
+        :return: Entries with SMILES, substances missing from the substance table are dropped
+        :rtype: pd.DataFrame
+        """
+        entries = [(entry,) + tuple(row[1:]) for row in results for entry in json.loads(row[0])]
+        if not entries:
+            return pd.DataFrame(columns=['sid', 'SMILES'] + columns)
+
+        # First element: assay data (JSON) --> convert to dataframe
+        results_df = pd.DataFrame.from_records([x[0] for x in entries])
+
+        # Add other fields to dataframe
+        for i, column in enumerate(columns, start=1):
+            results_df[column] = [x[i] for x in entries]
+
+        # Get SMILES from substance IDs, joined in DuckDB so only the matching substance row groups are decoded
+        self.cursor.register('substance_ids', pd.DataFrame({'sid': results_df['sid'].unique()}))
+        self.cursor.execute(
+            '''
+                SELECT substance_id, smiles
+                FROM substance
+                WHERE substance_id IN (SELECT sid FROM substance_ids)
+            '''
+        )
+        smiles_df = pd.DataFrame(self.cursor.fetchall(), columns=['sid', 'SMILES'])
+        self.cursor.unregister('substance_ids')
+
+        # Merges SMILES on substance IDs
+        return pd.merge(smiles_df, results_df, on='sid')
+
+    def get_represented_uniprot_ids(self) -> List[str]:
+        self.cursor.execute(
+            '''
+                SELECT DISTINCT uniprot_id
+                FROM target
+            '''
+        )
+        return [x[0] for x in self.cursor.fetchall()]
+
+    def get_uniprot_ids_with_data(self) -> List[str]:
+        self.cursor.execute(
+            '''
+                SELECT DISTINCT target.uniprot_id
+                FROM target
+                JOIN bioassay
+                ON target.protein_accession = bioassay.protein_accession
+                WHERE bioassay.assay_data IS NOT NULL AND target.uniprot_id IS NOT NULL
+            '''
+        )
+        return [x[0] for x in self.cursor.fetchall()]
+
+    def get_protein_accessions_with_data(self) -> List[str]:
+        self.cursor.execute(
+            '''
+                SELECT DISTINCT protein_accession
+                FROM bioassay
+                WHERE protein_accession IS NOT NULL AND assay_data IS NOT NULL
+            '''
+        )
+        return [x[0] for x in self.cursor.fetchall()]
+
+    def get_bioassay_protein_accessions(self) -> List[str]:
+        self.cursor.execute(
+            '''
+                SELECT DISTINCT protein_accession
+                FROM bioassay
+                WHERE protein_accession IS NOT NULL
+            '''
+        )
+        return [x[0] for x in self.cursor.fetchall()]
+
+    def get_organism_data_for_all_pubchem_uniprot_ids(self) -> Dict[str, List[str]]:
+        pubchem_uniprot_ids = self.get_uniprot_ids_with_data() # get all unique uniprot IDs in the pubchem database
+        with UniProtQuery() as uniprot_query: # borrow a pooled connection to UniProt database
+            return uniprot_query.get_all_data_for_uniprot_ids(tuple(pubchem_uniprot_ids)) # get organism data for \
+                # each uniprot ID
@@ -1,158 +1,271 @@
-import psycopg2
+import itertools
+import json
+import uuid
 import pandas as pd
-from typing import List, Dict
+from typing import List, Dict, Generator, Iterable, Optional
+from autochem.PostgresPool import PostgresPool
 from autochem.UniProtQuery import UniProtQuery
 
 
 class PubChemQuery:
-    def __init__(self) -> None:
-        ########## Connect to DB ##########
-        host = 'localhost'
-        database = 'pubchem'
-        user = 'postgres'
-        password = 'Coll@bor@tions2020'
-        # port = '5432'
-        self.connection = psycopg2.connect(host=host, database=database, user=user, password=password)
+    # Server-side prepared statements of the query methods, by name: (parameter types, statement). Each is prepared
+    # once per pooled connection, see _prepare_statements, so repeated lookups are not parsed and planned every time
+    __statements = {
+        'pubchem_assay_data_from_bioassay_id': ('integer', '''
+            SELECT assay_data::text, assay_columns
+            FROM bioassay
+            WHERE bioassay_id = $1 AND jsonb_typeof(assay_data)='array'
+        '''),
+        # Data entries of bioassays joined to the substance table in one query, grouped per bioassay: the substance
+        # IDs and SMILES of its entries as typed arrays and the entries, without their sid, as one JSON array decoded
+        # with a single json.loads, which is faster than psycopg2 decoding each entry and building one tuple per entry.
+        # JSONB reorders the keys of the entries, assay_columns has them in the order of the source assay
+        # NOTE: sids is index 0, SMILES is index 1, entries are index 2, assay_columns is index 3, bioassay_id is \
+            # index 4, protein_accession is index 5
+        'pubchem_bioassays_from_protein_accession': ('text', '''
+            SELECT array_agg(substance.substance_id ORDER BY e.position),
+                   array_agg(substance.smiles ORDER BY e.position),
+                   jsonb_agg(e.entry - 'sid' ORDER BY e.position)::text, bioassay.assay_columns,
+                   bioassay.bioassay_id, bioassay.protein_accession
+            FROM bioassay
+            CROSS JOIN jsonb_array_elements(bioassay.assay_data) WITH ORDINALITY AS e(entry, position)
+            JOIN substance ON substance.substance_id = (e.entry->>'sid')::integer
+            WHERE bioassay.protein_accession = $1 AND jsonb_typeof(bioassay.assay_data)='array'
+            GROUP BY bioassay.bioassay_id
+        '''),
+        # NOTE: As above, uniprot_id is index 6
+        'pubchem_bioassays_from_uniprot_id': ('text', '''
+            SELECT array_agg(substance.substance_id ORDER BY e.position),
+                   array_agg(substance.smiles ORDER BY e.position),
+                   jsonb_agg(e.entry - 'sid' ORDER BY e.position)::text, bioassay.assay_columns,
+                   bioassay.bioassay_id, bioassay.protein_accession, target.uniprot_id
+            FROM target
+            JOIN bioassay ON bioassay.protein_accession = target.protein_accession
+            CROSS JOIN jsonb_array_elements(bioassay.assay_data) WITH ORDINALITY AS e(entry, position)
+            JOIN substance ON substance.substance_id = (e.entry->>'sid')::integer
+            WHERE target.uniprot_id = $1 AND jsonb_typeof(bioassay.assay_data)='array'
+            GROUP BY bioassay.bioassay_id, target.uniprot_id
+        '''),
+        'pubchem_represented_uniprot_ids': (None, '''
+            SELECT DISTINCT uniprot_id
+            FROM target
+        '''),
+        'pubchem_uniprot_ids_with_data': (None, '''
+            SELECT DISTINCT target.uniprot_id
+            FROM target
+            JOIN bioassay
+            ON target.protein_accession = bioassay.protein_accession
+            WHERE bioassay.assay_data IS NOT NULL AND target.uniprot_id IS NOT NULL
+        '''),
+        'pubchem_protein_accessions_with_data': (None, '''
+            SELECT DISTINCT protein_accession
+            FROM bioassay
+            WHERE protein_accession IS NOT NULL AND assay_data IS NOT NULL
+        '''),
+        'pubchem_bioassay_protein_accessions': (None, '''
+            SELECT DISTINCT protein_accession
+            FROM bioassay
+            WHERE protein_accession IS NOT NULL
+        ''')
+    }
+    # Not prepared, a named cursor can only be declared for a query and not for EXECUTE. Ungrouped for streaming, so
+    # that memory is bounded by the number of entries fetched rather than by bioassay, and for any number of UniProt
+    # IDs at once, given as an array. Ordered so that chunks hold the same entries on every run
+    # NOTE: sid is index 0, SMILES is index 1, entry is index 2, then as above
+    __uniprot_ids_entry_query = '''
+        SELECT substance.substance_id, substance.smiles, (e.entry - 'sid')::text, bioassay.assay_columns,
+               bioassay.bioassay_id, bioassay.protein_accession, target.uniprot_id
+        FROM target
+        JOIN bioassay ON bioassay.protein_accession = target.protein_accession
+        CROSS JOIN jsonb_array_elements(bioassay.assay_data) WITH ORDINALITY AS e(entry, position)
+        JOIN substance ON substance.substance_id = (e.entry->>'sid')::integer
+        WHERE target.uniprot_id = ANY(%s::text[]) AND jsonb_typeof(bioassay.assay_data)='array'
+        ORDER BY bioassay.bioassay_id, e.position
+    '''
+    
+    def __init__(self, dsn:Optional[str]=None) -> None:
+        """
+        Queries the PubChem database over a connection borrowed from PostgresPool. Return it with close(), or use the
+        query as a context manager, so that other queries can reuse the connection.
+
+        :param dsn: Connection string, defaults to None for PostgresPool.dsn('pubchem')
+        :type dsn: Optional[str], optional
+        """
+        ########## Borrow connection to DB ##########
+        self.__dsn = PostgresPool.dsn('pubchem') if dsn is None else dsn
+        self.connection = PostgresPool.getconn(self.__dsn)
         self.cursor = self.connection.cursor()
+        self._prepare_statements()
         
-    def get_assay_data_from_bioassay_id(self, bioassay_id:str):
-        self.cursor.execute(
-            f'''
-                SELECT json_array_elements(assay_data)
-                FROM bioassay
-                WHERE bioassay_id = '{bioassay_id}'
-            '''
-        )
-        out = self.cursor.fetchall()
-        from pprint import pprint
-        pprint(out)
+    def _prepare_statements(self) -> None:
+        """ Prepares the statements the borrowed connection has not prepared yet, they last as long as its session. """
+        self.cursor.execute('SELECT name FROM pg_prepared_statements')
+        prepared = {x[0] for x in self.cursor.fetchall()}
+        for name, (parameter_types, statement) in PubChemQuery.__statements.items():
+            if name not in prepared:
+                self.cursor.execute(f"PREPARE {name}{f'({parameter_types})' if parameter_types else ''} AS {statement}")
+        self.connection.commit() # PREPARE is not undone by a rollback, this only ends the transaction
         
-    def get_bioassays_from_protein_accession(self, protein_accession:str) -> pd.DataFrame:
-        self.cursor.execute(
-            # NOTE: Assay data in index 0, bioassay_id is index 1, protein_accession is index 2, uniprot_id is index 3
-            f'''
-                SELECT json_array_elements(assay_data), bioassay_id, protein_accession
-                FROM bioassay
-                WHERE protein_accession = '{protein_accession}' AND assay_data IS NOT NULL AND json_typeof(assay_data)='array'
-            '''
-        )
-        results = self.cursor.fetchall()
+    def _execute(self, name:str, *params) -> None:
+        """ Executes a prepared statement with bound parameters, the results are left in self.cursor. """
+        self.cursor.execute(f"EXECUTE {name}({', '.join(['%s'] * len(params))})" if params else f'EXECUTE {name}',
+                            params)
         
-        # First element: assay data (JSON) --> convert to dataframe
-        results_df = pd.DataFrame.from_records(
-            [x[0] for x in results] # index w/ 0 bc there is a list of tuples for some reason
-        )
+    def close(self) -> None:
+        """ Returns the connection to the pool. """
+        if self.connection is not None:
+            self.cursor.close()
+            PostgresPool.putconn(self.connection, self.__dsn)
+            self.connection = None
         
-        # Add other fields to dataframe
-        results_df['bioassay_id'] = [x[1] for x in results]
-        results_df['protein_accession'] = [x[2] for x in results]
+    def __enter__(self) -> 'PubChemQuery':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
         
-        # Get SMILES from substance IDs
-        substance_ids = tuple(results_df['sid'])
-        self.cursor.execute(
-            '''
-                SELECT *
-                FROM substance
-                WHERE substance_id IN %s
-            ''',
-            (substance_ids,)
-        )
+    def get_assay_data_from_bioassay_id(self, bioassay_id:str) -> pd.DataFrame:
+        """
+        :param bioassay_id: ID of the bioassay
+        :type bioassay_id: str
+        :return: One row per data entry with the columns of the source assay in its order, empty if the bioassay has
+            no data
+        :rtype: pd.DataFrame
+        """
+        self._execute('pubchem_assay_data_from_bioassay_id', bioassay_id)
+        row = self.cursor.fetchone()
+        if row is None:
+            return pd.DataFrame()
+        results_df = pd.DataFrame.from_records(json.loads(row[0]))
+        return results_df[PubChemQuery._ordered_columns(results_df.columns, [row[1]])]
         
-        # Merges SMILES on substance IDs
-        results_df = pd.merge(pd.DataFrame(self.cursor.fetchall(), columns=['sid', 'SMILES']), results_df, on='sid')
-        return results_df
+    def get_bioassays_from_protein_accession(self, protein_accession:str) -> pd.DataFrame:
+        self._execute('pubchem_bioassays_from_protein_accession', protein_accession)
+        return PubChemQuery._assay_data_frame(self.cursor.fetchall(), ['bioassay_id', 'protein_accession'])
         
     def get_bioassays_from_uniprot_id(self, uniprot_id:str) -> pd.DataFrame:
-        self.cursor.execute(
-            # NOTE: Assay data in index 0, bioassay_id is index 1, protein_accession is index 2, uniprot_id is index 3
-            f'''
-                SELECT json_array_elements(assay_data), bioassay_id, bioassay.protein_accession, test.uniprot_id
-                FROM bioassay
-                JOIN (
-                    SELECT *
-                    FROM target
-                    WHERE target.uniprot_id = '{uniprot_id}'
-                ) AS test ON bioassay.protein_accession = test.protein_accession;
-            '''
-        )
-        results = self.cursor.fetchall()
+        self._execute('pubchem_bioassays_from_uniprot_id', uniprot_id)
         
         # TODO: user interface
         # TODO: SEPERATE BIOASSAY DATAFRAMES
         
-        # First element: assay data (JSON) --> convert to dataframe
-        results_df = pd.DataFrame.from_records(
-            [x[0] for x in results] # index w/ 0 bc there is a list of tuples for some reason
-        )
-        
-        # Add other fields to dataframe
-        results_df['bioassay_id'] = [x[1] for x in results]
-        results_df['protein_accession'] = [x[2] for x in results]
-        results_df['uniprot_id'] = [x[3] for x in results]
-        
-        # Get SMILES from substance IDs
-        substance_ids = tuple(results_df['sid'])
-        self.cursor.execute(
-            '''
-                SELECT *
-                FROM substance
-                WHERE substance_id IN %s
-            ''',
-            (substance_ids,)
-        )
+        return PubChemQuery._assay_data_frame(self.cursor.fetchall(),
+                                              ['bioassay_id', 'protein_accession', 'uniprot_id'])
+
+    def iter_bioassays_from_uniprot_id(self, uniprot_id:str,
+                                       chunk_size:int=10000) -> Generator[pd.DataFrame, None, None]:
+        """
+        Streaming get_bioassays_from_uniprot_id, see get_bioassays_for_uniprot_ids.
+
+        :param uniprot_id: UniProt ID of the target
+        :type uniprot_id: str
+        :param chunk_size: Number of data entries fetched per round trip, defaults to 10000
+        :type chunk_size: int, optional
+        :yield: Data entries with SMILES, entries whose substance is not in the substance table are left out
+        :rtype: Generator[pd.DataFrame, None, None]
+        """
+        return self.get_bioassays_for_uniprot_ids([uniprot_id], chunk_size=chunk_size)
+
+    def get_bioassays_for_uniprot_ids(self, uniprot_ids:Iterable[str],
+                                      chunk_size:int=10000) -> Generator[pd.DataFrame, None, None]:
+        """
+        Data entries of the bioassays of many targets from one set-based query, instead of one
+        get_bioassays_from_uniprot_id call per target. The IDs are sent as one array parameter and the entries are
+        read through a named (server-side) cursor chunk_size at a time and yielded as DataFrames, so memory does not
+        grow with the number of entries. Entries come in order of bioassay ID and then of their position in the
+        bioassay, so chunks are the same on every run. Chunks mix targets, each entry is tagged with its uniprot_id, and
+        have the columns of get_bioassays_from_uniprot_id that their entries have. The read-only transaction is rolled
+        back once the generator is exhausted or closed.
+
+        :param uniprot_ids: UniProt IDs of the targets
+        :type uniprot_ids: Iterable[str]
+        :param chunk_size: Number of data entries fetched per round trip, defaults to 10000
+        :type chunk_size: int, optional
+        :yield: Data entries with SMILES, entries whose substance is not in the substance table are left out
+        :rtype: Generator[pd.DataFrame, None, None]
+        """
+        try:
+            with self.connection.cursor(name=f'bioassays_{uuid.uuid4().hex}') as named_cursor:
+                named_cursor.itersize = chunk_size # rows per FETCH, chunks below are read one FETCH at a time
+                named_cursor.execute(PubChemQuery.__uniprot_ids_entry_query, (list(uniprot_ids),))
+                rows = iter(named_cursor)
+                while True:
+                    results = list(itertools.islice(rows, chunk_size))
+                    if not results:
+                        break
+
+                    # Consecutive entries of a bioassay as one group, in the form of the grouped queries
+                    groups = []
+                    for values, group in itertools.groupby(results, key=lambda x: x[3:]):
+                        group = list(group)
+                        groups.append(([x[0] for x in group], [x[1] for x in group],
+                                       '[' + ','.join(x[2] for x in group) + ']') + values)
+                    yield PubChemQuery._assay_data_frame(groups, ['bioassay_id', 'protein_accession', 'uniprot_id'])
+        finally:
+            self.connection.rollback() # ends the transaction the named cursor was declared in
+
+    @staticmethod
+    def _assay_data_frame(results:List[tuple], columns:List[str]) -> pd.DataFrame:
+        """
+        :param results: Rows of substance IDs, SMILES, serialized entries and assay_columns of a group of entries,
+            followed by the values of columns shared by the group
+        :type results: List[tuple]
+        :param columns: Names of the values after assay_columns
+        :type columns: List[str]
+        :return: One row per entry: sid, SMILES, the fields of the entry in the order of the source assays, then columns
+        :rtype: pd.DataFrame
+        """
+        # Assay data entries (JSON) --> convert to dataframe, sid and SMILES come typed from the substance table
+        entries = [entry for x in results for entry in json.loads(x[2])]
+        results_df = pd.DataFrame.from_records(entries, index=pd.RangeIndex(len(entries)))
+        results_df = results_df[PubChemQuery._ordered_columns(results_df.columns, [x[3] for x in results])]
+        results_df.insert(0, 'SMILES', [smiles for x in results for smiles in x[1]])
+        results_df.insert(0, 'sid', pd.array([sid for x in results for sid in x[0]], dtype='int64'))
         
-        # Merges SMILES on substance IDs
-        results_df = pd.merge(pd.DataFrame(self.cursor.fetchall(), columns=['sid', 'SMILES']), results_df, on='sid')
+        # Add other fields to dataframe, repeated for every entry of the group
+        for i, column in enumerate(columns, start=4):
+            results_df[column] = [x[i] for x in results for _ in x[0]]
         return results_df
     
+    @staticmethod
+    def _ordered_columns(columns:Iterable[str], assay_columns:List[Optional[List[str]]]) -> List[str]:
+        """
+        :param columns: Columns of a DataFrame built from JSONB entries, in the key order of JSONB
+        :type columns: Iterable[str]
+        :param assay_columns: assay_columns of the bioassays of the entries, None for bioassays loaded before it was
+            recorded
+        :type assay_columns: List[Optional[List[str]]]
+        :return: columns in the order of the source assays, columns they do not list keep their order at the end
+        :rtype: List[str]
+        """
+        columns = list(columns)
+        present = set(columns)
+        ordered = [column for column in dict.fromkeys(column for x in assay_columns if x is not None for column in x)
+                   if column in present]
+        listed = set(ordered)
+        return ordered + [column for column in columns if column not in listed]
+    
     def get_represented_uniprot_ids(self) -> List[str]:
-        self.cursor.execute(
-            '''
-                SELECT DISTINCT uniprot_id
-                FROM target
-            '''
-        )
+        self._execute('pubchem_represented_uniprot_ids')
         return [x[0] for x in self.cursor.fetchall()]
     
     def get_uniprot_ids_with_data(self) -> List[str]:
-        self.cursor.execute(
-            '''
-                SELECT DISTINCT target.uniprot_id
-                FROM target
-                JOIN bioassay
-                ON target.protein_accession = bioassay.protein_accession
-                WHERE bioassay.assay_data IS NOT NULL AND target.uniprot_id IS NOT NULL
-            '''
-        )
+        self._execute('pubchem_uniprot_ids_with_data')
         return [x[0] for x in self.cursor.fetchall()]
     
     def get_protein_accessions_with_data(self) -> List[str]:
-        self.cursor.execute(
-            '''
-                SELECT DISTINCT protein_accession
-                FROM bioassay
-                WHERE protein_accession IS NOT NULL AND protein_acces
-            '''
-        )
+        self._execute('pubchem_protein_accessions_with_data')
         return [x[0] for x in self.cursor.fetchall()]
     
     def get_bioassay_protein_accessions(self) -> List[str]:
-        self.cursor.execute(
-            '''
-                SELECT DISTINCT protein_accession
-                FROM bioassay
-                WHERE protein_accession IS NOT NULL
-            '''
-        )
+        self._execute('pubchem_bioassay_protein_accessions')
         return [x[0] for x in self.cursor.fetchall()]
     
     def get_organism_data_for_all_pubchem_uniprot_ids(self) -> Dict[str, List[str]]:
         pubchem_uniprot_ids = self.get_uniprot_ids_with_data() # get all unique uniprot IDs in the pubchem database
-        uniprot_query = UniProtQuery() # open a connection to UniProt database
-        out = uniprot_query.get_all_data_for_uniprot_ids(tuple(pubchem_uniprot_ids)) # get organism data for each \
-            # uniprot ID
-        uniprot_query.connection.close() # close the connection to the UniProt database
-        return out
+        with UniProtQuery() as uniprot_query: # borrow a pooled connection to UniProt database
+            return uniprot_query.get_all_data_for_uniprot_ids(tuple(pubchem_uniprot_ids)) # get organism data for \
+                # each uniprot ID
         
         
         
@@ -1,19 +1,35 @@
-import psycopg2
-from typing import Tuple
+from typing import Optional, Tuple
 import pandas as pd
+from autochem.PostgresPool import PostgresPool
 
 
 class UniProtQuery:
-    def __init__(self) -> None:
-        ########## Connect to DB ##########
-        host = 'localhost'
-        database = 'uniprot'
-        user = 'postgres'
-        password = 'Coll@bor@tions2020'
-        # port = '5432'
-        self.connection = psycopg2.connect(host=host, database=database, user=user, password=password)
+    def __init__(self, dsn:Optional[str]=None) -> None:
+        """
+        Queries the UniProt database over a connection borrowed from PostgresPool. Return it with close(), or use the
+        query as a context manager, so that other queries can reuse the connection.
+
+        :param dsn: Connection string, defaults to None for PostgresPool.dsn('uniprot')
+        :type dsn: Optional[str], optional
+        """
+        ########## Borrow connection to DB ##########
+        self.__dsn = PostgresPool.dsn('uniprot') if dsn is None else dsn
+        self.connection = PostgresPool.getconn(self.__dsn)
         self.cursor = self.connection.cursor()
         
+    def close(self) -> None:
+        """ Returns the connection to the pool. """
+        if self.connection is not None:
+            self.cursor.close()
+            PostgresPool.putconn(self.connection, self.__dsn)
+            self.connection = None
+        
+    def __enter__(self) -> 'UniProtQuery':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+        
     def get_all_data_for_uniprot_ids(self, uniprot_ids:Tuple[str]) -> pd.DataFrame:
         self.cursor.execute(
             '''
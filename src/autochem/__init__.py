@@ -1,4 +1,14 @@
 from autochem import api_client
 from autochem import database_build
+from autochem.PostgresPool import PostgresPool
 from autochem.PubChemQuery import PubChemQuery
 from autochem.UniProtQuery import UniProtQuery
+
+
+def __getattr__(name:str):
+    """ Imports PubChemDuckDBQuery on first use, so the package imports without duckdb (autochem[duckdb] extra). """
+    if name == 'PubChemDuckDBQuery':
+        from autochem.PubChemDuckDBQuery import PubChemDuckDBQuery
+        globals()[name] = PubChemDuckDBQuery # replaces the submodule the import bound to the same name
+        return PubChemDuckDBQuery
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
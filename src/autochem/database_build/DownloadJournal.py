@@ -0,0 +1,153 @@
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+
+class DownloadJournal():
+    def __init__(self, journal_path:str) -> None:
+        """
+        Persistent per-file state of a PubChem FTP download job. Directory listings are journaled along with the
+        state of every file in them, so a restarted job can skip finished files without listing the server or
+        re-checking anything on disk.
+
+        :param journal_path: Path to the SQLite file holding the journal, created if it does not exist
+        :type journal_path: str
+        """
+        self.__lock = threading.Lock() # download workers share one connection
+        self.__connection = sqlite3.connect(journal_path, check_same_thread=False)
+
+        with self.__lock:
+            self.__connection.executescript('''
+                CREATE TABLE IF NOT EXISTS listed_directory (
+                    directory TEXT PRIMARY KEY -- directory on the FTP server whose files are all in download_job
+                );
+                CREATE TABLE IF NOT EXISTS download_job (
+                    path TEXT PRIMARY KEY, -- path on the FTP server
+                    directory TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    size INTEGER, -- size reported by the server when listed
+                    mdtm TEXT, -- modification time reported by the server when listed
+                    state TEXT NOT NULL DEFAULT 'pending' CHECK (state IN ('pending', 'done', 'bad')),
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    bytes INTEGER NOT NULL DEFAULT 0, -- bytes transferred over all attempts
+                    seconds REAL NOT NULL DEFAULT 0 -- time spent transferring over all attempts
+                );
+            ''')
+            self.__connection.commit()
+
+    def record_listing(self, directory:str, remote_files:Dict[str, Tuple[Optional[int], Optional[str]]]) -> None:
+        """
+        Journals the files listed in a directory on the server. New files are added as pending; files already in
+        the journal keep their state but get the latest size and modification time.
+
+        :param directory: Directory on the FTP server
+        :type directory: str
+        :param remote_files: Mapper from filename to (size, mdtm)
+        :type remote_files: Dict[str, Tuple[Optional[int], Optional[str]]]
+        """
+        with self.__lock:
+            self.__connection.executemany(
+                '''
+                    INSERT INTO download_job (path, directory, filename, size, mdtm) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (path) DO UPDATE SET size = excluded.size, mdtm = excluded.mdtm
+                ''',
+                [(directory + filename, directory, filename, size, mdtm)
+                 for filename, (size, mdtm) in remote_files.items()]
+            )
+            self.__connection.execute('INSERT OR IGNORE INTO listed_directory (directory) VALUES (?)', (directory,))
+            self.__connection.commit()
+
+    def listing(self, directory:str) -> Optional[Dict[str, Tuple[Optional[int], Optional[str]]]]:
+        """
+        Gets the journaled listing of a directory.
+
+        :param directory: Directory on the FTP server
+        :type directory: str
+        :return: Mapper from filename to (size, mdtm), None if the directory has never been listed
+        :rtype: Optional[Dict[str, Tuple[Optional[int], Optional[str]]]]
+        """
+        with self.__lock:
+            if self.__connection.execute('SELECT 1 FROM listed_directory WHERE directory = ?',
+                                         (directory,)).fetchone() is None:
+                return None
+            rows = self.__connection.execute('SELECT filename, size, mdtm FROM download_job WHERE directory = ?',
+                                             (directory,)).fetchall()
+        return {filename: (size, mdtm) for filename, size, mdtm in rows}
+
+    def state(self, path:str) -> Optional[str]:
+        """
+        :param path: Path to the file on the FTP server
+        :type path: str
+        :return: 'pending', 'done' or 'bad', None if the file is not in the journal
+        :rtype: Optional[str]
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT state FROM download_job WHERE path = ?', (path,)).fetchone()
+        return row[0] if row is not None else None
+
+    def start_attempt(self, path:str) -> None:
+        """
+        Marks a file as pending and counts a new download attempt.
+
+        :param path: Path to the file on the FTP server
+        :type path: str
+        """
+        with self.__lock:
+            self.__connection.execute(
+                '''
+                    INSERT INTO download_job (path, directory, filename, attempts) VALUES (?, ?, ?, 1)
+                    ON CONFLICT (path) DO UPDATE SET state = 'pending', attempts = attempts + 1
+                ''',
+                (path, *DownloadJournal._split_path(path))
+            )
+            self.__connection.commit()
+
+    def add_transfer(self, path:str, n_bytes:int, seconds:float) -> None:
+        """
+        Adds the bytes and time of one transfer of a file to its totals.
+
+        :param path: Path to the file on the FTP server
+        :type path: str
+        :param n_bytes: Bytes transferred
+        :type n_bytes: int
+        :param seconds: Time spent transferring
+        :type seconds: float
+        """
+        with self.__lock:
+            self.__connection.execute('UPDATE download_job SET bytes = bytes + ?, seconds = seconds + ? WHERE path = ?',
+                                      (n_bytes, seconds, path))
+            self.__connection.commit()
+
+    def set_state(self, path:str, state:str) -> None:
+        """
+        :param path: Path to the file on the FTP server
+        :type path: str
+        :param state: 'pending', 'done' or 'bad'
+        :type state: str
+        """
+        with self.__lock:
+            self.__connection.execute(
+                '''
+                    INSERT INTO download_job (path, directory, filename, state) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (path) DO UPDATE SET state = excluded.state
+                ''',
+                (path, *DownloadJournal._split_path(path), state)
+            )
+            self.__connection.commit()
+
+    @staticmethod
+    def _split_path(path:str) -> Tuple[str, str]:
+        """
+        Splits a server path into its directory (with trailing '/', as used by PubChemFTP) and filename.
+
+        :param path: Path to the file on the FTP server
+        :type path: str
+        :return: (directory, filename)
+        :rtype: Tuple[str, str]
+        """
+        directory, _, filename = path.rpartition('/')
+        return (directory + '/' if directory else ''), filename
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
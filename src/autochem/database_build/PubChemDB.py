@@ -2,14 +2,17 @@ import json
 import pandas as pd
 import copy
 import zipfile
-from typing import List, Dict, Optional, Generator
+from typing import List, Dict, Optional, Generator, Iterable, Iterator, Callable, Any, Tuple, Set
 import gzip
 import os
 from tqdm import tqdm
-from rdkit.Chem import PandasTools
-import naclo
-from __ABCChemDB import __ABCChemDB
+from rdkit import Chem
+from .__ABCChemDB import __ABCChemDB
+from .PubChemFTP import PubChemFTP
+from ..PostgresPool import PostgresPool
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
 from functools import wraps
 from rdkit import RDLogger
 from rdkit.rdBase import LogStatus as RDLogStatus
@@ -18,6 +21,22 @@ import json
 import requests
 import time
 import logging
+import io
+import re
+import tempfile
+import pickle
+import itertools
+import gc
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+try: # optional, parses bytes without decoding them to str first and several times faster than json
+    import orjson
+except ImportError:
+    orjson = None
+try: # optional, needed to stream bioassay JSON
+    import ijson
+except ImportError:
+    ijson = None
 
 
 def _rdkit_stfu(func):
@@ -51,75 +70,259 @@ def psql_query(connection, sql: str, vars: tuple = (), testing_mode: bool = Fals
             connection.commit()
     return rows
 
+def _json_loads(contents:bytes) -> Any:
+    """ Parses UTF-8 JSON bytes with orjson if it is installed, json otherwise. Raises ValueError if contents are not
+    UTF-8 or not JSON. """
+    # Parsed JSON has no reference cycles, but the millions of dicts of a large assay trigger repeated full
+    # collections that rescan all of them, which doubles the parse time
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return orjson.loads(contents) if orjson is not None else json.loads(contents)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+def _ijson_value(events:Iterator[Tuple[str, Any]], event:str, value:Any) -> Any:
+    """ Builds the JSON value that starts with (event, value) from the ijson.basic_parse events that follow it. """
+    builder = ijson.ObjectBuilder()
+    builder.event(event, value)
+    depth = 1 if event in ('start_map', 'start_array') else 0
+    while depth:
+        event, value = next(events)
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+    return builder.value
+
+def _ijson_array_items(events:Iterator[Tuple[str, Any]]) -> Generator[Any, None, None]:
+    """ Yields the items of the JSON array whose start_array event was the last one taken from events. """
+    try:
+        for event, value in events:
+            if event == 'end_array':
+                return
+            yield _ijson_value(events, event, value)
+    except ijson.JSONError as e:
+        raise ValueError(f'Malformed JSON: {e}') from e
+
+def _copy_text_field(value:Any) -> str:
+    """ Formats a value as a field of PostgreSQL's COPY text format, where NULL is \\N and backslashes, tabs and
+    newlines are escaped. """
+    if value is None:
+        return '\\N'
+    if isinstance(value, list): # array literal, e.g. ['sid', 'outcome'] --> {"sid","outcome"}
+        value = '{' + ','.join('"' + str(item).replace('\\', '\\\\').replace('"', '\\"') + '"' for item in value) + '}'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _write_copy_text(file:io.TextIOBase, rows:Iterable[tuple]) -> None:
+    """ Writes rows to a file in PostgreSQL's COPY text format. """
+    for row in rows:
+        file.write('\t'.join(_copy_text_field(value) for value in row))
+        file.write('\n')
+
+def _read_copy_text(file:io.TextIOBase) -> Generator[tuple, None, None]:
+    """ Reads back rows written by _write_copy_text. Values are strings or None. """
+    unescape_map = {'t': '\t', 'n': '\n', 'r': '\r', '\\': '\\'}
+    for line in file:
+        yield tuple(None if field == '\\N' else re.sub(r'\\(.)', lambda match: unescape_map[match.group(1)], field)
+                    for field in line.rstrip('\n').split('\t'))
+
+def copy_rows(cursor, table:str, columns:List[str], rows:Iterable[tuple]) -> None:
+    """
+    Streams rows into a table with a single COPY ... FROM STDIN. Does not commit.
+
+    :param cursor: psycopg2 cursor
+    :type cursor: psycopg2.extensions.cursor
+    :param table: Table to copy into
+    :type table: str
+    :param columns: Columns of the table, in the order of the values in each row
+    :type columns: List[str]
+    :param rows: Rows to copy
+    :type rows: Iterable[tuple]
+    """
+    buffer = io.StringIO()
+    _write_copy_text(buffer, rows)
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', buffer)
+
+def _batched(items:Iterable, batch_size:int, weight:Optional[Callable[[Any], int]]=None,
+             max_weight:Optional[int]=None) -> Iterator[list]:
+    """ Splits items into lists of batch_size items, the last of which may be shorter. If weight is given, a list is
+    also closed as soon as the weights of its items add up to max_weight. """
+    if weight is None:
+        iterator = iter(items)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                return
+            yield batch
+    
+    batch = []
+    batch_weight = 0
+    for item in items:
+        batch.append(item)
+        batch_weight += weight(item)
+        if len(batch) >= batch_size or batch_weight >= max_weight:
+            yield batch
+            batch = []
+            batch_weight = 0
+    if batch:
+        yield batch
+
+def _bounded_ordered_map(executor:Executor, func:Callable, items:Iterable, max_in_flight:int) -> Iterator[Any]:
+    """
+    Like executor.map but never has more than max_in_flight items submitted at once, so finished results cannot pile up
+    in memory while the caller is still consuming earlier ones. Results are yielded in the order of items.
+    """
+    in_flight = deque()
+    for item in items:
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+        in_flight.append(executor.submit(func, item))
+    while in_flight:
+        yield in_flight.popleft().result()
+
+def _bioassay_zip_dir_to_shard(args:Tuple[str, str, bool]) -> Optional[Exception]:
+    """
+    Process pool worker for PubChemDB.repopulate_bioassay_table. Pickles the rows of a zip directory to a shard file
+    as _bioassay_zip_dir_row_generator yields them, so a worker holds no more rows at a time than the serial path,
+    see _read_bioassay_shard.
+
+    :param args: (zip_dir_path, shard_path, stream)
+    :type args: Tuple[str, str, bool]
+    :return: Error raised part way through the zip directory, returned rather than raised, which would raise it in the
+        caller as soon as the results are advanced rather than where it reads the rows of this zip directory, else
+        None
+    :rtype: Optional[Exception]
+    """
+    zip_dir_path, shard_path, stream = args
+    with open(shard_path, 'wb') as file:
+        try:
+            for assay_rows in PubChemDB._bioassay_zip_dir_row_generator(zip_dir_path, stream=stream):
+                pickle.dump(assay_rows, file, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            return e
+    return None
+
+def _read_bioassay_shard(shard_path:str, error:Optional[Exception]) -> Generator[tuple, None, None]:
+    """ Yields the rows of a shard written by _bioassay_zip_dir_to_shard one at a time and deletes it, then raises
+    the error of the worker, as the serial generator would. """
+    try:
+        with open(shard_path, 'rb') as file:
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError: # end of the shard
+                    break
+    finally:
+        os.remove(shard_path)
+    if error is not None:
+        raise error
+
+@_rdkit_stfu
+def _substance_sdf_to_shard(args:Tuple[str, str, int, bool]) -> Optional[str]:
+    """
+    Process pool worker for PubChemDB.repopulate_substance_table. Converts one .sdf.gz file to a shard of
+    (substance_id, smiles) rows in COPY text format.
+
+    :param args: (sdf_gz_path, shard_path, chunk_size, fast_smiles)
+    :type args: Tuple[str, str, int, bool]
+    :return: Error message if the file could not be converted, else None
+    :rtype: Optional[str]
+    """
+    sdf_gz_path, shard_path, chunk_size, fast_smiles = args
+    try:
+        with open(shard_path, 'w') as shard:
+            for rows in PubChemDB._substance_sdf_chunk_generator(sdf_gz_path, chunk_size, fast_smiles):
+                _write_copy_text(shard, rows)
+    except Exception as e: # returned rather than raised so the writer can record it in substance_errors
+        return str(e)
+    return None
+
 class PubChemDB(__ABCChemDB):
-    def __init__(self, bioassay_json_dir_path:str, substance_sdf_dir_path:str, protein2xrefs_path:str) -> None:
+    # Class level so that the static row builders can run in worker processes without a database connection
+    __activity_outcome_map = { # sourced from: https://ftp.ncbi.nlm.nih.gov/pubchem/Bioassay/pcassay2.asn
+        1: 'inactive',
+        2: 'active',
+        3: 'inconclusive',
+        4: 'unspecified',
+        5: 'probe'
+    }
+
+    __possible_non_tid_bioassay_columns = [ # sourced from: \
+        # https://ftp.ncbi.nlm.nih.gov/pubchem/Bioassay/pcassay2.asn
+        'sid',
+        'sid_source', # source says "sid-source" but it is actually "sid_source"
+        'version',
+        'comment',
+        'outcome',
+        'rank',
+        'data',
+        'url',
+        'xref',
+        'date'
+    ]
+
+    __unit_map = { # sourced from: https://ftp.ncbi.nlm.nih.gov/pubchem/Bioassay/pcassay2.asn
+        1: 'ppt',
+        2: 'ppm',
+        3: 'ppb',
+        4: 'mm',
+        5: 'um',
+        6: 'nm',
+        7: 'pm',
+        8: 'fm',
+        9: 'mgml',
+        10: 'ugml',
+        11: 'ngml',
+        12: 'pgml',
+        13: 'fgml',
+        14: 'm',
+        15: 'percent',
+        16: 'ratio',
+        17: 'sec',
+        18: 'rsec',
+        19: 'min',
+        20: 'rmin',
+        21: 'day',
+        22: 'rday',
+        23: 'ml-min-kg',
+        24: 'l-kg',
+        25: 'hr-ng-ml',
+        26: 'cm-sec',
+        27: 'mg-kg',
+        254: 'none',
+        255: 'unspecified'
+    }
+    
+    # Full sanitization minus the steps SMILES output does not depend on (hybridization stays, chirality cleanup
+    # needs it)
+    __fast_smiles_sanitize_ops = Chem.SanitizeFlags.SANITIZE_ALL ^ Chem.SanitizeFlags.SANITIZE_SETCONJUGATION ^ \
+        Chem.SanitizeFlags.SANITIZE_CLEANUPATROPISOMERS
+    
+    # Stages of build in dependency order, bioassay rows reference target
+    build_stages = ('target', 'substance', 'bioassay')
+    
+    def __init__(self, bioassay_json_dir_path:str, substance_sdf_dir_path:str, protein2xrefs_path:str,
+                 dsn:Optional[str]=None) -> None:
         self.bioassay_json_dir_path = bioassay_json_dir_path
         self.substance_sdf_dir_path = substance_sdf_dir_path
         self.protein2xrefs_path = protein2xrefs_path
         
-        self.__activity_outcome_map = { # sourced from: https://ftp.ncbi.nlm.nih.gov/pubchem/Bioassay/pcassay2.asn
-            1: 'inactive',
-            2: 'active',
-            3: 'inconclusive',
-            4: 'unspecified',
-            5: 'probe'
-        }
-        
-        self.__possible_non_tid_bioassay_columns = [ # sourced from: \
-            # https://ftp.ncbi.nlm.nih.gov/pubchem/Bioassay/pcassay2.asn
-            'sid',
-            'sid_source', # source says "sid-source" but it is actually "sid_source"
-            'version',
-            'comment',
-            'outcome',
-            'rank',
-            'data',
-            'url',
-            'xref',
-            'date'
-        ]
-        
-        self.__unit_map = { # sourced from: https://ftp.ncbi.nlm.nih.gov/pubchem/Bioassay/pcassay2.asn
-            1: 'ppt',
-            2: 'ppm',
-            3: 'ppb',
-            4: 'mm',
-            5: 'um',
-            6: 'nm',
-            7: 'pm',
-            8: 'fm',
-            9: 'mgml',
-            10: 'ugml',
-            11: 'ngml',
-            12: 'pgml',
-            13: 'fgml',
-            14: 'm',
-            15: 'percent',
-            16: 'ratio',
-            17: 'sec',
-            18: 'rsec',
-            19: 'min',
-            20: 'rmin',
-            21: 'day',
-            22: 'rday',
-            23: 'ml-min-kg',
-            24: 'l-kg',
-            25: 'hr-ng-ml',
-            26: 'cm-sec',
-            27: 'mg-kg',
-            254: 'none',
-            255: 'unspecified'
-        }
-        
-        ########## Connect to DB ##########
-        host = 'localhost'
-        database = 'pubchem'
-        user = 'postgres'
-        password = 'Coll@bor@tions2020'
-        # port = '5432'
-        self.connection = psycopg2.connect(host=host, database=database, user=user, password=password)
+        ########## Borrow connection to DB ##########
+        self.__dsn = PostgresPool.dsn('pubchem') if dsn is None else dsn
+        self.connection = PostgresPool.getconn(self.__dsn)
         self.cursor = self.connection.cursor()
         
+    def close(self) -> None:
+        """ Returns the connection to the pool. """
+        if self.connection is not None:
+            self.cursor.close()
+            PostgresPool.putconn(self.connection, self.__dsn)
+            self.connection = None
+        
     @property
     def _activity_outcome_map(self) -> Dict[int, str]:
         """
@@ -217,15 +420,88 @@ class PubChemDB(__ABCChemDB):
             if t_diff < 0.20:
                 time.sleep(0.20 - t_diff)  # NOTE: Required because PubChem API has a limit of 5 requests per second
         
-    def build(self):
-        self.repopulate_protein_target_table() # NOTE: done
-        self.repopulate_substance_table()
-        self.repopulate_bioassay_table()
-        pass
+    def build(self, stages:Optional[List[str]]=None, resume:bool=False, n_workers:int=1,
+              stream_json:bool=False) -> None:
+        """
+        Builds the database stage by stage, in the order of PubChemDB.build_stages. Every input file is committed in
+        its own transaction together with its checkpoint, so a build that stops part way can be resumed: with resume,
+        tables are not cleared and files already checkpointed are skipped. The target and substance stages checkpoint
+        files in build_checkpoint, the bioassay stage checkpoints each archive with its checksum in bioassay_archive.
+
+        :param stages: Stages to run, any of PubChemDB.build_stages, defaults to all of them
+        :type stages: Optional[List[str]], optional
+        :param resume: Whether to keep what earlier builds committed and only load files not checkpointed yet,
+            defaults to False
+        :type resume: bool, optional
+        :param n_workers: Number of processes that parse substance and bioassay files, defaults to 1
+        :type n_workers: int, optional
+        :param stream_json: Whether to parse bioassay JSON incrementally, see repopulate_bioassay_table, defaults to
+            False
+        :type stream_json: bool, optional
+        """
+        stages = list(PubChemDB.build_stages) if stages is None else stages
+        unknown_stages = set(stages) - set(PubChemDB.build_stages)
+        if unknown_stages:
+            raise ValueError(f'Unknown build stages {sorted(unknown_stages)}, expected any of {PubChemDB.build_stages}')
+        
+        if 'bioassay' in stages and not resume:
+            self._clear_bioassay_tables() # first, bioassay rows would block clearing target
+        
+        for stage in PubChemDB.build_stages: # dependency order regardless of the order given
+            if stage not in stages:
+                continue
+            print(f'########## {"Resuming" if resume else "Building"} {stage} stage ##########')
+            if stage == 'target':
+                self.repopulate_protein_target_table(resume=resume)
+            elif stage == 'substance':
+                self.repopulate_substance_table(n_workers=n_workers, resume=resume)
+            else:
+                self._build_bioassay_tables(n_workers=n_workers, stream=stream_json, resume=resume)
+    
+    def _create_checkpoint_table(self) -> None:
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS build_checkpoint (
+                stage TEXT NOT NULL, -- one of PubChemDB.build_stages
+                input_file TEXT NOT NULL, -- filename whose rows are all committed
+                committed_at TIMESTAMP NOT NULL DEFAULT now(),
+                PRIMARY KEY (stage, input_file)
+            )
+        ''')
+    
+    def _checkpointed_files(self, stage:str) -> Set[str]:
+        """
+        :param stage: One of PubChemDB.build_stages
+        :type stage: str
+        :return: Filenames of the stage that are fully committed
+        :rtype: Set[str]
+        """
+        self.cursor.execute('SELECT input_file FROM build_checkpoint WHERE stage = %s', (stage,))
+        return {row[0] for row in self.cursor.fetchall()}
+    
+    def _checkpoint(self, stage:str, input_file:str) -> None:
+        """ Records input_file as fully committed. Does not commit, so the checkpoint lands in the same transaction as
+        the rows of the file. """
+        self.cursor.execute('''
+            INSERT INTO build_checkpoint (stage, input_file) VALUES (%s, %s)
+            ON CONFLICT (stage, input_file) DO UPDATE SET committed_at = now()
+        ''', (stage, input_file))
     
-    def repopulate_protein_target_table(self):
+    def repopulate_protein_target_table(self, resume:bool=False) -> None:
+        """
+        Clears the target table and reloads it from protein2xrefs_path in one transaction.
+
+        :param resume: Whether to keep the table as it is if protein2xrefs_path was already loaded, defaults to False
+        :type resume: bool, optional
+        """
+        self._create_checkpoint_table()
+        input_file = os.path.basename(self.protein2xrefs_path)
+        if resume and input_file in self._checkpointed_files('target'):
+            print(f'Skipping {input_file}, already loaded')
+            return
+        
         # Clear existing data to avoid duplication
         self.cursor.execute('DELETE FROM target')
+        self.cursor.execute("DELETE FROM build_checkpoint WHERE stage = 'target'")
         
         df = pd.read_csv(self.protein2xrefs_path, delimiter='\t')
         
@@ -238,11 +514,12 @@ class PubChemDB(__ABCChemDB):
         df = df.drop_duplicates(subset=['ProteinAccession'], keep='first')
         # NOTE: FIX THIS #####
         
-        # Insert each row into table
-        for _, row in df.iterrows():
-            self.cursor.execute('INSERT INTO target (protein_accession, gene_id, ref_seq, uniprot_id) VALUES (%s, %s)',
-                                (row['ProteinAccession'], row['GeneID'], row['RefSeq'], row['UniProt']))
-
+        # Insert each row into table, as tuples since iterrows turns None back into NaN
+        for row in df[['ProteinAccession', 'GeneID', 'RefSeq', 'UniProt']].values.tolist():
+            self.cursor.execute('INSERT INTO target (protein_accession, gene_id, ref_seq, uniprot_id) VALUES (%s, %s, '
+                                '%s, %s)', row)
+        
+        self._checkpoint('target', input_file)
         self.connection.commit()
         
         
@@ -265,72 +542,737 @@ class PubChemDB(__ABCChemDB):
         self.connection.commit()
         
     @_rdkit_stfu
-    def repopulate_substance_table(self) -> None:
-        # Clear existing data to avoid duplication
-        self.cursor.execute('DELETE FROM substance')
-        self.cursor.execute('DELETE FROM substance_errors')
-        self.connection.commit()
+    def repopulate_substance_table(self, page_size:int=10000, chunk_size:int=10000, n_workers:int=1,
+                                   shard_dir_path:Optional[str]=None, fast_smiles:bool=False,
+                                   resume:bool=False) -> None:
+        """
+        Clears the substance table and reloads it from every .sdf.gz file in substance_sdf_dir_path. Each file is
+        streamed in chunks of chunk_size molecules and loaded with COPY in its own transaction, falling back to
+        execute_values pages of page_size rows if COPY is rejected, where pages that are rejected too are skipped.
+        Secondary indexes on substance are dropped for the load and rebuilt once it finishes. Files that fail to load
+        are recorded in substance_errors, files that load are checkpointed in build_checkpoint in the same transaction.
 
-        for filename in tqdm(os.listdir(self.substance_sdf_dir_path)):
-            if filename.endswith('.sdf.gz'):
-                try:
-                    df = PandasTools.LoadSDF(os.path.join(self.substance_sdf_dir_path, filename))
-                    # Delete unnecessary columns
-                    df = df[['PUBCHEM_SUBSTANCE_ID', 'ROMol']]
-                    # Add SMILES from MOLs
-                    df = naclo.dataframes.df_mols_2_smiles(df, 'ROMol', 'smiles')
-                    # Remove MOLs, only keep SMILES
-                    df = df.drop('ROMol', axis=1)
-                    
-                    # Replace w/ None instead of NaN because NaN is a string while None is recognized as NULL
-                    df = df.replace({np.nan: None})
+        :param page_size: Rows per execute_values statement in the fallback path, defaults to 10000
+        :type page_size: int, optional
+        :param chunk_size: Molecules parsed and loaded at a time, defaults to 10000
+        :type chunk_size: int, optional
+        :param n_workers: Number of processes that each convert one file at a time to a shard file, which this process
+            then loads with COPY, defaults to 1
+        :type n_workers: int, optional
+        :param shard_dir_path: Directory for shard files when n_workers > 1, defaults to the system temporary directory
+        :type shard_dir_path: Optional[str], optional
+        :param fast_smiles: Whether to skip the sanitization steps SMILES generation does not need, see
+            _fast_mol_to_smiles, defaults to False
+        :type fast_smiles: bool, optional
+        :param resume: Whether to keep the table as it is and only load files not checkpointed yet, retrying files that
+            failed before, defaults to False
+        :type resume: bool, optional
+        """
+        self._create_checkpoint_table()
+        filenames = [filename for filename in os.listdir(self.substance_sdf_dir_path) if filename.endswith('.sdf.gz')]
+        
+        if resume:
+            checkpointed_files = self._checkpointed_files('substance')
+            print(f'Skipping {sum(filename in checkpointed_files for filename in filenames)} files already loaded')
+            filenames = [filename for filename in filenames if filename not in checkpointed_files]
+            self.cursor.execute('DELETE FROM substance_errors WHERE filename = ANY(%s)',
+                                ([filename.split('.')[0] for filename in filenames],))
+        else:
+            # Clear existing data to avoid duplication
+            self.cursor.execute('DELETE FROM substance')
+            self.cursor.execute('DELETE FROM substance_errors')
+            self.cursor.execute("DELETE FROM build_checkpoint WHERE stage = 'substance'")
+        self.connection.commit()
+        
+        index_definitions = self._drop_secondary_indexes('substance')
+        try:
+            if n_workers <= 1:
+                for filename in tqdm(filenames):
+                    try:
+                        for rows in PubChemDB._substance_sdf_chunk_generator(
+                            os.path.join(self.substance_sdf_dir_path, filename), chunk_size, fast_smiles):
+                            buffer = io.StringIO()
+                            _write_copy_text(buffer, rows)
+                            buffer.seek(0)
+                            self._load_substance_copy_text(buffer, page_size)
+                        self._checkpoint('substance', filename)
+                    except Exception as e:
+                        self._record_substance_error(filename, str(e))
                     
-                    # Insert each row into table
-                    for _, row in df.iterrows():
-                        self.cursor.execute('INSERT INTO substance (substance_id, smiles) VALUES (%s, %s)',
-                                            (row['PUBCHEM_SUBSTANCE_ID'], row['smiles']))
-
+                    # Commit executions
+                    self.connection.commit()
+            else:
+                self._parallel_repopulate_substance_table(filenames, page_size, chunk_size, n_workers, shard_dir_path,
+                                                          fast_smiles)
+        finally:
+            self._create_indexes(index_definitions)
+    
+    def _parallel_repopulate_substance_table(self, filenames:List[str], page_size:int, chunk_size:int, n_workers:int,
+                                             shard_dir_path:Optional[str], fast_smiles:bool=False) -> None:
+        """ Worker processes convert one file each to a shard; this process is the only DB writer and loads each shard
+        in its own transaction, in the order of filenames. """
+        with tempfile.TemporaryDirectory(prefix='substance_shards_', dir=shard_dir_path) as shard_dir, \
+             ProcessPoolExecutor(max_workers=n_workers) as executor:
+            shard_paths = [os.path.join(shard_dir, f"{filename.split('.')[0]}.tsv") for filename in filenames]
+            jobs = [(os.path.join(self.substance_sdf_dir_path, filename), shard_path, chunk_size, fast_smiles)
+                    for filename, shard_path in zip(filenames, shard_paths)]
+            
+            # Window keeps at most 2 * n_workers finished shards waiting on disk
+            for filename, shard_path, error in tqdm(zip(filenames, shard_paths,
+                                                        _bounded_ordered_map(executor, _substance_sdf_to_shard, jobs,
+                                                                             2 * n_workers)),
+                                                    total=len(filenames)):
+                try:
+                    if error is not None:
+                        raise RuntimeError(error)
+                    with open(shard_path, 'r') as shard:
+                        self._load_substance_copy_text(shard, page_size)
+                    self._checkpoint('substance', filename)
                 except Exception as e:
-                    self.cursor.execute('INSERT INTO substance_errors (filename, error_message) VALUES (%s, %s)',
-                                        (filename.split('.')[0], str(e)))
+                    self._record_substance_error(filename, str(e))
                 
-                # Commit executions
                 self.connection.commit()
+                if os.path.exists(shard_path):
+                    os.remove(shard_path)
+    
+    def _record_substance_error(self, filename:str, error_message:str) -> None:
+        """ Rolls back the current file so nothing from it is kept, then records the failure in substance_errors. Does
+        not commit. """
+        self.connection.rollback()
+        self.cursor.execute('INSERT INTO substance_errors (filename, error_message) VALUES (%s, %s)',
+                            (filename.split('.')[0], error_message))
+    
+    @staticmethod
+    def _substance_sdf_chunk_generator(sdf_gz_path:str, chunk_size:int=10000,
+                                       fast_smiles:bool=False) -> Generator[List[Tuple[str, str]], None, None]:
+        """
+        Streams a .sdf.gz file with ForwardSDMolSupplier, keeping only the substance ID and SMILES of each molecule, so
+        memory use does not grow with the size of the file. Molecules RDKit cannot parse or write as SMILES, or that
+        have no PUBCHEM_SUBSTANCE_ID, are skipped.
+
+        :param sdf_gz_path: Path to .sdf.gz file
+        :type sdf_gz_path: str
+        :param chunk_size: Maximum number of rows per chunk, defaults to 10000
+        :type chunk_size: int, optional
+        :param fast_smiles: Whether to use _fast_mol_to_smiles instead of fully sanitizing each molecule, defaults to
+            False
+        :type fast_smiles: bool, optional
+        :yield: Chunk of (substance_id, smiles) rows
+        :rtype: Generator[List[Tuple[str, str]], None, None]
+        """
+        with gzip.open(sdf_gz_path, 'rb') as file:
+            rows = []
+            for mol in Chem.ForwardSDMolSupplier(file, sanitize=not fast_smiles, removeHs=not fast_smiles):
+                if mol is None or not mol.HasProp('PUBCHEM_SUBSTANCE_ID'):
+                    continue
+                try:
+                    smiles = PubChemDB._fast_mol_to_smiles(mol) if fast_smiles else Chem.MolToSmiles(mol)
+                except Exception:
+                    continue
+                
+                rows.append((mol.GetProp('PUBCHEM_SUBSTANCE_ID'), smiles))
+                if len(rows) >= chunk_size:
+                    yield rows
+                    rows = []
+            if rows:
+                yield rows
+    
+    @staticmethod
+    def _fast_mol_to_smiles(mol:Chem.Mol) -> str:
+        """
+        Writes the SMILES of a molecule parsed without sanitization, skipping the sanitization steps SMILES generation
+        does not depend on. Molecules those steps reject go through full sanitization instead, which raises for
+        molecules the default path would also have skipped.
+
+        :param mol: Molecule read with sanitize=False and removeHs=False
+        :type mol: Chem.Mol
+        :return: Same SMILES as Chem.MolToSmiles on the fully sanitized molecule
+        :rtype: str
+        """
+        try:
+            # Always a copy, so a failed attempt leaves mol untouched for the fallback
+            fast_mol = Chem.RemoveHs(mol, sanitize=False) if mol.GetNumHeavyAtoms() != mol.GetNumAtoms() else \
+                Chem.Mol(mol)
+            fast_mol.UpdatePropertyCache(strict=True)
+            Chem.SanitizeMol(fast_mol, PubChemDB.__fast_smiles_sanitize_ops)
+        except Exception: # fall back to full RDKit processing
+            return Chem.MolToSmiles(Chem.RemoveHs(mol))
+        return Chem.MolToSmiles(fast_mol)
+    
+    def _load_substance_copy_text(self, file:io.TextIOBase, page_size:int=10000) -> None:
+        """
+        Loads (substance_id, smiles) rows in COPY text format into substance in the current transaction with COPY. If
+        COPY rejects the rows, they are inserted again in pages of page_size rows with execute_values, each page under
+        its own savepoint, so only the pages holding a bad row (e.g. a substance ID loaded twice) are skipped and
+        logged. Does not commit.
+
+        :param file: Seekable file of rows written by _write_copy_text
+        :type file: io.TextIOBase
+        :param page_size: Rows per execute_values statement, defaults to 10000
+        :type page_size: int, optional
+        """
+        self.cursor.execute('SAVEPOINT substance_copy')
+        try:
+            self.cursor.copy_expert('COPY substance (substance_id, smiles) FROM STDIN', file)
+        except psycopg2.Error as e:
+            print(f'COPY rejected, inserting pages of {page_size} rows instead: {type(e).__name__} {e}')
+            self.cursor.execute('ROLLBACK TO SAVEPOINT substance_copy')
+            file.seek(0)
+            for page in _batched(_read_copy_text(file), page_size):
+                self.cursor.execute('SAVEPOINT substance_page')
+                try:
+                    execute_values(self.cursor, 'INSERT INTO substance (substance_id, smiles) VALUES %s', page,
+                                   page_size=page_size)
+                except psycopg2.Error as e:
+                    print(f'Skipping {len(page)} substances {page[0][0]} to {page[-1][0]}: {type(e).__name__} {e}')
+                    self.cursor.execute('ROLLBACK TO SAVEPOINT substance_page')
+                self.cursor.execute('RELEASE SAVEPOINT substance_page')
+        self.cursor.execute('RELEASE SAVEPOINT substance_copy')
+    
+    def _drop_secondary_indexes(self, table:str) -> List[str]:
+        """
+        Drops every index on a table that does not back a constraint (primary key, unique, exclusion), so that bulk
+        loads do not have to maintain them row by row.
+
+        :param table: Table name
+        :type table: str
+        :return: CREATE INDEX statements of the dropped indexes, for _create_indexes
+        :rtype: List[str]
+        """
+        self.cursor.execute('''
+            SELECT index_namespace.nspname, index_class.relname, pg_get_indexdef(pg_index.indexrelid)
+            FROM pg_index
+            JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+            JOIN pg_namespace index_namespace ON index_namespace.oid = index_class.relnamespace
+            WHERE pg_index.indrelid = %s::regclass
+                AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE pg_constraint.conindid = pg_index.indexrelid)
+        ''', (table,))
+        indexes = self.cursor.fetchall()
+        
+        for schema, index_name, index_definition in indexes:
+            print(f'Dropping index until the {table} load finishes: {index_definition}') # logged in case it never does
+            self.cursor.execute(sql.SQL('DROP INDEX {}').format(sql.Identifier(schema, index_name)))
+        self.connection.commit()
+        return [index_definition for _, _, index_definition in indexes]
+    
+    def _create_indexes(self, index_definitions:List[str]) -> None:
+        """
+        Rebuilds indexes dropped by _drop_secondary_indexes.
+
+        :param index_definitions: CREATE INDEX statements
+        :type index_definitions: List[str]
+        """
+        self.connection.rollback() # in case the load stopped mid-transaction
+        for index_definition in tqdm(index_definitions, desc='Rebuilding indexes', disable=not index_definitions):
+            self.cursor.execute(index_definition)
+            self.connection.commit()
                 
-    def repopulate_bioassay_table(self, protein_only:bool=True) -> None:
+    def repopulate_bioassay_table(self, protein_only:bool=True, n_workers:int=1, batch_size:int=10000,
+                                  activity_batch_size:int=1000000, incremental:bool=False, stream:bool=False) -> None:
+        """
+        Clears the bioassay, result_column and activity tables and reloads them from every zip directory in
+        bioassay_json_dir_path. The checksum of every zip directory is recorded in bioassay_archive. Rows are streamed
+        with COPY in batches of at most batch_size bioassays or activity_batch_size activity rows, whichever is reached
+        first. Bioassay rows go through a staging table and are moved into bioassay with one INSERT ... SELECT per
+        batch, which also applies the target foreign key: rows whose protein accession is not in the target table keep
+        only their bioassay ID. Each batch is one transaction. A batch the database rejects is rolled back and retried
+        one bioassay at a time, skipping bioassays it still rejects. A zip directory that fails to read part way
+        through, e.g. JSON found malformed in a streamed bioassay, is skipped from there on, the rows already loaded
+        from it are deleted once the load finishes and its checksum is not recorded, so an incremental load retries it.
+        Secondary indexes on bioassay, activity and result_column are dropped for the load and rebuilt once it
+        finishes.
+
+        :param protein_only: Currently unused, defaults to True
+        :type protein_only: bool, optional
+        :param n_workers: Number of processes that decompress, parse and reformat zip directories in parallel. Rows are
+            still inserted by this process in the same order as the serial path, defaults to 1
+        :type n_workers: int, optional
+        :param batch_size: Maximum number of bioassays per COPY batch, defaults to 10000
+        :type batch_size: int, optional
+        :param activity_batch_size: Maximum number of activity rows per COPY batch, defaults to 1000000
+        :type activity_batch_size: int, optional
+        :param incremental: Whether to only reload the AID ranges of archives that changed since the last load, see
+            _refresh_bioassay_table, defaults to False
+        :type incremental: bool, optional
+        :param stream: Whether to parse bioassay JSON incrementally with ijson, so a bioassay is never held as a whole
+            dict and its activity rows are loaded in bounded batches, see _bioassay_stream_tables_rows, defaults to
+            False
+        :type stream: bool, optional
+        """
+        if stream and ijson is None:
+            raise ImportError('Streaming bioassay JSON requires ijson')
+        if incremental:
+            self.migrate_assay_data_to_jsonb() # the staging table copies the columns of bioassay
+            self._refresh_bioassay_table(n_workers, batch_size, activity_batch_size, stream)
+            return
+        
         ########## Clear existing data to avoid duplication ##########
+        self._create_activity_tables()
+        self.cursor.execute('DELETE FROM activity')
+        self.cursor.execute('DELETE FROM result_column')
         self.cursor.execute('DELETE FROM bioassay')
         
         '''CREATE TABLE bioassay (
             bioassay_id INT PRIMARY KEY,
             gene_id INT,
             protein_accession TEXT,  -- was foreign key referencing target.protein_accession
-            assay_data JSON
+            assay_data JSONB,
+            assay_columns TEXT[]  -- keys of the assay_data entries in source order, JSONB does not keep it
         );'''
         
+        self.migrate_assay_data_to_jsonb() # instant on the now empty table of a database built before JSONB
+        
+        self._create_bioassay_staging_table()
+        self._create_bioassay_archive_table()
+        self.cursor.execute('DELETE FROM bioassay_archive')
+        
         self.connection.commit()
         
-        for zip_dir in tqdm([file for file in os.listdir(self.bioassay_json_dir_path) if not 
-                             file.startswith('README')]): # NOTE: Index os.listdir to limit number of files for testing
-            
-            loader = PubChemDB._bioassay_zip_dir_loader(os.path.join(self.bioassay_json_dir_path, zip_dir),
-                                                        print_filename=False)
+        zip_dir_paths = self._bioassay_zip_dir_paths()
+        archive_rows = [self._bioassay_archive_row(zip_dir_path) for zip_dir_path in
+                        tqdm(zip_dir_paths, desc='Checksumming archives')] # before the load, in case files change
+        
+        n_rows = 0
+        n_activity_rows = 0
+        n_fallback_batches = 0
+        n_skipped = 0
+        failed_archives = {}
+        t_0 = time.time()
+        index_definitions = self._drop_secondary_indexes('bioassay') + self._drop_secondary_indexes('activity') + \
+            self._drop_secondary_indexes('result_column')
+        try:
+            for batch in _batched(self._bioassay_rows(zip_dir_paths, n_workers, stream, failed_archives), batch_size,
+                                  weight=lambda assay_rows: len(assay_rows[2]), max_weight=activity_batch_size):
+                if not self._copy_bioassay_batch(batch):
+                    n_fallback_batches += 1
+                    for _, assay_rows in itertools.groupby(batch, key=PubChemDB._assay_rows_bioassay_id):
+                        n_skipped += not self._insert_bioassay_rows(list(assay_rows))
+                n_rows += sum(bioassay_row is not None for bioassay_row, _, _ in batch)
+                n_activity_rows += sum(len(activity_rows) for _, _, activity_rows in batch)
+        finally:
+            self._create_indexes(index_definitions)
+        t_diff = time.time() - t_0
+        
+        ########## Roll back zip directories that failed part way through ##########
+        for bioassay_ids in failed_archives.values():
+            for table in ['activity', 'result_column', 'bioassay']:
+                self.cursor.execute(f'DELETE FROM {table} WHERE bioassay_id = ANY(%s)', (sorted(bioassay_ids),))
+        
+        self._record_bioassay_archives([archive_row for zip_dir_path, archive_row in zip(zip_dir_paths, archive_rows)
+                                        if archive_row is not None and zip_dir_path not in failed_archives])
+        self.cursor.execute('DROP TABLE IF EXISTS bioassay_staging')
+        self.connection.commit()
+        
+        print(f'Loaded {n_rows} bioassays and {n_activity_rows} activities in {t_diff:.1f} s '
+              f'({(n_rows + n_activity_rows) / max(t_diff, 1e-9):.0f} rows/s), '
+              f'{n_fallback_batches} batches inserted one bioassay at a time, {n_skipped} bioassays rejected, '
+              f'{len(failed_archives)} failed zip directories rolled back')
+    
+    def _build_bioassay_tables(self, n_workers:int=1, stream:bool=False, resume:bool=False) -> None:
+        """
+        Bioassay stage of build, after build cleared the tables unless resuming. Loads one archive per transaction
+        through _refresh_bioassay_table, which checkpoints each archive in bioassay_archive as it commits, so a resumed
+        build skips archives already loaded. Unless resuming, the tables start out empty and are bulk loaded: their
+        secondary indexes, including those migrate_assay_data_to_jsonb creates, are dropped for the load and rebuilt
+        once it finishes, as in repopulate_bioassay_table.
+
+        :param n_workers: Number of processes that parse archives, defaults to 1
+        :type n_workers: int, optional
+        :param stream: Whether to parse bioassay JSON incrementally, defaults to False
+        :type stream: bool, optional
+        :param resume: Whether build is resuming, so the tables already hold rows, defaults to False
+        :type resume: bool, optional
+        """
+        if stream and ijson is None:
+            raise ImportError('Streaming bioassay JSON requires ijson')
+        self.migrate_assay_data_to_jsonb()
+        self._refresh_bioassay_table(n_workers=n_workers, stream=stream, empty=not resume)
+    
+    def _clear_bioassay_tables(self) -> None:
+        """ Deletes every bioassay, together with its activity rows and archive checksums, in one transaction. """
+        self._create_activity_tables()
+        self._create_bioassay_archive_table()
+        self.cursor.execute('DELETE FROM activity')
+        self.cursor.execute('DELETE FROM result_column')
+        self.cursor.execute('DELETE FROM bioassay')
+        self.cursor.execute('DELETE FROM bioassay_archive')
+        self.connection.commit()
+    
+    def _refresh_bioassay_table(self, n_workers:int=1, batch_size:int=10000, activity_batch_size:int=1000000,
+                                stream:bool=False, empty:bool=False) -> None:
+        """
+        Brings the bioassay tables up to date with bioassay_json_dir_path by reloading only archives whose checksum
+        differs from the one recorded in bioassay_archive. PubChem partitions bioassays into archives by AID range
+        (e.g. 0001001_0002000.zip), so each changed archive replaces exactly the rows in its range, in one transaction
+        together with its new checksum. Ranges of archives that no longer exist are deleted. An archive that fails to
+        load is rolled back and keeps its old rows and checksum, so the next refresh retries it.
+
+        :param n_workers: Number of processes that parse changed archives, defaults to 1
+        :type n_workers: int, optional
+        :param batch_size: Maximum number of bioassays per COPY batch, defaults to 10000
+        :type batch_size: int, optional
+        :param activity_batch_size: Maximum number of activity rows per COPY batch, defaults to 1000000
+        :type activity_batch_size: int, optional
+        :param stream: Whether to parse bioassay JSON incrementally, see repopulate_bioassay_table, defaults to False
+        :type stream: bool, optional
+        :param empty: Whether the bioassay tables are known to hold no rows, as after build clears them. Secondary
+            indexes on bioassay, activity and result_column are then dropped for the load and rebuilt once it finishes,
+            and ranges are not deleted before they are loaded, which would scan activity without its indexes, defaults
+            to False
+        :type empty: bool, optional
+        """
+        self._create_activity_tables()
+        self._create_bioassay_archive_table()
+        self._create_bioassay_staging_table()
+        self.connection.commit()
+        
+        self.cursor.execute('SELECT archive_name, aid_min, aid_max, md5, size, mtime_ns FROM bioassay_archive')
+        recorded = {row[0]: row for row in self.cursor.fetchall()}
+        
+        ########## Find changed archives ##########
+        changed_archive_rows = []
+        for zip_dir_path in tqdm(self._bioassay_zip_dir_paths(), desc='Checking archives'):
+            recorded_row = recorded.pop(os.path.basename(zip_dir_path), None)
+            archive_row = self._bioassay_archive_row(zip_dir_path, recorded_row)
+            if archive_row is None:
+                print(f'Skipping {zip_dir_path}, its name is not an AID range')
+            elif recorded_row is None or archive_row[3] != recorded_row[3]:
+                changed_archive_rows.append(archive_row)
+            elif archive_row != recorded_row: # touched but identical, e.g. downloaded again
+                self._record_bioassay_archives([archive_row])
+        self.connection.commit()
+        
+        ########## Delete ranges of archives no longer on disk ##########
+        for archive_name, aid_min, aid_max, _, _, _ in recorded.values():
+            self._delete_bioassay_range(aid_min, aid_max)
+            self.cursor.execute('DELETE FROM bioassay_archive WHERE archive_name = %s', (archive_name,))
+            self.connection.commit()
+        
+        ########## Replace ranges of changed archives ##########
+        n_rows = 0
+        n_failed_archives = 0
+        t_0 = time.time()
+        zip_dir_paths = [os.path.join(self.bioassay_json_dir_path, archive_row[0]) for archive_row in
+                         changed_archive_rows]
+        index_definitions = self._drop_secondary_indexes('bioassay') + self._drop_secondary_indexes('activity') + \
+            self._drop_secondary_indexes('result_column') if empty else []
+        try:
+            for archive_row, (zip_dir_path, rows) in zip(changed_archive_rows,
+                                                         self._bioassay_archive_rows(zip_dir_paths, n_workers, stream)):
+                _, aid_min, aid_max, _, _, _ = archive_row
+                try:
+                    if not empty:
+                        self._delete_bioassay_range(aid_min, aid_max)
+                    n_archive_rows = 0
+                    for batch in _batched(rows, batch_size, weight=lambda assay_rows: len(assay_rows[2]),
+                                          max_weight=activity_batch_size):
+                        self._copy_bioassay_rows(batch)
+                        n_archive_rows += sum(bioassay_row is not None for bioassay_row, _, _ in batch) + \
+                            sum(len(activity_rows) for _, _, activity_rows in batch)
+                    self._record_bioassay_archives([archive_row])
+                except Exception as e: # e.g. rejected rows, JSON found malformed part way through a stream or an
+                    # unknown code in a single bioassay, which workers forward too
+                    print(f'Failed to refresh {zip_dir_path}, keeping its previous rows: {type(e).__name__} {e}')
+                    self.connection.rollback()
+                    n_failed_archives += 1
+                else:
+                    self.connection.commit()
+                    n_rows += n_archive_rows
+        finally:
+            self._create_indexes(index_definitions)
+        t_diff = time.time() - t_0
+        
+        self.cursor.execute('DROP TABLE IF EXISTS bioassay_staging')
+        self.connection.commit()
+        
+        print(f'Refreshed {len(changed_archive_rows) - n_failed_archives} changed archives ({n_failed_archives} '
+              f'failed), deleted {len(recorded)} missing archives, loaded {n_rows} rows in {t_diff:.1f} s '
+              f'({n_rows / max(t_diff, 1e-9):.0f} rows/s)')
+    
+    def _bioassay_zip_dir_paths(self) -> List[str]:
+        return [os.path.join(self.bioassay_json_dir_path, file) for file in os.listdir(self.bioassay_json_dir_path)
+                if not file.startswith('README')] # NOTE: Index os.listdir to limit number of files for testing
+    
+    @staticmethod
+    def _bioassay_archive_row(zip_dir_path:str, recorded_row:Optional[tuple]=None) -> Optional[tuple]:
+        """
+        Checksums a bioassay archive, unless its size and modification time match recorded_row.
+
+        :param zip_dir_path: Path to .zip directory named after its AID range, e.g. 0001001_0002000.zip
+        :type zip_dir_path: str
+        :param recorded_row: Row of the archive in bioassay_archive, defaults to None
+        :type recorded_row: Optional[tuple], optional
+        :return: (archive_name, aid_min, aid_max, md5, size, mtime_ns) of the archive, recorded_row itself if the file
+            is unchanged, None if its name is not an AID range
+        :rtype: Optional[tuple]
+        """
+        archive_name = os.path.basename(zip_dir_path)
+        match = re.fullmatch(r'(\d+)_(\d+)\.zip', archive_name)
+        if match is None:
+            return None
+        
+        stat = os.stat(zip_dir_path)
+        if recorded_row is not None and tuple(recorded_row[4:]) == (stat.st_size, stat.st_mtime_ns):
+            return recorded_row
+        return (archive_name, int(match.group(1)), int(match.group(2)), PubChemFTP._calculate_md5(zip_dir_path),
+                stat.st_size, stat.st_mtime_ns)
+    
+    def _record_bioassay_archives(self, archive_rows:List[tuple]) -> None:
+        """ Upserts rows built by _bioassay_archive_row into bioassay_archive. Does not commit. """
+        execute_values(self.cursor, '''
+            INSERT INTO bioassay_archive (archive_name, aid_min, aid_max, md5, size, mtime_ns) VALUES %s
+            ON CONFLICT (archive_name) DO UPDATE SET aid_min = excluded.aid_min, aid_max = excluded.aid_max,
+                md5 = excluded.md5, size = excluded.size, mtime_ns = excluded.mtime_ns
+        ''', archive_rows)
+    
+    def _delete_bioassay_range(self, aid_min:int, aid_max:int) -> None:
+        """ Deletes every row of bioassays in an AID range from the bioassay tables. Does not commit. """
+        for table in ['activity', 'result_column', 'bioassay']:
+            self.cursor.execute(f'DELETE FROM {table} WHERE bioassay_id BETWEEN %s AND %s', (aid_min, aid_max))
+    
+    @staticmethod
+    def _bioassay_archive_rows(zip_dir_paths:List[str], n_workers:int=1,
+                               stream:bool=False) -> Generator[Tuple[str, Iterable], None, None]:
+        """
+        Like _bioassay_rows but keeps the rows of each zip directory together.
+
+        :param zip_dir_paths: Paths to .zip directories containing .json.gz files
+        :type zip_dir_paths: List[str]
+        :param n_workers: Number of worker processes, defaults to 1
+        :type n_workers: int, optional
+        :param stream: Whether to parse bioassay JSON incrementally, defaults to False
+        :type stream: bool, optional
+        :yield: (zip_dir_path, rows) where rows are as yielded by _bioassay_zip_dir_row_generator
+        :rtype: Generator[Tuple[str, Iterable], None, None]
+        """
+        if n_workers <= 1:
+            for zip_dir_path in tqdm(zip_dir_paths):
+                yield zip_dir_path, PubChemDB._bioassay_zip_dir_row_generator(zip_dir_path, stream=stream)
+        else:
+            # Workers do the CPU-bound decompressing, parsing and reformatting; the caller is the only DB writer. Rows
+            # go through shard files so neither side holds the rows of a whole zip directory
+            with tempfile.TemporaryDirectory(prefix='bioassay_shards_') as shard_dir, \
+                 ProcessPoolExecutor(max_workers=n_workers) as executor:
+                shard_paths = [os.path.join(shard_dir, f'{os.path.basename(zip_dir_path)}.pickle')
+                               for zip_dir_path in zip_dir_paths]
+                jobs = [(zip_dir_path, shard_path, stream)
+                        for zip_dir_path, shard_path in zip(zip_dir_paths, shard_paths)]
+                
+                # Window keeps at most 2 * n_workers finished shards waiting on disk
+                for zip_dir_path, shard_path, error in tqdm(zip(zip_dir_paths, shard_paths,
+                                                                _bounded_ordered_map(executor,
+                                                                                     _bioassay_zip_dir_to_shard, jobs,
+                                                                                     2 * n_workers)),
+                                                            total=len(zip_dir_paths)):
+                    yield zip_dir_path, _read_bioassay_shard(shard_path, error)
+    
+    def _create_bioassay_staging_table(self) -> None:
+        """ Creates the temporary staging table used by _copy_bioassay_rows. Does not commit. """
+        self.cursor.execute('''
+            CREATE TEMPORARY TABLE IF NOT EXISTS bioassay_staging (LIKE bioassay INCLUDING DEFAULTS)
+            ON COMMIT DELETE ROWS
+        ''')
+    
+    def _create_bioassay_archive_table(self) -> None:
+        """ Creates bioassay_archive if it does not exist. Does not commit. """
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bioassay_archive (
+                archive_name TEXT PRIMARY KEY, -- e.g. 0001001_0002000.zip
+                aid_min INT NOT NULL,
+                aid_max INT NOT NULL,
+                md5 TEXT NOT NULL, -- of the archive the rows in its AID range were loaded from
+                size BIGINT NOT NULL, -- size and modification time of the local file when it was checksummed, the
+                mtime_ns BIGINT NOT NULL -- checksum is not recomputed while they are unchanged
+            )
+        ''')
+    
+    def migrate_assay_data_to_jsonb(self) -> None:
+        """
+        Converts bioassay.assay_data of a database built with a JSON column to JSONB, so queries no longer re-parse it,
+        and adds the assay_columns column that keeps the key order JSONB discards. Bioassays loaded before it existed
+        have NULL assay_columns until they are reloaded. Creates the bioassay indexes used by PubChemQuery if they do
+        not exist. Safe to run more than once.
+        """
+        self.cursor.execute('''
+            SELECT data_type
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'bioassay' AND column_name = 'assay_data'
+        ''')
+        if self.cursor.fetchone()[0] == 'json':
+            print('Converting bioassay.assay_data from JSON to JSONB...')
+            self.cursor.execute('ALTER TABLE bioassay ALTER COLUMN assay_data TYPE JSONB USING assay_data::jsonb')
+        self.cursor.execute('ALTER TABLE bioassay ADD COLUMN IF NOT EXISTS assay_columns TEXT[]')
+        
+        print('...creating bioassay indexes...')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS bioassay_protein_accession_idx ON bioassay (protein_accession);
+            -- Arrays of the sid and outcome keys of every entry, e.g.
+            -- jsonb_path_query_array(assay_data, '$[*].sid') @> '[123]' is an index scan
+            CREATE INDEX IF NOT EXISTS bioassay_assay_data_sid_idx ON bioassay
+                USING GIN ((jsonb_path_query_array(assay_data, '$[*].sid')) jsonb_path_ops);
+            CREATE INDEX IF NOT EXISTS bioassay_assay_data_outcome_idx ON bioassay
+                USING GIN ((jsonb_path_query_array(assay_data, '$[*].outcome')) jsonb_path_ops);
+        ''')
+        self.connection.commit()
+    
+    def _create_activity_tables(self) -> None:
+        """ Creates the normalized result_column and activity tables and their indexes if they do not exist. Does not
+        commit. """
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS result_column (
+                bioassay_id INT NOT NULL,
+                tid INT NOT NULL, -- result column ID within the bioassay
+                name TEXT,
+                unit TEXT, -- decoded with _unit_map, NULL if the result has no unit
+                PRIMARY KEY (bioassay_id, tid)
+            );
+            CREATE TABLE IF NOT EXISTS activity (
+                bioassay_id INT NOT NULL,
+                sid INT NOT NULL,
+                tid INT, -- NULL if the substance has an outcome but no result values
+                outcome TEXT, -- decoded with _activity_outcome_map
+                value_num DOUBLE PRECISION, -- ival, fval and bval results
+                value_text TEXT -- sval and any other results
+            );
+            CREATE INDEX IF NOT EXISTS activity_sid_idx ON activity (sid);
+            CREATE INDEX IF NOT EXISTS activity_bioassay_id_idx ON activity (bioassay_id);
+        ''')
+    
+    @staticmethod
+    def _bioassay_rows(zip_dir_paths:List[str], n_workers:int=1, stream:bool=False,
+                       failed_archives:Optional[Dict[str, Set[int]]]=None) -> Generator[Tuple[Optional[tuple],
+                                                                                             List[tuple],
+                                                                                             List[tuple]], None, None]:
+        """
+        Yields the table rows of every bioassay in every zip directory in order, see _bioassay_zip_dir_row_generator.
+
+        :param zip_dir_paths: Paths to .zip directories containing .json.gz files
+        :type zip_dir_paths: List[str]
+        :param n_workers: Number of worker processes, defaults to 1
+        :type n_workers: int, optional
+        :param stream: Whether to parse bioassay JSON incrementally, defaults to False
+        :type stream: bool, optional
+        :param failed_archives: If given, a zip directory that fails to read part way through, e.g. JSON found
+            malformed in a streamed bioassay, is skipped from there on and added to it with the IDs of the bioassays
+            already yielded from it, instead of raising, defaults to None
+        :type failed_archives: Optional[Dict[str, Set[int]]], optional
+        :yield: (bioassay row, result_column rows, activity rows), see _bioassay_tables_rows and
+            _bioassay_stream_tables_rows
+        :rtype: Generator[Tuple[Optional[tuple], List[tuple], List[tuple]], None, None]
+        """
+        for zip_dir_path, rows in PubChemDB._bioassay_archive_rows(zip_dir_paths, n_workers, stream):
+            if failed_archives is None:
+                yield from rows
+                continue
             
-            # Skip if loader is None meaning the zip_dir failed to load
-            if loader == None:
+            bioassay_ids = set()
+            try:
+                for assay_rows in rows:
+                    bioassay_ids.add(PubChemDB._assay_rows_bioassay_id(assay_rows))
+                    yield assay_rows
+            except Exception as e: # e.g. JSON found malformed part way through a stream, an unknown code
+                print(f'Skipping the rest of {zip_dir_path}, its rows are rolled back after the load: '
+                      f'{type(e).__name__} {e}')
+                bioassay_ids.discard(None)
+                failed_archives[zip_dir_path] = bioassay_ids
+    
+    def _copy_bioassay_batch(self, batch:List[Tuple[tuple, List[tuple], List[tuple]]]) -> bool:
+        """
+        Loads the rows of a batch of bioassays into bioassay (through the staging table), result_column and activity in
+        one transaction. The target foreign key is resolved in the INSERT ... SELECT rather than by catching one
+        violation per row.
+
+        :param batch: (bioassay row, result_column rows, activity rows) of each bioassay, see _bioassay_tables_rows
+        :type batch: List[Tuple[tuple, List[tuple], List[tuple]]]
+        :return: True if the batch was committed, False if it was rejected and rolled back
+        :rtype: bool
+        """
+        try:
+            self._copy_bioassay_rows(batch)
+        except psycopg2.Error as e:
+            print(f'Batch of {len(batch)} bioassays rejected, inserting one at a time: {type(e).__name__} {e}')
+            self.connection.rollback()
+            return False
+        
+        self.connection.commit()
+        return True
+    
+    def _copy_bioassay_rows(self, batch:List[Tuple[tuple, List[tuple], List[tuple]]]) -> None:
+        """ Copies the rows of a batch of bioassays, see _copy_bioassay_batch. Does not commit. """
+        copy_rows(self.cursor, 'bioassay_staging',
+                  ['bioassay_id', 'gene_id', 'protein_accession', 'assay_data', 'assay_columns'],
+                  [bioassay_row for bioassay_row, _, _ in batch if bioassay_row is not None])
+        # Same outcome as _insert_bioassay_row: unknown protein accession --> only the bioassay ID is kept
+        self.cursor.execute('''
+            INSERT INTO bioassay (bioassay_id, gene_id, protein_accession, assay_data, assay_columns)
+            SELECT s.bioassay_id,
+                   CASE WHEN has_target THEN s.gene_id END,
+                   CASE WHEN has_target THEN s.protein_accession END,
+                   CASE WHEN has_target THEN s.assay_data END,
+                   CASE WHEN has_target THEN s.assay_columns END
+            FROM (
+                SELECT bioassay_staging.*,
+                       (protein_accession IS NULL OR EXISTS (
+                           SELECT 1 FROM target WHERE target.protein_accession = bioassay_staging.protein_accession
+                       )) AS has_target
+                FROM bioassay_staging
+            ) s
+        ''')
+        self.cursor.execute('TRUNCATE bioassay_staging') # a transaction can hold several batches
+        self._copy_activity_rows([row for _, result_column_rows, _ in batch for row in result_column_rows],
+                                 [row for _, _, activity_rows in batch for row in activity_rows])
+    
+    def _copy_activity_rows(self, result_column_rows:List[tuple], activity_rows:List[tuple]) -> None:
+        """ Copies rows built by _result_column_table_rows and _activity_table_rows. Does not commit. """
+        copy_rows(self.cursor, 'result_column', ['bioassay_id', 'tid', 'name', 'unit'], result_column_rows)
+        copy_rows(self.cursor, 'activity', ['bioassay_id', 'sid', 'tid', 'outcome', 'value_num', 'value_text'],
+                  activity_rows)
+    
+    @staticmethod
+    def _bioassay_zip_dir_row_generator(zip_dir_path:str, stream:bool=False,
+                                        stream_batch_size:int=10000) -> Generator[Tuple[Optional[tuple], List[tuple],
+                                                                                        List[tuple]], None, None]:
+        """
+        Loads every bioassay in a zip directory, skipping those sourced from ChEMBL, and yields its table rows. Needs
+        no database connection so it can run in a worker process.
+
+        :param zip_dir_path: Path to .zip directory containing .json.gz files
+        :type zip_dir_path: str
+        :param stream: Whether to parse bioassay JSON incrementally, defaults to False
+        :type stream: bool, optional
+        :param stream_batch_size: Substances per batch of activity rows when streaming, defaults to 10000
+        :type stream_batch_size: int, optional
+        :yield: (bioassay row, result_column rows, activity rows), see _bioassay_tables_rows and
+            _bioassay_stream_tables_rows
+        :rtype: Generator[Tuple[Optional[tuple], List[tuple], List[tuple]], None, None]
+        """
+        loader = PubChemDB._bioassay_zip_dir_loader(zip_dir_path, print_filename=False, stream=stream)
+        
+        # Skip if loader is None meaning the zip_dir failed to load
+        if loader == None:
+            return
+        
+        for bioassay_json in loader:
+            # Skip if from chembl
+            if bioassay_json['PC_AssaySubmit']['assay']['descr']['aid_source']['db']['name'].lower() == 'chembl':
                 continue
             
-            for bioassay_json in loader:
-                # Skip if from chembl
-                if bioassay_json['PC_AssaySubmit']['assay']['descr']['aid_source']['db']['name'].lower() == 'chembl':
-                    continue
-                
-                self._protein_only_add_entry_to_bioassay_table(bioassay_json)
+            if stream:
+                yield from PubChemDB._bioassay_stream_tables_rows(bioassay_json, stream_batch_size)
+            else:
+                yield PubChemDB._bioassay_tables_rows(bioassay_json)
     
     @staticmethod
-    def _bioassay_zip_dir_loader(zip_dir_path:str, print_filename:bool=False) -> Optional[Generator]:
+    def _bioassay_zip_dir_loader(zip_dir_path:str, print_filename:bool=False,
+                                 stream:bool=False) -> Optional[Generator]:
         """
-        Sequentially reads .json.gz files in a .zip directory into dict object. Yields one at a time.
+        Sequentially reads .json.gz files in a .zip directory into dict object. Yields one at a time. Each file is
+        decompressed straight from its zip member stream and the bytes are parsed with _json_loads, so the compressed
+        contents and a decoded str copy are never held. Files that are not UTF-8 JSON are skipped.
+        
+        With stream, the data of each bioassay is not parsed up front: it is an iterator over the data entries, which
+        reads them from the member stream one at a time, see _bioassay_json_stream. It has to be consumed before the
+        next bioassay is requested.
         
         NOTE: This will read from a zip directory with .json.gz children, data comes directly from FTP as a zip
         directory containing ZIP DIRECTORIES, each of which contain .json.gz files.
@@ -339,6 +1281,8 @@ class PubChemDB(__ABCChemDB):
         :type zip_dir_path: str
         :param print_filename: Whether to print filenames, defaults to False
         :type print_filename: bool, optional
+        :param stream: Whether to parse incrementally with ijson, defaults to False
+        :type stream: bool, optional
         :yield: Dict object containing loaded JSON data
         :rtype: Iterator[List[dict]]
         """
@@ -348,24 +1292,207 @@ class PubChemDB(__ABCChemDB):
                 filenames = [filename for filename in zip_ref.namelist() if filename.endswith('.json.gz')]
 
                 for filename in filenames:
+                    if stream:
+                        with zip_ref.open(filename, 'r') as member, \
+                             gzip.GzipFile(fileobj=member, mode='rb') as file:
+                            try:
+                                bioassay_json = PubChemDB._bioassay_json_stream(file)
+                            except ValueError: # e.g. data before assay, parsed as a whole below instead
+                                bioassay_json = None
+                            if bioassay_json is not None:
+                                if print_filename: # Print filename
+                                    print(f'STREAMING: {filename}')
+                                yield bioassay_json # its data is read from file as the consumer iterates it
+                                continue
+                    
                     # Read .json.gz zipped file
-                    with zip_ref.open(filename, 'r') as file:
-                        contents = gzip.decompress(file.read())
-                        try:
-                            contents_str = contents.decode('utf-8')
-                        except Exception as e:
-                            continue
-                        # Load the JSON data into a Python object
-                        if print_filename: # Print filename
-                            print(f'LOADING: {filename}')
-        
-                    yield json.loads(contents_str)
+                    with zip_ref.open(filename, 'r') as member, gzip.GzipFile(fileobj=member, mode='rb') as file:
+                        contents = file.read()
+                    if print_filename: # Print filename
+                        print(f'LOADING: {filename}')
+                    
+                    # Load the JSON data into a Python object
+                    try:
+                        bioassay_json = _json_loads(contents)
+                    except ValueError:
+                        continue
+                    del contents # not kept alive while the consumer works on the dict
+                    
+                    yield bioassay_json
         except zipfile.BadZipFile as e:
             print(f'Failed to load zipdir: {zip_dir_path}') # likely means the zipdir is corrupted from FTP download
             return None
+    
+    @staticmethod
+    def _bioassay_json_stream(file:io.BufferedIOBase) -> dict:
+        """
+        Parses a bioassay JSON stream with ijson up to the start of its data. PubChem writes the assay descriptor
+        before the data, so everything but the data entries is known before the first entry is read.
+
+        :param file: Decompressed .json stream
+        :type file: io.BufferedIOBase
+        :raises ValueError: If the stream is not a PC_AssaySubmit document with its assay before its data
+        :return: Bioassay JSON where data, if present, is an iterator over its entries that reads them from file
+        :rtype: dict
+        """
+        events = ijson.basic_parse(file, use_float=True)
+        try:
+            if next(events) != ('start_map', None) or next(events) != ('map_key', 'PC_AssaySubmit') or \
+                next(events) != ('start_map', None):
+                raise ValueError('Not a PC_AssaySubmit document')
+            
+            assay_submit = {}
+            for event, value in events:
+                if event == 'end_map': # no data
+                    break
+                key = value # event is map_key
+                event, value = next(events)
+                if key == 'data' and event == 'start_array':
+                    if 'assay' not in assay_submit:
+                        raise ValueError('Bioassay data precedes its assay descriptor')
+                    assay_submit['data'] = _ijson_array_items(events)
+                    break
+                assay_submit[key] = _ijson_value(events, event, value)
+        except (ijson.JSONError, StopIteration) as e:
+            raise ValueError(f'Malformed JSON: {e}') from e
+        return {'PC_AssaySubmit': assay_submit}
                 
     def _protein_only_add_entry_to_bioassay_table(self, json_bioassay:dict) -> None:
         '''TODO: fails if not protein only'''
+        self._insert_bioassay_rows([PubChemDB._bioassay_tables_rows(json_bioassay)])
+    
+    @staticmethod
+    def _bioassay_tables_rows(json_bioassay:dict) -> Tuple[tuple, List[tuple], List[tuple]]:
+        """
+        Builds the rows of a bioassay for every bioassay table.
+
+        :param json_bioassay: Loaded bioassay JSON
+        :type json_bioassay: dict
+        :return: (bioassay row, result_column rows, activity rows)
+        :rtype: Tuple[tuple, List[tuple], List[tuple]]
+        """
+        result_column_rows = PubChemDB._result_column_table_rows(json_bioassay)
+        activity_rows = PubChemDB._activity_table_rows(json_bioassay)
+        return PubChemDB._bioassay_table_row(json_bioassay), result_column_rows, activity_rows
+    
+    @staticmethod
+    def _bioassay_stream_tables_rows(json_bioassay:dict, batch_size:int=10000) -> Generator[Tuple[Optional[tuple],
+                                                                                               List[tuple],
+                                                                                               List[tuple]],
+                                                                                         None, None]:
+        """
+        Builds the same rows as _bioassay_tables_rows from a bioassay whose data is an iterator, see
+        _bioassay_zip_dir_loader, one data entry at a time. Activity rows are yielded every batch_size substances
+        without a bioassay row; the last yield carries the bioassay and result_column rows. The serialized assay data
+        is the only thing held that grows with the bioassay.
+
+        :param json_bioassay: Bioassay JSON
+        :type json_bioassay: dict
+        :param batch_size: Substances per batch of activity rows, defaults to 10000
+        :type batch_size: int, optional
+        :yield: (bioassay row or None, result_column rows, activity rows)
+        :rtype: Generator[Tuple[Optional[tuple], List[tuple], List[tuple]], None, None]
+        """
+        result_column_rows = PubChemDB._result_column_table_rows(json_bioassay)
+        if 'data' not in json_bioassay['PC_AssaySubmit']: # no data for the bioassay
+            yield PubChemDB._bioassay_table_row(json_bioassay), result_column_rows, []
+            return
+        
+        bioassay_id = json_bioassay['PC_AssaySubmit']['assay']['descr']['aid']['id']
+        column_names = PubChemDB._bioassay_column_names(json_bioassay)
+        assay_data = io.StringIO() # same text as json.dumps of the list _reformat_bioassay_data returns
+        assay_data.write('[')
+        assay_columns = {} # keys of the reformatted entries in first-seen order
+        activity_rows = []
+        for i, sid_entry in enumerate(json_bioassay['PC_AssaySubmit']['data']):
+            activity_rows.extend(PubChemDB._sid_entry_activity_rows(bioassay_id, sid_entry))
+            if column_names is not None:
+                if i:
+                    assay_data.write(', ')
+                reformatted_entry = PubChemDB._reformat_sid_entry(sid_entry, column_names)
+                assay_columns.update(dict.fromkeys(reformatted_entry))
+                assay_data.write(json.dumps(reformatted_entry))
+            
+            if (i + 1) % batch_size == 0:
+                yield None, [], activity_rows
+                activity_rows = []
+        assay_data.write(']')
+        
+        yield PubChemDB._bioassay_table_row(json_bioassay, assay_data.getvalue(), list(assay_columns)), \
+            result_column_rows, activity_rows
+    
+    @staticmethod
+    def _result_column_table_rows(json_bioassay:dict) -> List[tuple]:
+        """
+        :param json_bioassay: Loaded bioassay JSON
+        :type json_bioassay: dict
+        :return: (bioassay_id, tid, name, unit) of each result column of the bioassay
+        :rtype: List[tuple]
+        """
+        descr = json_bioassay['PC_AssaySubmit']['assay']['descr']
+        return [(descr['aid']['id'], item['tid'], item['name'],
+                 PubChemDB.__unit_map[item['unit']] if 'unit' in item else None)
+                for item in descr.get('results', [])]
+    
+    @staticmethod
+    def _activity_table_rows(json_bioassay:dict) -> List[tuple]:
+        """
+        Flattens the data of a bioassay to one row per substance and result value. A substance without result values
+        still gets one row, with a NULL tid, to keep its outcome.
+
+        :param json_bioassay: Loaded bioassay JSON
+        :type json_bioassay: dict
+        :return: (bioassay_id, sid, tid, outcome, value_num, value_text) rows
+        :rtype: List[tuple]
+        """
+        if 'data' not in json_bioassay['PC_AssaySubmit']: # no data for the bioassay
+            return []
+        
+        bioassay_id = json_bioassay['PC_AssaySubmit']['assay']['descr']['aid']['id']
+        return [row for sid_entry in json_bioassay['PC_AssaySubmit']['data']
+                for row in PubChemDB._sid_entry_activity_rows(bioassay_id, sid_entry)]
+    
+    @staticmethod
+    def _sid_entry_activity_rows(bioassay_id:int, sid_entry:dict) -> List[tuple]:
+        """
+        :param bioassay_id: ID of the bioassay the entry belongs to
+        :type bioassay_id: int
+        :param sid_entry: One entry of the data of a bioassay, before _reformat_sid_entry
+        :type sid_entry: dict
+        :return: (bioassay_id, sid, tid, outcome, value_num, value_text) rows of the entry, see _activity_table_rows
+        :rtype: List[tuple]
+        """
+        outcome = PubChemDB.__activity_outcome_map[sid_entry['outcome']]
+        if not sid_entry.get('data'):
+            return [(bioassay_id, sid_entry['sid'], None, outcome, None, None)]
+        
+        rows = []
+        for tid_entry in sid_entry['data']:
+            value = next(iter(tid_entry['value'].values())) # e.g. {'fval': 1.5} --> 1.5
+            if isinstance(value, (int, float)): # includes bval
+                rows.append((bioassay_id, sid_entry['sid'], tid_entry['tid'], outcome, float(value), None))
+            else:
+                rows.append((bioassay_id, sid_entry['sid'], tid_entry['tid'], outcome, None,
+                             value if isinstance(value, str) else json.dumps(value)))
+        return rows
+    
+    @staticmethod
+    def _bioassay_table_row(json_bioassay:dict, assay_data:Optional[str]=None,
+                            assay_columns:Optional[List[str]]=None) -> tuple:
+        """
+        Extracts the gene ID and protein accession of a bioassay and reformats its data.
+
+        :param json_bioassay: Loaded bioassay JSON
+        :type json_bioassay: dict
+        :param assay_data: Data already reformatted and serialized, see _bioassay_stream_tables_rows, defaults to
+            reformatting the data of json_bioassay
+        :type assay_data: Optional[str], optional
+        :param assay_columns: Keys of the entries of assay_data, given with it, defaults to None
+        :type assay_columns: Optional[List[str]], optional
+        :return: (bioassay_id, gene_id, protein_accession, assay_data, assay_columns) where assay_data is serialized
+            JSON and assay_columns are the keys of its entries in first-seen order, None if the bioassay has no data
+        :rtype: tuple
+        """
         bioassay_id = json_bioassay['PC_AssaySubmit']['assay']['descr']['aid']['id']
         gene_id = None
         if 'xref' in json_bioassay['PC_AssaySubmit']['assay']['descr']:
@@ -375,32 +1502,96 @@ class PubChemDB(__ABCChemDB):
         else:
             print(bioassay_id, 'no xref for gene_id')
         
-        ########## Determine protein accession from bioassay target info ##########
-        target_info = PubChemDB._get_bioassay_target_info_if_exists(json_bioassay)
-        
-        if target_info and 'protein_accession' in target_info['mol_id']: # NOTE: target_info could be NoneType or \
-            # empty object
-            protein_accession = target_info['mol_id']['protein_accession']
-            protein_accession = protein_accession.split('.')[0] # remove version number if present
-        else:
-            protein_accession = None
+        protein_accession = PubChemDB._bioassay_protein_accession(json_bioassay)
         
         ########## Format bioassay data ########## 
+        if assay_data is not None:
+            return bioassay_id, gene_id, protein_accession, assay_data, assay_columns
         if 'data' in json_bioassay['PC_AssaySubmit']:
-            formatted_bioassay_data = self._reformat_bioassay_data(json_bioassay)
+            formatted_bioassay_data = PubChemDB._reformat_bioassay_data(json_bioassay)
+            assay_columns = list(dict.fromkeys(itertools.chain.from_iterable(formatted_bioassay_data)))
         else: # no data for the bioassay
             formatted_bioassay_data = None
         
+        return bioassay_id, gene_id, protein_accession, json.dumps(formatted_bioassay_data), assay_columns
+    
+    def _insert_bioassay_rows(self, assay_rows:List[Tuple[Optional[tuple], List[tuple], List[tuple]]]) -> bool:
+        """
+        Inserts the rows of one bioassay under one savepoint, the bioassay row with _insert_bioassay_row, and commits.
+        A bioassay the database rejects is rolled back to the savepoint, logged and skipped, together with any of its
+        activity rows that earlier batches committed ahead of a streamed bioassay row.
+
+        :param assay_rows: Consecutive (bioassay row, result_column rows, activity rows) of one bioassay, see
+            _bioassay_tables_rows and _bioassay_stream_tables_rows
+        :type assay_rows: List[Tuple[Optional[tuple], List[tuple], List[tuple]]]
+        :return: Whether the bioassay was inserted
+        :rtype: bool
+        """
+        bioassay_id = PubChemDB._assay_rows_bioassay_id(assay_rows[0])
+        self.cursor.execute('SAVEPOINT bioassay_rows')
+        try:
+            for bioassay_row, result_column_rows, activity_rows in assay_rows:
+                if bioassay_row is not None: # None for activity rows flushed ahead of a streamed bioassay
+                    self._insert_bioassay_row(bioassay_row)
+                self._copy_activity_rows(result_column_rows, activity_rows)
+        except psycopg2.Error as e:
+            print(f'Skipping bioassay {bioassay_id}, rejected by the database: {type(e).__name__} {e}')
+            self.cursor.execute('ROLLBACK TO SAVEPOINT bioassay_rows')
+            self._delete_bioassay_range(bioassay_id, bioassay_id)
+            self.connection.commit()
+            return False
+        self.connection.commit()
+        return True
+    
+    @staticmethod
+    def _assay_rows_bioassay_id(assay_rows:Tuple[Optional[tuple], List[tuple], List[tuple]]) -> Optional[int]:
+        """ Bioassay ID of (bioassay row, result_column rows, activity rows), whichever of them has a row. """
+        bioassay_row, result_column_rows, activity_rows = assay_rows
+        for row in [bioassay_row] + result_column_rows[:1] + activity_rows[:1]:
+            if row is not None:
+                return row[0]
+        return None
+    
+    def _insert_bioassay_row(self, row:tuple) -> None:
+        """
+        Inserts a row built by _bioassay_table_row, keeping only the bioassay ID if its protein accession is not in the
+        target table. Does not commit.
+
+        :param row: (bioassay_id, gene_id, protein_accession, assay_data, assay_columns)
+        :type row: tuple
+        """
+        bioassay_id, gene_id, protein_accession, assay_data, assay_columns = row
+        
         ########## Store in database ##########
+        self.cursor.execute('SAVEPOINT bioassay_row')
         try:
-            self.cursor.execute('INSERT INTO bioassay (bioassay_id, gene_id, protein_accession, assay_data) VALUES (%s, %s, %s, %s)',
-                                (bioassay_id, gene_id, protein_accession, json.dumps(formatted_bioassay_data)))
+            self.cursor.execute('''
+                INSERT INTO bioassay (bioassay_id, gene_id, protein_accession, assay_data, assay_columns)
+                VALUES (%s, %s, %s, %s, %s)
+            ''', (bioassay_id, gene_id, protein_accession, assay_data, assay_columns))
         except psycopg2.errors.ForeignKeyViolation: # the protein accession is not in the protein table
-            self.connection.rollback() # rollback to previous commit due to foreign key violation
+            self.cursor.execute('ROLLBACK TO SAVEPOINT bioassay_row')
             self.cursor.execute('INSERT INTO bioassay (bioassay_id) VALUES (%s)', (bioassay_id,))
+        self.cursor.execute('RELEASE SAVEPOINT bioassay_row')
+        
+    @staticmethod
+    def _bioassay_protein_accession(json_bioassay:dict) -> Optional[str]:
+        """
+        Determines the protein accession of a bioassay from its target info.
 
-        self.connection.commit()
+        :param json_bioassay: Loaded bioassay JSON, its data is not read
+        :type json_bioassay: dict
+        :return: Protein accession without version number, None if the target is not a protein
+        :rtype: Optional[str]
+        """
+        target_info = PubChemDB._get_bioassay_target_info_if_exists(json_bioassay)
         
+        if target_info and 'protein_accession' in target_info['mol_id']: # NOTE: target_info could be NoneType or \
+            # empty object
+            protein_accession = target_info['mol_id']['protein_accession']
+            return protein_accession.split('.')[0] # remove version number if present
+        return None
+    
     @staticmethod
     def _get_bioassay_target_info_if_exists(json_bioassay:dict) -> Optional[dict]:
         try:
@@ -410,36 +1601,79 @@ class PubChemDB(__ABCChemDB):
         except (KeyError, IndexError): # KeyError for ['target'] or IndexError for [0], assume no target data
             return None
     
-    def _reformat_bioassay_data(self, json_bioassay:dict) -> dict:
-        if 'results' in json_bioassay['PC_AssaySubmit']['assay']['descr']:
-            tid_to_activity_name_map = {}
-            for item in json_bioassay['PC_AssaySubmit']['assay']['descr']['results']:
-                if 'unit' in item:
-                    tid_to_activity_name_map[item['tid']] = f"{item['name']} ({self._unit_map[item['unit']]})"
-                else:
-                    tid_to_activity_name_map[item['tid']] = '' # no unit --> this will show up as a blank: "()"
-        else:
+    @staticmethod
+    def _tid_to_activity_name_map(json_bioassay:dict) -> Optional[Dict[int, str]]:
+        """
+        :param json_bioassay: Loaded bioassay JSON
+        :type json_bioassay: dict
+        :return: Mapper from TID to activity name with units, None if the bioassay has no result columns
+        :rtype: Optional[Dict[int, str]]
+        """
+        if 'results' not in json_bioassay['PC_AssaySubmit']['assay']['descr']:
+            return None
+        
+        tid_to_activity_name_map = {}
+        for item in json_bioassay['PC_AssaySubmit']['assay']['descr']['results']:
+            if 'unit' in item:
+                tid_to_activity_name_map[item['tid']] = f"{item['name']} ({PubChemDB.__unit_map[item['unit']]})"
+            else:
+                tid_to_activity_name_map[item['tid']] = '' # no unit --> this will show up as a blank: "()"
+        return tid_to_activity_name_map
+    
+    @staticmethod
+    def _bioassay_column_names(json_bioassay:dict) -> Optional[Dict[Any, str]]:
+        """
+        Precomputes, once per bioassay, the column name of every key a data entry can have, so reformatting an entry
+        is one dict lookup per key.
+
+        :param json_bioassay: Loaded bioassay JSON
+        :type json_bioassay: dict
+        :return: Mapper from TID to activity name with units and from each non-TID key to itself, None if the bioassay
+            has no result columns
+        :rtype: Optional[Dict[Any, str]]
+        """
+        tid_to_activity_name_map = PubChemDB._tid_to_activity_name_map(json_bioassay)
+        if tid_to_activity_name_map is None:
+            return None
+        
+        column_names = dict(tid_to_activity_name_map)
+        column_names.update((column, column) for column in PubChemDB.__possible_non_tid_bioassay_columns)
+        return column_names
+    
+    @staticmethod
+    def _reformat_bioassay_data(json_bioassay:dict) -> dict:
+        column_names = PubChemDB._bioassay_column_names(json_bioassay)
+        if column_names is None:
             return [] # no TIDs therefore assume no assay data for the bioassay
         
-        reformatted_data = []
-        for sid_entry in json_bioassay['PC_AssaySubmit']['data']:
-            if 'data' in sid_entry: # clean up data, else there is no activity data but the structure is still added \
-                # to reformatted_data
-                sid_results = sid_entry.pop('data')
-                tid_data = {tid_entry['tid']: list(tid_entry['value'].values())[0] for tid_entry in sid_results} # \
-                    # list(tid_entry['value'].values())[0] converts a dictionary with various keys such as 'sval' or \
-                        # 'fval' to a single value
-                sid_entry.update(tid_data)
-            
-            # Decode activity outcome from integers to strings
-            sid_entry['outcome'] = self._activity_outcome_map[sid_entry['outcome']]
-            
-            # Decode TID to activity name w/ units
-            sid_entry = {(tid_to_activity_name_map[key] if key not in self._possible_non_tid_bioassay_columns else key):
-                value for key, value in sid_entry.items()}
+        return [PubChemDB._reformat_sid_entry(sid_entry, column_names)
+                for sid_entry in json_bioassay['PC_AssaySubmit']['data']]
+    
+    @staticmethod
+    def _reformat_sid_entry(sid_entry:dict, column_names:Dict[Any, str]) -> dict:
+        """
+        Flattens one data entry: its result values become keys named after their result column, after the other keys,
+        and its outcome is decoded to a string. The entry itself is not modified.
 
-            reformatted_data.append(sid_entry)
-        return reformatted_data
+        :param sid_entry: One entry of the data of a bioassay
+        :type sid_entry: dict
+        :param column_names: Column names of the bioassay, see _bioassay_column_names
+        :type column_names: Dict[Any, str]
+        :return: Reformatted entry
+        :rtype: dict
+        """
+        reformatted_entry = {}
+        for key, value in sid_entry.items():
+            if key != 'data': # results are added below, else there is no activity data but the structure is kept
+                reformatted_entry[column_names[key]] = value
+        
+        # Decode activity outcome from integers to strings
+        reformatted_entry['outcome'] = PubChemDB.__activity_outcome_map[sid_entry['outcome']]
+        
+        for tid_entry in sid_entry.get('data', ()):
+            # The value is a dictionary with one key such as 'sval' or 'fval'
+            reformatted_entry[column_names[tid_entry['tid']]] = next(iter(tid_entry['value'].values()))
+        return reformatted_entry
     
     def testing(self):        
         df = pd.read_csv('/Users/collabpharma/Downloads/Aid2GeneidAccessionUniProt(1)', delimiter='\t')
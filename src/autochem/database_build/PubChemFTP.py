@@ -1,23 +1,41 @@
 import os
 import shutil
-from ftplib import FTP
+from ftplib import FTP, error_perm, error_reply, error_temp
 from tqdm import tqdm
 import hashlib
 import zipfile
 import socket
 import time
+import queue
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from .SyncManifest import SyncManifest
+from .DownloadJournal import DownloadJournal
+from .TransferChecks import TransferChecks
 
 
 class PubChemFTP():
-    def __init__(self, absolute_out_dir:str, overwrite:bool=False) -> None:
+    def __init__(self, absolute_out_dir:str, overwrite:bool=False, sync:bool=False, resume:bool=False,
+                 ftp_host:str='ftp.ncbi.nlm.nih.gov', ftp_port:int=21, ftp_user:str='anonymous',
+                 ftp_password:str='', buffer_size:int=1024 * 1024) -> None:
         self.__absolute_out_dir = absolute_out_dir
         self.__overwrite = overwrite
+        self.__sync = sync # only download files that are new or changed on the server, resume partial files
+        self.__resume = resume # pick up an interrupted job from the journal without re-listing the server
+        self.__buffer_size = buffer_size # bytes per socket read and per local write
         
         # Path to send stuff that fails error checking
         self.__bad_file_path = os.path.join(self.__absolute_out_dir, 'bad_files')
         
         # Make directory and set directory names to be populated
         self._make_dir()
+        
+        # Record of every downloaded file (size, modification time, md5), used by sync mode to skip unchanged files
+        self.__manifest = SyncManifest(os.path.join(self.__absolute_out_dir, 'sync_manifest.sqlite3'))
+        
+        # Per-file job state (pending/done/bad, attempts, bytes, seconds), used by resume mode to skip finished files
+        self.__journal = DownloadJournal(os.path.join(self.__absolute_out_dir, 'download_journal.sqlite3'))
+        
         self.__protein_target_ftp_directory = 'pubchem/Target/'
         self.__protein_target_filename = 'protein2xrefs.gz'
         self.__substance_sdf_ftp_directory = 'pubchem/Substance/CURRENT-Full/SDF/'
@@ -25,47 +43,355 @@ class PubChemFTP():
         self.__bioassay_asn_metadata_ftp_directory = 'pubchem/Bioassay/'
         self.__bioassay_asn_metadata_filename = 'pcassay2.asn'
         
-        # FTP connection details
-        self.__ftp_host = 'ftp.ncbi.nlm.nih.gov'
-        self.__ftp_user = 'anonymous'
-        self.__ftp_password = ''
+        # FTP connection details, host and port can be pointed at a local FTP server for testing
+        self.__ftp_host = ftp_host
+        self.__ftp_port = ftp_port
+        self.__ftp_user = ftp_user
+        self.__ftp_password = ftp_password
+        
+        # Each thread holds its own FTP session so that download workers never share a control connection
+        self.__session = threading.local()
         
         # Connect to the FTP server
         self._connect(dir_name='')
+        
+    @property
+    def _ftp(self) -> FTP:
+        """
+        FTP session owned by the calling thread, opened by _connect.
+
+        :return: FTP session for the current thread
+        :rtype: FTP
+        """
+        return self.__session.ftp
     
     def _connect(self, dir_name:str) -> None:
         time1 = time.time()
-        self.__ftp = FTP(self.__ftp_host)
-        self.__ftp.login(self.__ftp_user, self.__ftp_password)
-        self.__ftp.cwd('/' + dir_name) # preface w/ root ('/') to clear previous cwd operations
+        old_ftp = getattr(self.__session, 'ftp', None)
+        if old_ftp is not None: # replacing a dropped session, release its socket
+            old_ftp.close()
+        ftp = FTP()
+        ftp.connect(self.__ftp_host, self.__ftp_port)
+        ftp.login(self.__ftp_user, self.__ftp_password)
+        ftp.cwd('/' + dir_name) # preface w/ root ('/') to clear previous cwd operations
+        self.__session.ftp = ftp
         print('time to connect: ', time.time() - time1) # probably not even useful
         
     def _ftp_read(self, local_file_path:str, server_file_path:str, base_dir_name:str,
-                  max_failed_attempts:int=5, reconnect_delay_seconds:int=25) -> None:
+                  max_failed_attempts:int=5, reconnect_delay_seconds:int=25, resume:bool=False,
+                  checks:Optional[TransferChecks]=None) -> int:
+        n_bytes = 0
+        
+        def write(chunk:bytes) -> None:
+            nonlocal n_bytes
+            file.write(chunk)
+            if checks is not None: # hash/verify as bytes arrive instead of re-reading the file afterwards
+                checks.update(chunk)
+            n_bytes += len(chunk)
+        
         for i in range(max_failed_attempts):
             try:
-                with open(local_file_path, 'wb') as file:
-                    self.__ftp.retrbinary(f'RETR {server_file_path}', file.write)
+                # When resuming, append to whatever is already on disk and ask the server to start from there
+                offset = os.path.getsize(local_file_path) if resume and os.path.exists(local_file_path) else 0
+                if checks is not None:
+                    checks.reset()
+                    if offset: # seed the checks with the part that is already on disk
+                        with open(local_file_path, 'rb') as file:
+                            for chunk in iter(lambda: file.read(self.__buffer_size), b''):
+                                checks.update(chunk)
+                
+                with open(local_file_path, 'ab' if offset else 'wb', buffering=self.__buffer_size) as file:
+                    self._ftp.retrbinary(f'RETR {server_file_path}', write, blocksize=self.__buffer_size,
+                                         rest=offset or None)
                 break
-            except socket.error: # re-connect to FTP server
+            except (socket.error, EOFError, error_temp): # connection dropped or transient server error, re-connect
                 print('SOCKET ERROR')
                 if i == max_failed_attempts - 1:
                     raise Exception(f'Failed to reconnect to FTP server after {max_failed_attempts} attempts')
                 else:
-                    self._connect(base_dir_name) # this assumes the thread is paused to connect
-                    time.sleep(reconnect_delay_seconds)
-            except Exception as e:
-                if hasattr(e, 'message'):
-                    print(f'Error downloading {server_file_path}: {e.message}')
-                elif hasattr(e, 'args') and e.args:
-                    print(f'Error downloading {server_file_path}: {e.args[0]}')
-                else:
-                    print(f'Error downloading {server_file_path}: {str(e)}')
+                    self._reconnect(base_dir_name, reconnect_delay_seconds)
+            # Any other error propagates so the caller never mistakes a partial file for a finished one
+        return n_bytes
+    
+    def _reconnect(self, dir_name:str, reconnect_delay_seconds:int) -> None:
+        """
+        Replaces the FTP session of the calling thread after its connection dropped, then waits before it is used.
+
+        :param dir_name: Directory on the FTP server to change into
+        :type dir_name: str
+        :param reconnect_delay_seconds: Seconds to wait after reconnecting
+        :type reconnect_delay_seconds: int
+        """
+        self._connect(dir_name) # this assumes the thread is paused to connect
+        time.sleep(reconnect_delay_seconds)
+    
+    def _keep_alive(self, dir_name:str, reconnect_delay_seconds:int=0) -> None:
+        """
+        Checks the FTP session of the calling thread with NOOP and reconnects if it is gone. The main session sits idle
+        while worker threads download with their own sessions, so the server may have timed it out in the meantime.
+
+        :param dir_name: Directory on the FTP server to change into when reconnecting
+        :type dir_name: str
+        :param reconnect_delay_seconds: Seconds to wait after reconnecting, defaults to 0
+        :type reconnect_delay_seconds: int, optional
+        """
+        try:
+            self._ftp.voidcmd('NOOP')
+        except (socket.error, EOFError, error_temp, error_reply): # e.g. '421 Control connection timed out'
+            print('FTP session timed out, reconnecting')
+            self._reconnect(dir_name, reconnect_delay_seconds)
+    
+    def _list_remote_files(self) -> Dict[str, Tuple[Optional[int], Optional[str]]]:
+        """
+        Lists the files in the current directory on the FTP server along with their size and modification time. Uses
+        a single MLSD command when the server supports it and falls back to SIZE and MDTM for each file.
+
+        :return: Mapper from filename to (size, mdtm)
+        :rtype: Dict[str, Tuple[Optional[int], Optional[str]]]
+        """
+        try:
+            return {
+                filename: (int(facts['size']) if 'size' in facts else None, facts.get('modify'))
+                for filename, facts in self._ftp.mlsd(facts=['type', 'size', 'modify'])
+                if facts.get('type') == 'file'
+            }
+        except error_perm: # MLSD not supported
+            return {filename: self._remote_file_info(filename) for filename in self._ftp.nlst()}
+    
+    def _remote_file_info(self, filename:str) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Gets the size and modification time of a file in the current directory on the FTP server.
+
+        :param filename: Name of the file on the server
+        :type filename: str
+        :return: (size, mdtm), either is None if the server does not report it
+        :rtype: Tuple[Optional[int], Optional[str]]
+        """
+        try:
+            self._ftp.voidcmd('TYPE I') # SIZE is only reliable in binary mode
+            size = self._ftp.size(filename)
+        except error_perm:
+            size = None
+        try:
+            mdtm = self._ftp.voidcmd(f'MDTM {filename}').split()[-1] # response looks like '213 YYYYMMDDHHMMSS'
+        except error_perm:
+            mdtm = None
+        return size, mdtm
+    
+    def _sync_offset(self, manifest_path:str, local_file_path:str, remote_size:Optional[int],
+                     remote_mdtm:Optional[str]) -> Optional[int]:
+        """
+        Compares the local copy of a file against the manifest and the server to decide where its download should
+        start.
+
+        :param manifest_path: Path to the file on the FTP server, used as the manifest key
+        :type manifest_path: str
+        :param local_file_path: Absolute path to the local copy
+        :type local_file_path: str
+        :param remote_size: Size reported by the server
+        :type remote_size: Optional[int]
+        :param remote_mdtm: Modification time reported by the server
+        :type remote_mdtm: Optional[str]
+        :return: None if the local copy is complete and unchanged on the server, otherwise the byte offset to resume
+            the download from (0 for a fresh download)
+        :rtype: Optional[int]
+        """
+        entry = self.__manifest.get(manifest_path)
+        if entry is None or remote_size is None or remote_mdtm is None:
+            return 0
+        
+        size, mdtm, md5 = entry
+        part_file_path = PubChemFTP._part_path(local_file_path)
+        if (size, mdtm) != (remote_size, remote_mdtm): # file changed on the server since it was downloaded
+            return 0
+        elif md5 is not None and os.path.exists(local_file_path) and \
+            os.path.getsize(local_file_path) == remote_size: # complete and verified
+            return None
+        elif md5 is None and os.path.exists(part_file_path) and \
+            os.path.getsize(part_file_path) < remote_size: # interrupted part way through the same server version
+            return os.path.getsize(part_file_path)
+        return 0
+    
+    def _sync_read(self, local_file_path:str, filename:str, ftp_directory:str,
+                   remote_files:Dict[str, Tuple[Optional[int], Optional[str]]], force:bool=False,
+                   checks:Optional[TransferChecks]=None) -> Optional[int]:
+        """
+        Downloads a file unless sync or resume mode is on and the manifest shows the local copy is complete and
+        unchanged on the server. The file is written to a '.part' file next to local_file_path; partial files left
+        behind by an interrupted job are resumed with REST. Call _mark_synced once the file passes its integrity check
+        to move it into place, or _move_to_bad_files if it never does.
+
+        :param local_file_path: Absolute path to write the file to
+        :type local_file_path: str
+        :param filename: Name of the file on the server
+        :type filename: str
+        :param ftp_directory: Directory on the FTP server containing the file
+        :type ftp_directory: str
+        :param remote_files: Mapper from filename to (size, mdtm) as returned by _list_remote_files
+        :type remote_files: Dict[str, Tuple[Optional[int], Optional[str]]]
+        :param force: Download from scratch regardless of the manifest, e.g. after a failed integrity check, defaults
+            to False
+        :type force: bool, optional
+        :param checks: Integrity checks to feed with the file as it is downloaded, defaults to None
+        :type checks: Optional[TransferChecks], optional
+        :return: Number of bytes downloaded, None if the local copy is already up to date
+        :rtype: Optional[int]
+        """
+        remote_size, remote_mdtm = remote_files.get(filename, (None, None))
+        offset = 0 if force or not (self.__sync or self.__resume) else self._sync_offset(
+            ftp_directory + filename, local_file_path, remote_size, remote_mdtm)
+        if offset is None:
+            self.__journal.set_state(ftp_directory + filename, 'done')
+            return None
+        
+        self.__manifest.start(ftp_directory + filename, remote_size, remote_mdtm)
+        self.__journal.start_attempt(ftp_directory + filename)
+        time1 = time.time()
+        n_bytes = self._ftp_read(PubChemFTP._part_path(local_file_path), filename, ftp_directory, resume=offset > 0,
+                                 checks=checks)
+        self.__journal.add_transfer(ftp_directory + filename, n_bytes, time.time() - time1)
+        return n_bytes
+    
+    def _mark_synced(self, local_file_path:str, filename:str, ftp_directory:str, md5:str) -> None:
+        """
+        Atomically moves a downloaded file that passed its integrity check from its '.part' file into place and
+        records it as done in the manifest and journal.
+
+        :param local_file_path: Absolute path the file was downloaded for
+        :type local_file_path: str
+        :param filename: Name of the file on the server
+        :type filename: str
+        :param ftp_directory: Directory on the FTP server containing the file
+        :type ftp_directory: str
+        :param md5: MD5 hash of the local copy, as computed while downloading
+        :type md5: str
+        """
+        part_file_path = PubChemFTP._part_path(local_file_path)
+        if os.path.exists(part_file_path): # not there if the file was already up to date
+            os.replace(part_file_path, local_file_path)
+        self.__manifest.finish(ftp_directory + filename, md5)
+        self.__journal.set_state(ftp_directory + filename, 'done')
+    
+    def _move_to_bad_files(self, local_file_path:str, filename:str, ftp_directory:str) -> None:
+        """
+        Moves a file that repeatedly failed its integrity check to the bad files directory and records it as bad.
+
+        :param local_file_path: Absolute path the file was downloaded for
+        :type local_file_path: str
+        :param filename: Name of the file on the server
+        :type filename: str
+        :param ftp_directory: Directory on the FTP server containing the file
+        :type ftp_directory: str
+        """
+        os.replace(PubChemFTP._staged_path(local_file_path), os.path.join(self.__bad_file_path, filename))
+        self.__manifest.remove(ftp_directory + filename)
+        self.__journal.set_state(ftp_directory + filename, 'bad')
+    
+    def _remote_files(self, ftp_directory:str) -> Dict[str, Tuple[Optional[int], Optional[str]]]:
+        """
+        Lists the current directory on the FTP server and journals the listing. In resume mode a journaled listing is
+        reused instead so the server is not listed again.
+
+        :param ftp_directory: Directory on the FTP server, must be the current directory
+        :type ftp_directory: str
+        :return: Mapper from filename to (size, mdtm)
+        :rtype: Dict[str, Tuple[Optional[int], Optional[str]]]
+        """
+        remote_files = self.__journal.listing(ftp_directory) if self.__resume else None
+        if remote_files is None:
+            remote_files = self._list_remote_files()
+            self.__journal.record_listing(ftp_directory, remote_files)
+        return remote_files
+    
+    def _is_done(self, filename:str, ftp_directory:str) -> bool:
+        """
+        :param filename: Name of the file on the server
+        :type filename: str
+        :param ftp_directory: Directory on the FTP server containing the file
+        :type ftp_directory: str
+        :return: Whether resume mode is on and the journal shows the file as done
+        :rtype: bool
+        """
+        return self.__resume and self.__journal.state(ftp_directory + filename) == 'done'
+    
+    def _download_files(self, filenames:List[str], download_file:Callable[[str], int], ftp_directory:str,
+                        n_workers:int=1, verbose:bool=True) -> None:
+        """
+        Downloads each file in filenames with download_file. When n_workers > 1, that many threads each open an
+        independent FTP session in ftp_directory and pull filenames from a shared work queue. Aggregate throughput is
+        printed once the queue is drained.
+
+        :param filenames: Names of the files to download, relative to ftp_directory
+        :type filenames: List[str]
+        :param download_file: Downloads a single file by name and returns the number of bytes written
+        :type download_file: Callable[[str], int]
+        :param ftp_directory: Directory on the FTP server that each worker session changes into
+        :type ftp_directory: str
+        :param n_workers: Number of simultaneous FTP sessions, defaults to 1
+        :type n_workers: int, optional
+        :param verbose: Whether to print status info to console, defaults to True
+        :type verbose: bool, optional
+        """
+        work_queue = queue.Queue()
+        for filename in filenames:
+            work_queue.put(filename)
+        
+        progress_bar = tqdm(total=len(filenames)) if verbose else None
+        totals_lock = threading.Lock()
+        totals = {'files': 0, 'bytes': 0}
+        
+        def worker(open_session:bool) -> None:
+            if open_session: # worker threads need their own session, the main thread already has one
+                try:
+                    self._connect(ftp_directory)
+                except Exception as e:
+                    print(f'Download worker could not connect to FTP server: {e}')
+                    return
+            
+            while True:
+                try:
+                    filename = work_queue.get_nowait()
+                except queue.Empty:
+                    break
+                n_bytes = download_file(filename)
+                with totals_lock:
+                    totals['files'] += 1
+                    totals['bytes'] += n_bytes
+                    if progress_bar is not None:
+                        progress_bar.update(1)
+            
+            if open_session:
+                try:
+                    self._ftp.quit()
+                except Exception:
+                    pass # session is already gone, nothing to clean up
+        
+        time1 = time.time()
+        if n_workers <= 1:
+            worker(open_session=False)
+        else:
+            threads = [threading.Thread(target=worker, args=(True,), daemon=True) for _ in range(n_workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed_seconds = max(time.time() - time1, 1e-9)
+        
+        if progress_bar is not None:
+            progress_bar.close()
+        if not work_queue.empty():
+            print(f'{work_queue.qsize()} files in {ftp_directory} were not downloaded because no worker could connect')
+        if verbose:
+            megabytes = totals['bytes'] / 1e6
+            print(f"Downloaded {totals['files']} files ({megabytes:.1f} MB) in {elapsed_seconds:.1f} s: \
+{megabytes / elapsed_seconds:.2f} MB/s over {max(n_workers, 1)} connection(s)")
     
-    def download_all(self, verbose:bool=True) -> None:
+    def download_all(self, n_workers:int=1, verbose:bool=True) -> None:
         """
         Downloads all relevent data from PubChem FTP server.
 
+        :param n_workers: Number of simultaneous FTP sessions used for the multi-file directories, defaults to 1
+        :type n_workers: int, optional
         :param verbose: Whether to print status info to console at each step, defaults to True
         :type verbose: bool, optional
         """
@@ -82,7 +408,7 @@ class PubChemFTP():
         if verbose:
             print('Downloading substance SDFs...')
         try:
-            self.download_substance_sdfs(verbose=verbose)
+            self.download_substance_sdfs(n_workers=n_workers, verbose=verbose)
         except Exception as e:
             print(f'Error downloading substance SDFs: {e}')
         
@@ -90,7 +416,7 @@ class PubChemFTP():
         if verbose:
             print('Downloading bioassay JSONs...')
         try:
-            self.download_bioassay_jsons(verbose=verbose)
+            self.download_bioassay_jsons(n_workers=n_workers, verbose=verbose)
         except Exception as e:
             print(f'Error downloading bioassay JSONs: {e}')
         
@@ -115,11 +441,11 @@ class PubChemFTP():
         # Path to the single file that needs to be downloaded
         file_path = os.path.join(protein_target_out_dir, self.__protein_target_filename)
         
-        self._ftp_read(file_path, self.__protein_target_filename, self.__protein_target_ftp_directory)
-        if verbose:
-            print(f'Downloaded: {self.__protein_target_filename}')
+        self._download_single_file(file_path, self.__protein_target_filename, self.__protein_target_ftp_directory,
+                                   verbose)
 
-    def download_substance_sdfs(self, max_bad_checksum_download_attempts:int=5, verbose:bool=True) -> None:
+    def download_substance_sdfs(self, max_bad_checksum_download_attempts:int=5, n_workers:int=1,
+                                verbose:bool=True) -> None:
         """
         Downloads all substance files as SDFs (zipped using gzip) as structured in the PubChem FTP server. Uses md5
         checksum files provided by PubChem to verify download integrity.
@@ -127,6 +453,8 @@ class PubChemFTP():
         :param max_bad_checksum_download_attempts: The maxmimum number of attempts to download a file with a bad md5
             checksum, defaults to 5
         :type max_bad_checksum_download_attempts: int, optional
+        :param n_workers: Number of simultaneous FTP sessions to download with, defaults to 1
+        :type n_workers: int, optional
         :param verbose: Whether to print status info to console, defaults to True
         :type verbose: bool, optional
         """
@@ -134,56 +462,115 @@ class PubChemFTP():
         # Make directory locally, change directory on server, get aboslute path to directory locally
         substance_sdf_out_dir = self._cwd_on_server_and_make_dir_locally(self.__substance_sdf_ftp_directory)
         
-        filenames = list(set([filename.split('.')[0] for filename in self.__ftp.nlst()])) # remove extensions and \
-            # merge duplicates so that .sdf.gz and .sdf.gz.md5 are iterated at the same time
+        remote_files = self._remote_files(self.__substance_sdf_ftp_directory)
+        filenames = list(set([filename.split('.')[0] for filename in remote_files])) # remove extensions and merge \
+            # duplicates so that .sdf.gz and .sdf.gz.md5 are iterated at the same time
+        
+        # Skip files a previous run already finished
+        filenames = [filename for filename in filenames if not self._is_done(
+            filename if filename.startswith('README') else f'{filename}.sdf.gz.md5', self.__substance_sdf_ftp_directory
+        )]
 
         # Download each file
-        for filename in (tqdm(filenames) if verbose else filenames):
-            file_path_no_extension = os.path.join(substance_sdf_out_dir, filename)
-            
-            try:
-                if filename.startswith('README'): # README file, no checksum; Saved bc we still want to preserve these
-                    self._ftp_read(file_path_no_extension, filename, self.__substance_sdf_ftp_directory) # README has no extension already
-                    continue
-            
-                else: # not a README
-                    # Try to download up to (max_bad_checksum_download_attempts) times if checksum fails
-                    for i in range(max_bad_checksum_download_attempts):
-                        # Open and write SDF file, should overwrite if already exists in case of bad checksum                            
-                        self._ftp_read(f'{file_path_no_extension}.sdf.gz', f'{filename}.sdf.gz', self.__substance_sdf_ftp_directory)
-                        # Open and write MD5 file, should overwrite if already exists in case of bad checksum
-                        self._ftp_read(f'{file_path_no_extension}.sdf.gz.md5', f'{filename}.sdf.gz.md5', self.__substance_sdf_ftp_directory)
-                            
-                        # Check MD5
-                        if self._substance_sdf_md5_checksum(filename.split('.')[0]): # just the name, no extension
-                            break
-                        elif i == max_bad_checksum_download_attempts - 1: # We've reached the max number of attempts \
-                            # so skip this file
-                            print(f'Could not download substance SDF: {filename} after \
-                                {max_bad_checksum_download_attempts} attempts. Skipping...')
-
-                            # Move bad files away
-                            os.rename(f'{file_path_no_extension}.sdf.gz', os.path.join(self.__bad_file_path,
-                                                                                    f'{filename}.sdf.gz'))
-                            os.rename(f'{file_path_no_extension}.sdf.gz.md5', os.path.join(self.__bad_file_path,
-                                                                                        f'{filename}.sdf.gz.md5'))
-                        elif verbose:
-                            print(f'Bad checksum for: {filename}. Trying again...')
-                        
-
-                        if i == max_bad_checksum_download_attempts - 1:
-                            print(f'Could not download substance SDF: {filename} after \
-                                {max_bad_checksum_download_attempts} attempts. Skipping...')
+        self._download_files(
+            filenames,
+            lambda filename: self._download_substance_sdf(filename, substance_sdf_out_dir, remote_files,
+                                                          max_bad_checksum_download_attempts, verbose),
+            self.__substance_sdf_ftp_directory,
+            n_workers=n_workers,
+            verbose=verbose
+        )
+    
+    def _download_substance_sdf(self, filename:str, substance_sdf_out_dir:str,
+                                remote_files:Dict[str, Tuple[Optional[int], Optional[str]]],
+                                max_bad_checksum_download_attempts:int, verbose:bool) -> int:
+        """
+        Downloads a single substance SDF and its md5 file, retrying while the checksum does not match.
+
+        :param filename: Name of the file on the server without extensions
+        :type filename: str
+        :param substance_sdf_out_dir: Absolute path to the local substance SDF directory
+        :type substance_sdf_out_dir: str
+        :param remote_files: Mapper from filename to (size, mdtm) for the substance SDF directory on the server
+        :type remote_files: Dict[str, Tuple[Optional[int], Optional[str]]]
+        :param max_bad_checksum_download_attempts: The maxmimum number of attempts to download a file with a bad md5
+            checksum
+        :type max_bad_checksum_download_attempts: int
+        :param verbose: Whether to print status info to console
+        :type verbose: bool
+        :return: Number of bytes downloaded
+        :rtype: int
+        """
+        file_path_no_extension = os.path.join(substance_sdf_out_dir, filename)
+        n_bytes = 0
+        
+        try:
+            if filename.startswith('README'): # README file, no checksum; Saved bc we still want to preserve these
+                checks = TransferChecks()
+                n_bytes = self._sync_read(file_path_no_extension, filename, self.__substance_sdf_ftp_directory,
+                                          remote_files, checks=checks) # README has no extension already
+                if n_bytes is not None:
+                    self._mark_synced(file_path_no_extension, filename, self.__substance_sdf_ftp_directory,
+                                      checks.md5)
+                return n_bytes or 0
+        
+            # Try to download up to (max_bad_checksum_download_attempts) times if checksum fails
+            for i in range(max_bad_checksum_download_attempts):
+                # Open and write SDF file, should overwrite if already exists in case of bad checksum
+                sdf_checks = TransferChecks()
+                sdf_bytes = self._sync_read(f'{file_path_no_extension}.sdf.gz', f'{filename}.sdf.gz',
+                                            self.__substance_sdf_ftp_directory, remote_files, force=i > 0,
+                                            checks=sdf_checks)
+                # Open and write MD5 file, should overwrite if already exists in case of bad checksum
+                md5_checks = TransferChecks()
+                md5_bytes = self._sync_read(f'{file_path_no_extension}.sdf.gz.md5', f'{filename}.sdf.gz.md5',
+                                            self.__substance_sdf_ftp_directory, remote_files, force=i > 0,
+                                            checks=md5_checks)
+                
+                if sdf_bytes is None and md5_bytes is None: # both files already up to date in sync mode
+                    return n_bytes
+                n_bytes += (sdf_bytes or 0) + (md5_bytes or 0)
+                
+                # MD5 of the SDF was computed while downloading, only re-read from disk if it was already up to date
+                sdf_md5 = sdf_checks.md5 if sdf_bytes is not None else PubChemFTP._calculate_md5(
+                    PubChemFTP._staged_path(f'{file_path_no_extension}.sdf.gz'))
+                md5_file_md5 = md5_checks.md5 if md5_bytes is not None else PubChemFTP._calculate_md5(
+                    PubChemFTP._staged_path(f'{file_path_no_extension}.sdf.gz.md5'))
                     
-                    if verbose:
-                        print(f'Downloaded: {filename}')
-            except Exception as e:
-                print(f'Error downloading {filename}: {e}')
+                # Check MD5, the .md5 is moved into place last so that a done .md5 means the pair is done
+                if self._substance_sdf_md5_checksum(filename.split('.')[0], sdf_md5): # just the name, no extension
+                    self._mark_synced(f'{file_path_no_extension}.sdf.gz', f'{filename}.sdf.gz',
+                                      self.__substance_sdf_ftp_directory, sdf_md5)
+                    self._mark_synced(f'{file_path_no_extension}.sdf.gz.md5', f'{filename}.sdf.gz.md5',
+                                      self.__substance_sdf_ftp_directory, md5_file_md5)
+                    break
+                elif i == max_bad_checksum_download_attempts - 1: # We've reached the max number of attempts \
+                    # so skip this file
+                    print(f'Could not download substance SDF: {filename} after \
+                        {max_bad_checksum_download_attempts} attempts. Skipping...')
+
+                    # Move bad files away
+                    for extension in ['.sdf.gz', '.sdf.gz.md5']:
+                        self._move_to_bad_files(f'{file_path_no_extension}{extension}', f'{filename}{extension}',
+                                                self.__substance_sdf_ftp_directory)
+                elif verbose:
+                    print(f'Bad checksum for: {filename}. Trying again...')
+            
+            if verbose:
+                print(f'Downloaded: {filename}')
+        except Exception as e:
+            print(f'Error downloading {filename}: {e}')
+        return n_bytes
                 
-    def download_bioassay_jsons(self, max_bad_zip_file_attempts:int=5, verbose:bool=True) -> None:
+    def download_bioassay_jsons(self, max_bad_zip_file_attempts:int=5, n_workers:int=1, verbose:bool=True) -> None:
         """
         Downloads all bioassays as JSON files (zipped using gzip) as structured in the PubChem FTP server.
 
+        :param max_bad_zip_file_attempts: The maximum number of attempts to download a file that fails the zip error
+            check, defaults to 5
+        :type max_bad_zip_file_attempts: int, optional
+        :param n_workers: Number of simultaneous FTP sessions to download with, defaults to 1
+        :type n_workers: int, optional
         :param verbose: Whether to print status info to console, defaults to True
         :type verbose: bool, optional
         """
@@ -192,44 +579,88 @@ class PubChemFTP():
         bioassay_json_out_dir = self._cwd_on_server_and_make_dir_locally(self.__bioassay_json_ftp_directory)
 
         # Retrieve a list of all file names in the directory
-        filenames = self.__ftp.nlst()        
+        remote_files = self._remote_files(self.__bioassay_json_ftp_directory)
 
-        # Download each file
-        for filename in (tqdm(filenames[397:]) if verbose else filenames):
-            file_path = os.path.join(bioassay_json_out_dir, filename)
+        # Download each file, skipping files a previous run already finished
+        self._download_files(
+            [filename for filename in remote_files if not self._is_done(filename, self.__bioassay_json_ftp_directory)],
+            lambda filename: self._download_bioassay_json(filename, bioassay_json_out_dir, remote_files,
+                                                          max_bad_zip_file_attempts, verbose),
+            self.__bioassay_json_ftp_directory,
+            n_workers=n_workers,
+            verbose=verbose
+        )
+    
+    def _download_bioassay_json(self, filename:str, bioassay_json_out_dir:str,
+                                remote_files:Dict[str, Tuple[Optional[int], Optional[str]]],
+                                max_bad_zip_file_attempts:int, verbose:bool) -> int:
+        """
+        Downloads a single bioassay JSON zip directory, retrying while it fails the zip error check.
+
+        :param filename: Name of the file on the server
+        :type filename: str
+        :param bioassay_json_out_dir: Absolute path to the local bioassay JSON directory
+        :type bioassay_json_out_dir: str
+        :param remote_files: Mapper from filename to (size, mdtm) for the bioassay JSON directory on the server
+        :type remote_files: Dict[str, Tuple[Optional[int], Optional[str]]]
+        :param max_bad_zip_file_attempts: The maximum number of attempts to download a file that fails the zip error
+            check
+        :type max_bad_zip_file_attempts: int
+        :param verbose: Whether to print status info to console
+        :type verbose: bool
+        :return: Number of bytes downloaded
+        :rtype: int
+        """
+        file_path = os.path.join(bioassay_json_out_dir, filename)
+        n_bytes = 0
+        
+        try:
+            if filename.startswith('README'): # README file, no error checking; Saved bc we still want to preserve \
+                # these
+                checks = TransferChecks()
+                n_bytes = self._sync_read(file_path, filename, self.__bioassay_json_ftp_directory, remote_files,
+                                          checks=checks) # README has no extension already
+                if n_bytes is not None:
+                    self._mark_synced(file_path, filename, self.__bioassay_json_ftp_directory, checks.md5)
+                return n_bytes or 0
             
-            try:
-                if filename.startswith('README'): # README file, no error checking; Saved bc we still want to preserve \
-                    # these
-                    self._ftp_read(file_path, filename, self.__bioassay_json_ftp_directory) # README has no extension already
-                    continue
+            # Try to download up to (max_bad_zip_file_attempts) times if error check fails
+            for i in range(max_bad_zip_file_attempts):
+                checks = TransferChecks(verify_zip=True)
+                file_bytes = self._sync_read(file_path, filename, self.__bioassay_json_ftp_directory, remote_files,
+                                             force=i > 0, checks=checks)
+                if file_bytes is None: # already up to date in sync mode
+                    return n_bytes
+                n_bytes += file_bytes
                 
-                # Try to download up to (max_bad_zip_file_attempts) times if error check fails
-                for i in range(max_bad_zip_file_attempts):
-                    self._ftp_read(file_path, filename, self.__bioassay_json_ftp_directory)
+                # CRC of every member was checked while downloading, fall back to reading the archive back from disk if \
+                    # it uses zip features that cannot be checked in one pass. If it is corrupt, re-download
+                zip_ok = checks.zip_ok
+                if zip_ok is None:
+                    zip_ok = PubChemFTP._error_check_bioassay_json(PubChemFTP._staged_path(file_path))
+                if zip_ok:
+                    self._mark_synced(file_path, filename, self.__bioassay_json_ftp_directory, checks.md5)
+                    break
+                elif i == max_bad_zip_file_attempts - 1: # We've reached the max number of attempts so skip this \
+                    # file
+                    print(f'Could not download bioassay JSON: {filename} after {max_bad_zip_file_attempts} \
+                        attempts. Skipping...')
                     
-                    # Try to open the zipped directory, if it can't open, re-download
-                    if PubChemFTP._error_check_bioassay_json(file_path):
-                        break
-                    elif i == max_bad_zip_file_attempts - 1: # We've reached the max number of attempts so skip this \
-                        # file
-                        print(f'Could not download bioassay JSON: {filename} after {max_bad_zip_file_attempts} \
-                            attempts. Skipping...')
-                        
-                        # Move the bad file away
-                        os.rename(file_path, os.path.join(self.__bad_file_path, filename))
-                    elif verbose:
-                        print(f'Bad error check for: {filename}. Trying again...')
-
-                if verbose:
-                    print(f'Downloaded: {filename}')
-            except Exception as e:
-                if hasattr(e, 'message'):
-                    print(f'Error downloading {filename}: {e.message}')
-                elif hasattr(e, 'args') and e.args:
-                    print(f'Error downloading {filename}: {e.args[0]}')
-                else:
-                    print(f'Error downloading {filename}: {str(e)}')
+                    # Move the bad file away
+                    self._move_to_bad_files(file_path, filename, self.__bioassay_json_ftp_directory)
+                elif verbose:
+                    print(f'Bad error check for: {filename}. Trying again...')
+
+            if verbose:
+                print(f'Downloaded: {filename}')
+        except Exception as e:
+            if hasattr(e, 'message'):
+                print(f'Error downloading {filename}: {e.message}')
+            elif hasattr(e, 'args') and e.args:
+                print(f'Error downloading {filename}: {e.args[0]}')
+            else:
+                print(f'Error downloading {filename}: {str(e)}')
+        return n_bytes
                 
     def download_bioassay_asn_metadata(self, verbose:bool=True) -> None:
         """
@@ -248,28 +679,62 @@ class PubChemFTP():
         # Path to the single file that needs to be downloaded
         file_path = os.path.join(bioassay_asn_metadata_out_dir, self.__bioassay_asn_metadata_filename)
         
-        self._ftp_read(file_path, self.__bioassay_asn_metadata_filename, self.__bioassay_asn_metadata_ftp_directory)
+        self._download_single_file(file_path, self.__bioassay_asn_metadata_filename,
+                                   self.__bioassay_asn_metadata_ftp_directory, verbose)
+        
+    def _download_single_file(self, local_file_path:str, filename:str, ftp_directory:str, verbose:bool) -> None:
+        """
+        Downloads one file without an integrity check from the current directory on the FTP server, skipping it in
+        sync mode if it is unchanged.
+
+        :param local_file_path: Absolute path to write the file to
+        :type local_file_path: str
+        :param filename: Name of the file on the server
+        :type filename: str
+        :param ftp_directory: Directory on the FTP server containing the file
+        :type ftp_directory: str
+        :param verbose: Whether to print status info to console
+        :type verbose: bool
+        """
+        if self._is_done(filename, ftp_directory):
+            if verbose:
+                print(f'Already downloaded: {filename}')
+            return
+        
+        checks = TransferChecks()
+        n_bytes = self._sync_read(local_file_path, filename, ftp_directory,
+                                  {filename: self._remote_file_info(filename)}, checks=checks)
+        if n_bytes is None:
+            if verbose:
+                print(f'Up to date: {filename}')
+            return
+        
+        self._mark_synced(local_file_path, filename, ftp_directory, checks.md5)
         if verbose:
-            print(f'Downloaded: {self.__bioassay_asn_metadata_filename}')
+            print(f'Downloaded: {filename}')
                 
     def _make_dir(self) -> None:
         """
-        Conditionally create a directory for the output files based on whether the directory exists and whether it is 
-        overwritable.
+        Conditionally create a directory for the output files based on whether the directory exists, whether it is 
+        overwritable, and whether it is being synced.
 
-        :raises ValueError: Overwrite is False but directory is not empty
+        :raises ValueError: Overwrite and sync are False but directory is not empty
         """
         if not os.path.exists(self.__absolute_out_dir): # create directory if it doesn't exist
             os.makedirs(self.__absolute_out_dir)
+        elif self.__sync or self.__resume: # keep existing files, the manifest and journal decide what needs to be \
+            # downloaded again
+            pass
         elif len(os.listdir(self.__absolute_out_dir)) > 0 and self.__overwrite == False: # raise error if directory \
             # exists and overwrite is False
             raise ValueError(f'Directory {self.__absolute_out_dir} is not empty. Set overwrite=True to overwrite \
-                files. Note that this will delete all files in {self.__absolute_out_dir}.')
+                files. Note that this will delete all files in {self.__absolute_out_dir}. Set sync=True to only \
+                download files that are new or changed on the server.')
         else: # delete directory and recreate if overwrite is True
             shutil.rmtree(self.__absolute_out_dir)
             os.makedirs(self.__absolute_out_dir)
             
-        os.makedirs(self.__bad_file_path)
+        os.makedirs(self.__bad_file_path, exist_ok=True)
             
     def _cwd_on_server_and_make_dir_locally(self, dir_name:str) -> str:
         """
@@ -281,51 +746,89 @@ class PubChemFTP():
         :return: Absolute path to the directory locally
         :rtype: str
         """
-        # Change to the directory on the FTP server
-        self.__ftp.cwd('/' + dir_name) # preface w/ root ('/') to clear previous cwd operations
+        # Change to the directory on the FTP server, on a fresh session if the last one timed out
+        self._keep_alive(dir_name)
+        self._ftp.cwd('/' + dir_name) # preface w/ root ('/') to clear previous cwd operations
         
-        # Make the directory locally
+        # Make the directory locally, may already exist in sync mode or as the parent of another download directory
         out_dir = os.path.join(self.__absolute_out_dir, dir_name)
-        os.makedirs(out_dir)
+        os.makedirs(out_dir, exist_ok=True)
         
         return out_dir
             
-    def _substance_sdf_md5_checksum(self, filename_no_extension:str) -> bool:
+    def _substance_sdf_md5_checksum(self, filename_no_extension:str, calc_md5:Optional[str]=None) -> bool:
         """
         Checks the MD5 checksum of a Substance SDF file against the MD5 checksum. Assumes that the MD5 checksum file is
         in the same directory as the SDF file and has the same name as the SDF file, but with a '.md5' extension.
 
         :param filename_no_extension: Name of file, not path, before ('.')
         :type filename_no_extension: str
+        :param calc_md5: MD5 of the SDF file if already computed while downloading, otherwise it is computed from the
+            file on disk, defaults to None
+        :type calc_md5: Optional[str], optional
         :return: Status of whether or not the MD5 checksums match
         :rtype: bool
         """
         file_stem = os.path.join(self.__absolute_out_dir, self.__substance_sdf_ftp_directory, filename_no_extension)
-        calc_md5 = self._calculate_md5(f'{file_stem}.sdf.gz')
-        read_md5 = open(f'{file_stem}.sdf.gz.md5', 'r').read().split()[0]
+        if calc_md5 is None:
+            calc_md5 = self._calculate_md5(PubChemFTP._staged_path(f'{file_stem}.sdf.gz'))
+        with open(PubChemFTP._staged_path(f'{file_stem}.sdf.gz.md5'), 'r') as file:
+            read_md5 = file.read().split()[0]
         return calc_md5 == read_md5
     
     @staticmethod
-    def _calculate_md5(filepath:str) -> str:
+    def _part_path(local_file_path:str) -> str:
+        """
+        :param local_file_path: Absolute path a file is downloaded for
+        :type local_file_path: str
+        :return: Path the file is written to while it is downloading and unverified
+        :rtype: str
+        """
+        return f'{local_file_path}.part'
+    
+    @staticmethod
+    def _staged_path(local_file_path:str) -> str:
+        """
+        :param local_file_path: Absolute path a file is downloaded for
+        :type local_file_path: str
+        :return: Path to the '.part' file if the file has not been moved into place yet, otherwise local_file_path
+        :rtype: str
+        """
+        part_file_path = PubChemFTP._part_path(local_file_path)
+        return part_file_path if os.path.exists(part_file_path) else local_file_path
+    
+    @staticmethod
+    def _calculate_md5(filepath:str, chunk_size:int=1024 * 1024) -> str:
         """
         Calculates the Message Digest Algorithm 5 crytographic hash of a file.
 
         :param filepath: Path to file to be hashed
         :type filepath: str
+        :param chunk_size: Number of bytes read at a time, defaults to 1 MiB
+        :type chunk_size: int, optional
         :return: MD5 hash of file
         :rtype: str
         """
         md5_hash = hashlib.md5()
         with open(filepath, 'rb') as file:
-            for chunk in iter(lambda: file.read(4096), b''):
+            for chunk in iter(lambda: file.read(chunk_size), b''):
                 md5_hash.update(chunk)
         return md5_hash.hexdigest()
     
     @staticmethod
     def _error_check_bioassay_json(absolute_file_path:str) -> bool:
+        """
+        Reads a bioassay zip directory back from disk and tests the CRC of every member. Only used when the archive
+        could not be checked while it was downloading.
+
+        :param absolute_file_path: Path to the zip directory
+        :type absolute_file_path: str
+        :return: Whether the zip directory is intact
+        :rtype: bool
+        """
         try:
-            zipfile.ZipFile(absolute_file_path, 'r')
-            return True
+            with zipfile.ZipFile(absolute_file_path, 'r') as zip_ref:
+                return zip_ref.testzip() is None
         except Exception:
             return False
         
@@ -334,4 +837,4 @@ if __name__ == '__main__':
     pc_ftp = PubChemFTP(os.path.join(os.getcwd(), 'pubchem_ftp_data'), overwrite=True)
     
     # Download protein target xref, substance sdf, and bioassay json files
-    pc_ftp.download_all(verbose=True)
+    pc_ftp.download_all(n_workers=4, verbose=True)
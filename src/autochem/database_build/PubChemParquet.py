@@ -0,0 +1,305 @@
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Generator, Iterable, List, Optional, Tuple
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+from .__ABCChemDB import __ABCChemDB
+from .PubChemDB import PubChemDB, _bounded_ordered_map, _rdkit_stfu, ijson
+
+
+def _bioassay_zip_dir_to_parquet(args:Tuple[str, str, bool, int]) -> Tuple[int, Optional[str]]:
+    """ Process pool worker for PubChemParquet.write_bioassay_datasets, see PubChemParquet._write_bioassay_zip_dir.
+    Returns (rows written, None) or (0, error message) after removing what was written for the zip directory. """
+    zip_dir_path, out_dir_path, _, _ = args
+    try:
+        return PubChemParquet._write_bioassay_zip_dir(*args), None
+    except Exception as e:
+        PubChemParquet._remove_bioassay_zip_dir(zip_dir_path, out_dir_path)
+        return 0, f'{type(e).__name__} {e}'
+
+@_rdkit_stfu
+def _substance_sdf_to_parquet(args:Tuple[str, str, int, bool]) -> Optional[str]:
+    """ Process pool worker for PubChemParquet.write_substance_dataset, see PubChemParquet._write_substance_sdf.
+    Returns an error message if the file could not be converted. """
+    try:
+        PubChemParquet._write_substance_sdf(*args)
+    except Exception as e:
+        return f'{type(e).__name__} {e}'
+    return None
+
+
+class PubChemParquet(__ABCChemDB):
+    # Columns of the Postgres tables PubChemDB builds, activity also gets the protein accession of its bioassay
+    __bioassay_schema = pa.schema([
+        pa.field('bioassay_id', pa.int64()),
+        pa.field('gene_id', pa.int64()),
+        pa.field('protein_accession', pa.string()),
+        pa.field('assay_data', pa.string()), # serialized JSON, see PubChemDB._reformat_bioassay_data
+        pa.field('assay_columns', pa.list_(pa.string()))
+    ])
+    __result_column_schema = pa.schema([
+        pa.field('bioassay_id', pa.int64()),
+        pa.field('tid', pa.int64()),
+        pa.field('name', pa.string()),
+        pa.field('unit', pa.string())
+    ])
+    __activity_schema = pa.schema([
+        pa.field('bioassay_id', pa.int64()),
+        pa.field('sid', pa.int64()),
+        pa.field('tid', pa.int64()),
+        pa.field('outcome', pa.string()),
+        pa.field('value_num', pa.float64()),
+        pa.field('value_text', pa.string()),
+        pa.field('protein_accession', pa.string())
+    ])
+    __substance_schema = pa.schema([
+        pa.field('substance_id', pa.int64()),
+        pa.field('smiles', pa.string())
+    ])
+
+    # Stages of build
+    build_stages = ('substance', 'bioassay')
+
+    def __init__(self, bioassay_json_dir_path:str, substance_sdf_dir_path:str, out_dir_path:str) -> None:
+        """
+        Writes the curated PubChem tables to Parquet datasets instead of Postgres, from the same files and with the
+        same row builders as PubChemDB. Each dataset is a directory under out_dir_path that can be scanned with
+        pyarrow.dataset, DuckDB or pandas using hive partitioning, so filters on the partition columns skip whole
+        directories and filters on other columns use row group statistics.
+
+        :param bioassay_json_dir_path: Directory of bioassay JSON zip archives
+        :type bioassay_json_dir_path: str
+        :param substance_sdf_dir_path: Directory of substance .sdf.gz files
+        :type substance_sdf_dir_path: str
+        :param out_dir_path: Directory to write the datasets to, created if it does not exist
+        :type out_dir_path: str
+        """
+        self.bioassay_json_dir_path = bioassay_json_dir_path
+        self.substance_sdf_dir_path = substance_sdf_dir_path
+        self.out_dir_path = out_dir_path
+
+    def build(self, stages:Optional[List[str]]=None, n_workers:int=1, stream_json:bool=False) -> None:
+        """
+        Writes the datasets of the selected stages, replacing any written before.
+
+        :param stages: Stages to run, any of PubChemParquet.build_stages, defaults to all of them
+        :type stages: Optional[List[str]], optional
+        :param n_workers: Number of processes that each convert one input file at a time, defaults to 1
+        :type n_workers: int, optional
+        :param stream_json: Whether to parse bioassay JSON incrementally, see PubChemDB.repopulate_bioassay_table,
+            defaults to False
+        :type stream_json: bool, optional
+        """
+        stages = list(PubChemParquet.build_stages) if stages is None else stages
+        unknown_stages = set(stages) - set(PubChemParquet.build_stages)
+        if unknown_stages:
+            raise ValueError(f'Unknown build stages {sorted(unknown_stages)}, expected any of '
+                             f'{PubChemParquet.build_stages}')
+
+        if 'substance' in stages:
+            self.write_substance_dataset(n_workers=n_workers)
+        if 'bioassay' in stages:
+            self.write_bioassay_datasets(n_workers=n_workers, stream=stream_json)
+
+    def write_substance_dataset(self, n_workers:int=1, chunk_size:int=100000, fast_smiles:bool=False) -> None:
+        """
+        Writes out_dir_path/substance with one Parquet file per .sdf.gz file, named after it, and one row group per
+        chunk_size molecules. PubChem numbers substances in file order, so the substance_id statistics of each row
+        group cover a narrow range. Files that fail to convert are reported and left out.
+
+        :param n_workers: Number of processes that each convert one file at a time, defaults to 1
+        :type n_workers: int, optional
+        :param chunk_size: Molecules per row group, defaults to 100000
+        :type chunk_size: int, optional
+        :param fast_smiles: Whether to skip the sanitization steps SMILES generation does not need, see
+            PubChemDB._fast_mol_to_smiles, defaults to False
+        :type fast_smiles: bool, optional
+        """
+        dataset_path = PubChemParquet._recreate_dir(os.path.join(self.out_dir_path, 'substance'))
+        filenames = sorted(filename for filename in os.listdir(self.substance_sdf_dir_path)
+                           if filename.endswith('.sdf.gz'))
+        jobs = [(os.path.join(self.substance_sdf_dir_path, filename),
+                 os.path.join(dataset_path, f"{filename.split('.')[0]}.parquet"), chunk_size, fast_smiles)
+                for filename in filenames]
+
+        n_failed_files = 0
+        for filename, error in zip(filenames, tqdm(PubChemParquet._map(_substance_sdf_to_parquet, jobs, n_workers),
+                                                   total=len(jobs))):
+            if error is not None:
+                print(f'Failed to convert {filename}: {error}')
+                n_failed_files += 1
+        print(f'Wrote {len(filenames) - n_failed_files} substance files to {dataset_path} ({n_failed_files} failed)')
+
+    def write_bioassay_datasets(self, n_workers:int=1, stream:bool=False, activity_batch_size:int=1000000) -> None:
+        """
+        Writes the bioassay, result_column and activity rows PubChemDB loads into Postgres to datasets of the same
+        names in out_dir_path. Every dataset is partitioned by the AID range of the zip directory its rows come from
+        (e.g. aid_range=0001001_0002000), bioassay and activity also by protein_accession. Unlike the Postgres build,
+        bioassays keep their protein accession and data whether or not it is in the target table. Each zip directory
+        is written by one worker process in parts of at most activity_batch_size activity rows; a zip directory that
+        fails is reported and removed from every dataset.
+
+        :param n_workers: Number of processes that each convert one zip directory at a time, defaults to 1
+        :type n_workers: int, optional
+        :param stream: Whether to parse bioassay JSON incrementally, see PubChemDB.repopulate_bioassay_table, defaults
+            to False
+        :type stream: bool, optional
+        :param activity_batch_size: Maximum number of activity rows per part, defaults to 1000000
+        :type activity_batch_size: int, optional
+        """
+        if stream and ijson is None:
+            raise ImportError('Streaming bioassay JSON requires ijson')
+
+        for dataset in ['bioassay', 'result_column', 'activity']:
+            PubChemParquet._recreate_dir(os.path.join(self.out_dir_path, dataset))
+        zip_dir_paths = sorted(os.path.join(self.bioassay_json_dir_path, file)
+                               for file in os.listdir(self.bioassay_json_dir_path) if file.endswith('.zip'))
+        jobs = [(zip_dir_path, self.out_dir_path, stream, activity_batch_size) for zip_dir_path in zip_dir_paths]
+
+        n_rows = 0
+        n_failed_zip_dirs = 0
+        for zip_dir_path, (n_zip_dir_rows, error) in zip(zip_dir_paths,
+                                                          tqdm(PubChemParquet._map(_bioassay_zip_dir_to_parquet, jobs,
+                                                                                   n_workers),
+                                                               total=len(jobs))):
+            if error is not None:
+                print(f'Failed to convert {zip_dir_path}, left out of the datasets: {error}')
+                n_failed_zip_dirs += 1
+            n_rows += n_zip_dir_rows
+        print(f'Wrote {n_rows} bioassay and activity rows from {len(zip_dir_paths) - n_failed_zip_dirs} zip '
+              f'directories to {self.out_dir_path} ({n_failed_zip_dirs} failed)')
+
+    @staticmethod
+    def _write_bioassay_zip_dir(zip_dir_path:str, out_dir_path:str, stream:bool=False,
+                                activity_batch_size:int=1000000) -> int:
+        """
+        Writes the rows of every bioassay in a zip directory, skipping those sourced from ChEMBL, replacing anything
+        written for it before.
+
+        :param zip_dir_path: Path to .zip directory containing .json.gz files
+        :type zip_dir_path: str
+        :param out_dir_path: Directory holding the datasets
+        :type out_dir_path: str
+        :param stream: Whether to parse bioassay JSON incrementally, defaults to False
+        :type stream: bool, optional
+        :param activity_batch_size: Maximum number of activity rows per part, defaults to 1000000
+        :type activity_batch_size: int, optional
+        :return: Number of bioassay and activity rows written
+        :rtype: int
+        """
+        PubChemParquet._remove_bioassay_zip_dir(zip_dir_path, out_dir_path)
+        aid_range = os.path.basename(zip_dir_path).split('.')[0]
+
+        n_rows = 0
+        n_parts = 0
+        bioassay_rows, result_column_rows, activity_rows = [], [], []
+        for bioassay_json in PubChemDB._bioassay_zip_dir_loader(zip_dir_path, stream=stream):
+            # Skip if from chembl
+            if bioassay_json['PC_AssaySubmit']['assay']['descr']['aid_source']['db']['name'].lower() == 'chembl':
+                continue
+
+            # Known before any data is read, so activity rows streamed ahead of their bioassay row get it too
+            protein_accession = PubChemDB._bioassay_protein_accession(bioassay_json)
+            assay_rows = PubChemDB._bioassay_stream_tables_rows(bioassay_json) if stream else \
+                [PubChemDB._bioassay_tables_rows(bioassay_json)]
+            for bioassay_row, assay_result_column_rows, assay_activity_rows in assay_rows:
+                if bioassay_row is not None:
+                    bioassay_rows.append(bioassay_row)
+                result_column_rows.extend(assay_result_column_rows)
+                activity_rows.extend(row + (protein_accession,) for row in assay_activity_rows)
+
+                if len(activity_rows) >= activity_batch_size:
+                    PubChemParquet._write_bioassay_part(out_dir_path, aid_range, n_parts, bioassay_rows,
+                                                        result_column_rows, activity_rows)
+                    n_rows += len(bioassay_rows) + len(activity_rows)
+                    n_parts += 1
+                    bioassay_rows, result_column_rows, activity_rows = [], [], []
+
+        if bioassay_rows or result_column_rows or activity_rows:
+            PubChemParquet._write_bioassay_part(out_dir_path, aid_range, n_parts, bioassay_rows, result_column_rows,
+                                                activity_rows)
+            n_rows += len(bioassay_rows) + len(activity_rows)
+        return n_rows
+
+    @staticmethod
+    def _write_bioassay_part(out_dir_path:str, aid_range:str, part:int, bioassay_rows:List[tuple],
+                             result_column_rows:List[tuple], activity_rows:List[tuple]) -> None:
+        """ Writes one part of the rows of a zip directory, see _write_bioassay_zip_dir. """
+        for dataset, rows, schema, partition_cols in [
+            ('bioassay', bioassay_rows, PubChemParquet.__bioassay_schema, ['protein_accession']),
+            ('result_column', result_column_rows, PubChemParquet.__result_column_schema, None),
+            ('activity', activity_rows, PubChemParquet.__activity_schema, ['protein_accession'])
+        ]:
+            if not rows:
+                continue
+            pq.write_to_dataset(PubChemParquet._table(rows, schema),
+                                os.path.join(out_dir_path, dataset, f'aid_range={aid_range}'),
+                                partition_cols=partition_cols, basename_template=f'part-{part}-{{i}}.parquet',
+                                existing_data_behavior='overwrite_or_ignore')
+
+    @staticmethod
+    def _remove_bioassay_zip_dir(zip_dir_path:str, out_dir_path:str) -> None:
+        """ Removes the partition of a zip directory from every bioassay dataset. """
+        aid_range = os.path.basename(zip_dir_path).split('.')[0]
+        for dataset in ['bioassay', 'result_column', 'activity']:
+            shutil.rmtree(os.path.join(out_dir_path, dataset, f'aid_range={aid_range}'), ignore_errors=True)
+
+    @staticmethod
+    def _write_substance_sdf(sdf_gz_path:str, parquet_path:str, chunk_size:int=100000,
+                             fast_smiles:bool=False) -> None:
+        """
+        Converts a .sdf.gz file to a Parquet file, one row group per chunk. The file is written under a hidden name
+        and renamed once complete, so a dataset scan never sees a partial file.
+
+        :param sdf_gz_path: Path to .sdf.gz file
+        :type sdf_gz_path: str
+        :param parquet_path: Path to the Parquet file to write
+        :type parquet_path: str
+        :param chunk_size: Molecules per row group, defaults to 100000
+        :type chunk_size: int, optional
+        :param fast_smiles: Whether to use PubChemDB._fast_mol_to_smiles, defaults to False
+        :type fast_smiles: bool, optional
+        """
+        partial_path = os.path.join(os.path.dirname(parquet_path), f'.{os.path.basename(parquet_path)}.partial')
+        try:
+            with pq.ParquetWriter(partial_path, PubChemParquet.__substance_schema) as writer:
+                for rows in PubChemDB._substance_sdf_chunk_generator(sdf_gz_path, chunk_size, fast_smiles):
+                    writer.write_table(PubChemParquet._table([(int(substance_id), smiles)
+                                                              for substance_id, smiles in rows],
+                                                             PubChemParquet.__substance_schema))
+        except Exception:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        os.replace(partial_path, parquet_path)
+
+    @staticmethod
+    def _table(rows:List[tuple], schema:pa.Schema) -> pa.Table:
+        """
+        :param rows: Rows with values in the order of the fields of schema
+        :type rows: List[tuple]
+        :param schema: Schema of the table
+        :type schema: pa.Schema
+        :return: Table of the rows
+        :rtype: pa.Table
+        """
+        columns = zip(*rows) if rows else [[] for _ in schema]
+        return pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                    schema=schema)
+
+    @staticmethod
+    def _recreate_dir(path:str) -> str:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+
+    @staticmethod
+    def _map(func:Callable, items:Iterable, n_workers:int=1) -> Generator:
+        """ Maps func over items in this process, or in n_workers processes if n_workers > 1, in order. """
+        if n_workers <= 1:
+            yield from map(func, items)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                yield from _bounded_ordered_map(executor, func, items, 2 * n_workers)
@@ -0,0 +1,85 @@
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+
+class SyncManifest():
+    def __init__(self, manifest_path:str) -> None:
+        """
+        Local record of every file mirrored from the PubChem FTP server. A row is written with a NULL md5 before a
+        download starts and the md5 is filled in once the file passes its integrity check, so a row with a NULL md5
+        always marks a partial or unverified file.
+
+        :param manifest_path: Path to the SQLite file holding the manifest, created if it does not exist
+        :type manifest_path: str
+        """
+        self.__lock = threading.Lock() # download workers share one connection
+        self.__connection = sqlite3.connect(manifest_path, check_same_thread=False)
+
+        with self.__lock:
+            self.__connection.execute('''
+                CREATE TABLE IF NOT EXISTS manifest (
+                    path TEXT PRIMARY KEY, -- path on the FTP server
+                    size INTEGER, -- size reported by the server
+                    mdtm TEXT, -- modification time reported by the server, YYYYMMDDHHMMSS
+                    md5 TEXT -- md5 of the verified local copy, NULL while the download is incomplete
+                )
+            ''')
+            self.__connection.commit()
+
+    def get(self, path:str) -> Optional[Tuple[Optional[int], Optional[str], Optional[str]]]:
+        """
+        Gets the manifest entry for a file.
+
+        :param path: Path to the file on the FTP server
+        :type path: str
+        :return: (size, mdtm, md5) of the file, None if the file has never been downloaded
+        :rtype: Optional[Tuple[Optional[int], Optional[str], Optional[str]]]
+        """
+        with self.__lock:
+            return self.__connection.execute('SELECT size, mdtm, md5 FROM manifest WHERE path = ?',
+                                             (path,)).fetchone()
+
+    def start(self, path:str, size:Optional[int], mdtm:Optional[str]) -> None:
+        """
+        Records that a download of the server version (size, mdtm) of a file has started.
+
+        :param path: Path to the file on the FTP server
+        :type path: str
+        :param size: Size reported by the server
+        :type size: Optional[int]
+        :param mdtm: Modification time reported by the server
+        :type mdtm: Optional[str]
+        """
+        with self.__lock:
+            self.__connection.execute('INSERT OR REPLACE INTO manifest (path, size, mdtm, md5) VALUES (?, ?, ?, NULL)',
+                                      (path, size, mdtm))
+            self.__connection.commit()
+
+    def finish(self, path:str, md5:str) -> None:
+        """
+        Records that the local copy of a file is complete and verified.
+
+        :param path: Path to the file on the FTP server
+        :type path: str
+        :param md5: MD5 hash of the local copy
+        :type md5: str
+        """
+        with self.__lock:
+            self.__connection.execute('UPDATE manifest SET md5 = ? WHERE path = ?', (md5, path))
+            self.__connection.commit()
+
+    def remove(self, path:str) -> None:
+        """
+        Forgets a file, e.g. after it was moved to the bad files directory.
+
+        :param path: Path to the file on the FTP server
+        :type path: str
+        """
+        with self.__lock:
+            self.__connection.execute('DELETE FROM manifest WHERE path = ?', (path,))
+            self.__connection.commit()
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,261 @@
+import hashlib
+import struct
+import zlib
+from typing import Optional
+
+
+class StreamingZipVerifier():
+    # Record signatures and layouts sourced from: https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+    __local_file_header_signature = b'PK\x03\x04'
+    __central_directory_signature = b'PK\x01\x02'
+    __end_of_central_directory_signature = b'PK\x05\x06'
+    __data_descriptor_signature = b'PK\x07\x08'
+    __local_file_header = struct.Struct('<4sHHHHHIIIHH')
+    __end_of_central_directory = struct.Struct('<4sHHHHIIH')
+    __max_end_of_central_directory_size = 22 + 65535 # fixed record + largest possible comment
+
+    def __init__(self) -> None:
+        """
+        Checks a zip archive while it is being downloaded. Local file headers are parsed as bytes arrive and the CRC-32
+        of every member is computed on the fly, so corrupt archives are caught without reading the file back from disk.
+        Archives using features that cannot be checked in a single forward pass (encryption, zip64 sizes, stored
+        members without sizes in the header) are reported as unverifiable so the caller can fall back to
+        zipfile.ZipFile.testzip.
+        """
+        self.__buffer = bytearray()
+        self.__state = 'header' # header -> data -> (descriptor) -> header ... -> trailer
+        self.__error = None
+        self.__unverifiable = False
+        self.__n_bytes = 0 # fed so far, the buffer holds the last unconsumed ones
+        self.__n_members = 0
+        self.__central_directory_offset = None
+
+        # Current member
+        self.__method = None
+        self.__decompressor = None
+        self.__has_data_descriptor = False
+        self.__expected_crc = 0
+        self.__crc = 0
+        self.__remaining_compressed_bytes = 0
+
+    def update(self, chunk:bytes) -> None:
+        """
+        Feeds the next block of the archive.
+
+        :param chunk: Bytes following those already fed
+        :type chunk: bytes
+        """
+        if self.__error is not None or self.__unverifiable:
+            return
+
+        self.__buffer.extend(chunk)
+        self.__n_bytes += len(chunk)
+        try:
+            self._process_buffer()
+        except (zlib.error, struct.error) as e:
+            self.__error = str(e)
+
+        if self.__state == 'trailer': # only the end of central directory record is needed from here on
+            del self.__buffer[:-self.__max_end_of_central_directory_size]
+
+    def result(self) -> Optional[bool]:
+        """
+        Result of the check once the whole archive has been fed.
+
+        :return: True if every member passed its CRC check and the archive is complete, False if it is corrupt or
+            truncated, None if it could not be checked while streaming
+        :rtype: Optional[bool]
+        """
+        if self.__error is not None:
+            return False
+        elif self.__unverifiable:
+            return None
+        elif self.__state != 'trailer':
+            return False
+        return self._check_end_of_central_directory()
+
+    def _check_end_of_central_directory(self) -> Optional[bool]:
+        """
+        Checks that the archive ends with a complete end of central directory record, i.e. exactly its comment follows
+        the fixed part, and that the record agrees with the members and central directory that were streamed.
+
+        :return: Whether the record is complete and consistent, None for zip64 archives
+        :rtype: Optional[bool]
+        """
+        # The comment may contain the signature itself, the record is the last one that ends exactly at the end
+        start = self.__buffer.rfind(self.__end_of_central_directory_signature)
+        while start >= 0:
+            end = start + self.__end_of_central_directory.size
+            if end <= len(self.__buffer) and \
+                end + struct.unpack_from('<H', self.__buffer, end - 2)[0] == len(self.__buffer):
+                break
+            start = self.__buffer.rfind(self.__end_of_central_directory_signature, 0, start)
+        if start < 0: # missing, or cut inside the record or its comment
+            return False
+
+        _, disk, central_directory_disk, disk_entries, entries, central_directory_size, central_directory_offset, _ = \
+            self.__end_of_central_directory.unpack_from(self.__buffer, start)
+        if 0xFFFF in (disk_entries, entries) or 0xFFFFFFFF in (central_directory_size, central_directory_offset):
+            return None # zip64, the real values are in the zip64 record
+        end_of_central_directory_offset = self.__n_bytes - len(self.__buffer) + start
+        return disk == central_directory_disk == 0 and disk_entries == entries == self.__n_members and \
+            central_directory_offset == self.__central_directory_offset and \
+            central_directory_size == end_of_central_directory_offset - self.__central_directory_offset
+
+    def _process_buffer(self) -> None:
+        while True:
+            if self.__state == 'header':
+                if not self._read_local_file_header():
+                    return
+            elif self.__state == 'data':
+                if not self._read_member_data():
+                    return
+            elif self.__state == 'descriptor':
+                if not self._read_data_descriptor():
+                    return
+            else: # trailer
+                return
+
+            if self.__error is not None or self.__unverifiable:
+                return
+
+    def _read_local_file_header(self) -> bool:
+        if len(self.__buffer) < 4:
+            return False
+
+        signature = bytes(self.__buffer[:4])
+        if signature in (self.__central_directory_signature, self.__end_of_central_directory_signature):
+            self.__state = 'trailer' # all members have been read
+            self.__central_directory_offset = self.__n_bytes - len(self.__buffer)
+            return True
+        elif signature != self.__local_file_header_signature:
+            self.__error = 'Bad local file header signature'
+            return False
+
+        if len(self.__buffer) < self.__local_file_header.size:
+            return False
+        _, _, flags, method, _, _, crc, compressed_size, uncompressed_size, name_length, extra_length = \
+            self.__local_file_header.unpack_from(self.__buffer)
+        header_length = self.__local_file_header.size + name_length + extra_length
+        if len(self.__buffer) < header_length:
+            return False
+
+        self.__has_data_descriptor = bool(flags & 0x08)
+        if flags & 0x01 or method not in (0, 8): # encrypted or not stored/deflated
+            self.__unverifiable = True
+        elif not self.__has_data_descriptor and 0xFFFFFFFF in (compressed_size, uncompressed_size): # zip64
+            self.__unverifiable = True
+        elif method == 0 and self.__has_data_descriptor: # stored member of unknown length
+            self.__unverifiable = True
+        if self.__unverifiable:
+            return False
+
+        self.__method = method
+        self.__decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if method == 8 else None
+        self.__expected_crc = crc
+        self.__crc = 0
+        self.__remaining_compressed_bytes = compressed_size
+        self.__n_members += 1
+        del self.__buffer[:header_length]
+        self.__state = 'data'
+        return True
+
+    def _read_member_data(self) -> bool:
+        if not self.__buffer:
+            return False
+
+        if self.__has_data_descriptor: # length unknown, the end of the deflate stream marks the end of the member
+            data = bytes(self.__buffer)
+            self.__buffer.clear()
+        else:
+            data = bytes(self.__buffer[:self.__remaining_compressed_bytes])
+            del self.__buffer[:len(data)]
+            self.__remaining_compressed_bytes -= len(data)
+
+        if self.__method == 8:
+            self.__crc = zlib.crc32(self.__decompressor.decompress(data), self.__crc)
+            if self.__decompressor.eof:
+                self.__buffer[:0] = self.__decompressor.unused_data # bytes past the end belong to the next record
+        else:
+            self.__crc = zlib.crc32(data, self.__crc)
+
+        if self.__has_data_descriptor:
+            if not self.__decompressor.eof:
+                return False
+            self.__state = 'descriptor'
+            return True
+        elif self.__remaining_compressed_bytes > 0:
+            return False
+
+        if self.__method == 8 and not self.__decompressor.eof:
+            self.__error = 'Deflate stream ended early'
+        elif self.__crc != self.__expected_crc:
+            self.__error = 'Bad CRC-32'
+        self.__state = 'header'
+        return True
+
+    def _read_data_descriptor(self) -> bool:
+        # Descriptor is [signature] crc-32 compressed-size uncompressed-size, where the sizes are 4 or 8 (zip64) bytes
+        start = 4 if self.__buffer[:4] == self.__data_descriptor_signature else 0
+        if len(self.__buffer) < start + 4:
+            return False
+        if struct.unpack_from('<I', self.__buffer, start)[0] != self.__crc:
+            self.__error = 'Bad CRC-32'
+            return False
+
+        # Size fields are either 8 or 16 bytes long, whichever is followed by the next record
+        for sizes_length in (8, 16):
+            end = start + 4 + sizes_length
+            if len(self.__buffer) < end + 4:
+                return False
+            if bytes(self.__buffer[end:end + 2]) == b'PK':
+                del self.__buffer[:end]
+                self.__state = 'header'
+                return True
+        self.__error = 'Bad data descriptor'
+        return False
+
+
+class TransferChecks():
+    def __init__(self, verify_zip:bool=False) -> None:
+        """
+        Integrity checks fed with each block of a download as it arrives, so that a file is hashed (and, for zip
+        archives, CRC checked) in the same pass that writes it to disk.
+
+        :param verify_zip: Whether to also check the download as a zip archive, defaults to False
+        :type verify_zip: bool, optional
+        """
+        self.__verify_zip = verify_zip
+        self.reset()
+
+    def reset(self) -> None:
+        """ Discards everything fed so far, e.g. when a download restarts from the beginning. """
+        self.__md5_hash = hashlib.md5()
+        self.__zip_verifier = StreamingZipVerifier() if self.__verify_zip else None
+
+    def update(self, chunk:bytes) -> None:
+        """
+        Feeds the next block of the download.
+
+        :param chunk: Bytes following those already fed
+        :type chunk: bytes
+        """
+        self.__md5_hash.update(chunk)
+        if self.__zip_verifier is not None:
+            self.__zip_verifier.update(chunk)
+
+    @property
+    def md5(self) -> str:
+        """
+        :return: MD5 hash of everything fed so far
+        :rtype: str
+        """
+        return self.__md5_hash.hexdigest()
+
+    @property
+    def zip_ok(self) -> Optional[bool]:
+        """
+        :return: Result of StreamingZipVerifier.result, None if verify_zip is False
+        :rtype: Optional[bool]
+        """
+        return self.__zip_verifier.result() if self.__zip_verifier is not None else None
@@ -1,9 +1,10 @@
-import psycopg2
 import requests
 from requests.adapters import HTTPAdapter, Retry
 import re
 from tqdm import tqdm
+from typing import Optional
 from .__ABCChemDB import __ABCChemDB
+from ..PostgresPool import PostgresPool
 from math import ceil
 
 
@@ -20,14 +21,10 @@ class KnownLengthIterator:
 
 
 class UniProtDB(__ABCChemDB):
-    def __init__(self) -> None:
-        ########## Connect to DB ##########
-        host = 'localhost'
-        database = 'uniprot'
-        user = 'postgres'
-        password = 'Coll@bor@tions2020'
-        # port = '5432'
-        self.connection = psycopg2.connect(host=host, database=database, user=user, password=password)
+    def __init__(self, dsn:Optional[str]=None) -> None:
+        ########## Borrow connection to DB ##########
+        self.__dsn = PostgresPool.dsn('uniprot') if dsn is None else dsn
+        self.connection = PostgresPool.getconn(self.__dsn)
         self.cursor = self.connection.cursor()
         
         # Sourced from https://www.uniprot.org/help/api_queries
@@ -39,6 +36,13 @@ class UniProtDB(__ABCChemDB):
         
         self.__url = 'https://rest.uniprot.org/uniprotkb/search?fields=accession,protein_name,organism_name&format=json&query=(reviewed:true)&size=500'
         
+    def close(self) -> None:
+        """ Returns the connection to the pool. """
+        if self.connection is not None:
+            self.cursor.close()
+            PostgresPool.putconn(self.connection, self.__dsn)
+            self.connection = None
+        
     def build(self) -> None:
         # Clear table
         self.cursor.execute('DELETE FROM organism_uniprot')
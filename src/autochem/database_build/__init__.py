@@ -1,3 +1,13 @@
 from .__ABCChemDB import __ABCChemDB
 from .PubChemDB import PubChemDB
+from .PubChemFTP import PubChemFTP
 from .UniProtDB import UniProtDB
+
+
+def __getattr__(name:str):
+    """ Imports PubChemParquet on first use, so the package imports without pyarrow (autochem[parquet] extra). """
+    if name == 'PubChemParquet':
+        from .PubChemParquet import PubChemParquet
+        globals()[name] = PubChemParquet # replaces the submodule the import bound to the same name
+        return PubChemParquet
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
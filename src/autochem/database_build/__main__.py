@@ -0,0 +1,38 @@
+import argparse
+from typing import List, Optional
+from .PubChemDB import PubChemDB
+
+
+def main(argv:Optional[List[str]]=None) -> None:
+    """
+    Command line entry point of PubChemDB.build, run as autochem-build or python -m autochem.database_build.
+
+    :param argv: Command line arguments, defaults to sys.argv[1:]
+    :type argv: Optional[List[str]], optional
+    """
+    parser = argparse.ArgumentParser(prog='autochem-build',
+                                     description='Build the PubChem database from files downloaded with PubChemFTP.')
+    parser.add_argument('bioassay_json_dir_path', help='Directory of bioassay JSON zip archives')
+    parser.add_argument('substance_sdf_dir_path', help='Directory of substance .sdf.gz files')
+    parser.add_argument('protein2xrefs_path', help='protein2xrefs file of protein targets')
+    parser.add_argument('--stage', action='append', choices=PubChemDB.build_stages,
+                        help='Stage to run, can be given more than once, defaults to every stage')
+    parser.add_argument('--resume', action='store_true',
+                        help='Keep what earlier builds committed and skip input files already checkpointed')
+    parser.add_argument('--n-workers', type=int, default=1, help='Processes that parse input files')
+    parser.add_argument('--stream-json', action='store_true',
+                        help='Parse bioassay JSON incrementally so memory does not grow with the size of an assay')
+    parser.add_argument('--dsn', help='Connection string of the pubchem database, defaults to AUTOCHEM_PUBCHEM_DSN or '
+                                      'localhost, see PostgresPool.dsn')
+    args = parser.parse_args(argv)
+
+    pc_db = PubChemDB(args.bioassay_json_dir_path, args.substance_sdf_dir_path, args.protein2xrefs_path,
+                      dsn=args.dsn)
+    try:
+        pc_db.build(stages=args.stage, resume=args.resume, n_workers=args.n_workers, stream_json=args.stream_json)
+    finally:
+        pc_db.close()
+
+
+if __name__ == '__main__':
+    main()
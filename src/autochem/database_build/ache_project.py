@@ -1,6 +1,7 @@
 import requests
 import psycopg2
 import pandas as pd
+from autochem.PostgresPool import PostgresPool
 
 
 def get_ache_bche_assay_ids() -> dict:
@@ -21,12 +22,7 @@ if __name__ == '__main__':
     assay_ids = get_ache_bche_assay_ids()
     
     ########## Connect to DB ##########
-    host = 'localhost'
-    database = 'pubchem'
-    user = 'postgres'
-    password = 'Coll@bor@tions2020'
-    # port = '5432'
-    connection = psycopg2.connect(host=host, database=database, user=user, password=password)
+    connection = psycopg2.connect(PostgresPool.dsn('pubchem'))
     cursor = connection.cursor()
     
     dfs = []
@@ -41,10 +37,10 @@ if __name__ == '__main__':
         cursor.execute('''
             SELECT assay_data, smiles, bioassay_id
             FROM (
-                SELECT bioassay_id, json_array_elements(assay_data) AS assay_data,
-                json_array_elements(assay_data)->>'sid' AS sid
+                SELECT bioassay_id, entry AS assay_data, entry->>'sid' AS sid
                 FROM bioassay
                 JOIN temp_assay_ids ON bioassay_id = id
+                CROSS JOIN jsonb_array_elements(assay_data) AS entry
             ) AS extracted_sids
             JOIN substance ON sid::integer = substance_id
         ''')
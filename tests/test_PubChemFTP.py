@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+import pytest
+from autochem.database_build import PubChemFTP
+
+pyftpdlib = pytest.importorskip('pyftpdlib')
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+
+IDLE_TIMEOUT_SECONDS = 1 # the server drops control connections idle for longer
+
+
+def make_fixture_tree(root:str) -> None:
+    """ A miniature PubChem FTP tree with every directory download_all reads from. """
+    target_dir = os.path.join(root, 'pubchem', 'Target')
+    sdf_dir = os.path.join(root, 'pubchem', 'Substance', 'CURRENT-Full', 'SDF')
+    json_dir = os.path.join(root, 'pubchem', 'Bioassay', 'JSON')
+    for dir_path in [target_dir, sdf_dir, json_dir]:
+        os.makedirs(dir_path)
+
+    with open(os.path.join(target_dir, 'protein2xrefs.gz'), 'wb') as file:
+        file.write(gzip.compress(b'ProteinAccession\tGeneID\tRefSeq\tUniProt\nP00001\t1\tNP_1\tQ11111\n'))
+    with open(os.path.join(root, 'pubchem', 'Bioassay', 'pcassay2.asn'), 'wb') as file:
+        file.write(b'PC-AssayDescription ::= SEQUENCE {}\n')
+
+    for i in range(6):
+        name = f'Substance_{i * 25000 + 1:09d}_{(i + 1) * 25000:09d}'
+        sdf = gzip.compress(f'{i}\n  RDKit\n\n  0  0  0  0  0  0  0  0  0  0999 V2000\nM  END\n$$$$\n'.encode() * 50)
+        with open(os.path.join(sdf_dir, f'{name}.sdf.gz'), 'wb') as file:
+            file.write(sdf)
+        with open(os.path.join(sdf_dir, f'{name}.sdf.gz.md5'), 'w') as file:
+            file.write(f'{hashlib.md5(sdf).hexdigest()}  {name}.sdf.gz\n')
+    with open(os.path.join(sdf_dir, 'README'), 'w') as file:
+        file.write('Substance SDF files\n')
+
+    for i in range(6):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for aid in range(i * 1000 + 1, i * 1000 + 4):
+                zip_file.writestr(f'{i * 1000 + 1:07d}_{(i + 1) * 1000:07d}/{aid}.json.gz',
+                                  gzip.compress(json.dumps({'aid': aid}).encode() * 100))
+        with open(os.path.join(json_dir, f'{i * 1000 + 1:07d}_{(i + 1) * 1000:07d}.zip'), 'wb') as file:
+            file.write(buffer.getvalue())
+
+
+@pytest.fixture
+def ftp_server(tmp_path):
+    """ Serves the fixture tree with pyftpdlib on a free local port, yields (root, port). """
+    root = str(tmp_path / 'server')
+    make_fixture_tree(root)
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(root)
+    handler = type('Handler', (FTPHandler,), {'authorizer': authorizer, 'timeout': IDLE_TIMEOUT_SECONDS})
+    server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'timeout': 0.1}, daemon=True)
+    thread.start()
+    yield root, server.address[1]
+    server.close_all()
+    thread.join(5)
+
+
+def remote_files(root:str):
+    """ Paths of every file in the fixture tree relative to root. """
+    return sorted(os.path.relpath(os.path.join(dir_path, filename), root)
+                  for dir_path, _, filenames in os.walk(root) for filename in filenames)
+
+
+def assert_mirrored(server_root:str, out_dir:str) -> None:
+    for path in remote_files(server_root):
+        with open(os.path.join(server_root, path), 'rb') as remote, open(os.path.join(out_dir, path), 'rb') as local:
+            assert local.read() == remote.read(), path
+    assert os.listdir(os.path.join(out_dir, 'bad_files')) == []
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_download_all(ftp_server, tmp_path, n_workers):
+    server_root, port = ftp_server
+    out_dir = str(tmp_path / 'out')
+    pc_ftp = PubChemFTP(out_dir, ftp_host='127.0.0.1', ftp_port=port)
+    pc_ftp.download_all(n_workers=n_workers, verbose=False)
+    assert_mirrored(server_root, out_dir)
+
+
+def test_idle_main_session_reconnects(ftp_server, tmp_path):
+    """ The main session sits idle while workers download, the next stage must not run on the timed out session. """
+    server_root, port = ftp_server
+    out_dir = str(tmp_path / 'out')
+    pc_ftp = PubChemFTP(out_dir, ftp_host='127.0.0.1', ftp_port=port)
+    pc_ftp.download_substance_sdfs(n_workers=3, verbose=False)
+    time.sleep(IDLE_TIMEOUT_SECONDS * 3)
+    pc_ftp.download_bioassay_jsons(n_workers=3, verbose=False)
+    time.sleep(IDLE_TIMEOUT_SECONDS * 3)
+    pc_ftp.download_bioassay_asn_metadata(verbose=False)
+    time.sleep(IDLE_TIMEOUT_SECONDS * 3)
+    pc_ftp.download_protein_target_data(verbose=False)
+    assert_mirrored(server_root, out_dir)
+
+
+def test_sync_skips_unchanged_files(ftp_server, tmp_path):
+    server_root, port = ftp_server
+    out_dir = str(tmp_path / 'out')
+    PubChemFTP(out_dir, ftp_host='127.0.0.1', ftp_port=port).download_all(n_workers=2, verbose=False)
+
+    json_dir = os.path.join(out_dir, 'pubchem', 'Bioassay', 'JSON')
+    mtimes = {filename: os.stat(os.path.join(json_dir, filename)).st_mtime_ns for filename in os.listdir(json_dir)}
+    PubChemFTP(out_dir, sync=True, ftp_host='127.0.0.1', ftp_port=port).download_all(n_workers=2, verbose=False)
+    assert {filename: os.stat(os.path.join(json_dir, filename)).st_mtime_ns
+            for filename in os.listdir(json_dir)} == mtimes
+    assert_mirrored(server_root, out_dir)
@@ -0,0 +1,96 @@
+import hashlib
+import io
+import random
+import zipfile
+import pytest
+from autochem.database_build.TransferChecks import StreamingZipVerifier, TransferChecks
+
+
+class Unseekable(io.RawIOBase):
+    """ Write-only stream, makes zipfile write members with data descriptors. """
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.buffer.extend(data)
+        return len(data)
+
+
+def make_zip(compression:int, data_descriptors:bool=False, comment:bytes=b'') -> bytes:
+    rng = random.Random(0)
+    stream = Unseekable() if data_descriptors else io.BytesIO()
+    with zipfile.ZipFile(stream, 'w', compression) as zip_file:
+        for i in range(3):
+            zip_file.writestr(f'0000001_0001000/{i}.json.gz', bytes(rng.getrandbits(8) for _ in range(2000)) * 3)
+        zip_file.comment = comment
+    return bytes(stream.buffer) if data_descriptors else stream.getvalue()
+
+
+def zipfile_ok(data:bytes) -> bool:
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            return zip_file.testzip() is None
+    except (zipfile.BadZipFile, EOFError, OSError):
+        return False
+
+
+def streamed(data:bytes, chunk_size:int) -> bool:
+    verifier = StreamingZipVerifier()
+    for i in range(0, len(data), chunk_size):
+        verifier.update(data[i:i + chunk_size])
+    return verifier.result()
+
+
+ARCHIVES = {
+    'deflated': make_zip(zipfile.ZIP_DEFLATED),
+    'stored': make_zip(zipfile.ZIP_STORED),
+    'data descriptors': make_zip(zipfile.ZIP_DEFLATED, data_descriptors=True),
+    'comment': make_zip(zipfile.ZIP_DEFLATED, comment=b'AID range 1-1000'),
+}
+
+
+@pytest.mark.parametrize('name', ARCHIVES)
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096, 1 << 20])
+def test_intact_archive_passes(name, chunk_size):
+    assert streamed(ARCHIVES[name], chunk_size) is True
+
+
+@pytest.mark.parametrize('name', ARCHIVES)
+def test_truncated_archive_fails(name):
+    data = ARCHIVES[name]
+    comment_length = len(zipfile.ZipFile(io.BytesIO(data)).comment)
+    for n_missing in list(range(1, comment_length + 24)) + [len(data) // 2, len(data) - 10]:
+        truncated = data[:-n_missing]
+        if n_missing > comment_length: # zipfile only warns about a truncated comment
+            assert not zipfile_ok(truncated)
+        assert streamed(truncated, 4096) is False, n_missing
+
+
+def test_inconsistent_end_of_central_directory_fails():
+    data = bytearray(ARCHIVES['deflated'])
+    start = data.rfind(b'PK\x05\x06')
+    for field_offset in [8, 10, 12, 16]: # entries on disk, entries, central directory size and offset
+        corrupt = bytearray(data)
+        corrupt[start + field_offset] ^= 0x01
+        assert streamed(bytes(corrupt), 4096) is False, field_offset
+
+
+def test_corrupt_member_fails():
+    data = bytearray(ARCHIVES['stored'])
+    data[len(data) // 3] ^= 0xFF
+    assert not zipfile_ok(bytes(data))
+    assert streamed(bytes(data), 4096) is False
+
+
+def test_transfer_checks_md5_and_reset():
+    data = ARCHIVES['deflated']
+    checks = TransferChecks(verify_zip=True)
+    checks.update(data[:100])
+    checks.reset()
+    checks.update(data)
+    assert checks.zip_ok is True
+    assert checks.md5 == hashlib.md5(data).hexdigest()
+    assert TransferChecks().zip_ok is None